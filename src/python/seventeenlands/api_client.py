@@ -1,66 +1,340 @@
 import datetime
 import gzip
+import hashlib
+import itertools
 import json
-from typing import Any, Dict, Optional
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import requests
 
+import seventeenlands.clock_utils
 import seventeenlands.logging_utils
+import seventeenlands.records
 import seventeenlands.retry_utils
+import seventeenlands.scheduling_utils
+import seventeenlands.tracing
 
 
 logger = seventeenlands.logging_utils.get_logger('api_client')
 
 DEFAULT_HOST = 'https://api.17lands.com'
 
-_ERROR_COOLDOWN = datetime.timedelta(minutes=2)
+
+# Deadlines for establishing a connection and for each read from the socket
+_CONNECT_TIMEOUT = datetime.timedelta(seconds=10)
+_READ_TIMEOUT = datetime.timedelta(seconds=60)
+
+DEFAULT_MAX_REQUESTS_PER_SECOND = 10.0
+
+# Drafts, games and events are never dropped: once their class is full, the follower waits
+# for room. State is resent whenever it changes and errors are aggregated, so those drop their
+# oldest submissions instead.
+DEFAULT_PRIORITY_CLASSES = {
+    'draft': seventeenlands.scheduling_utils.PriorityClass(priority=0, requests_per_second=10.0, burst=20, max_pending=2000),
+    'game': seventeenlands.scheduling_utils.PriorityClass(priority=1, requests_per_second=5.0, burst=10, max_pending=500),
+    'event': seventeenlands.scheduling_utils.PriorityClass(priority=2, requests_per_second=2.0, burst=10, max_pending=500),
+    'state': seventeenlands.scheduling_utils.PriorityClass(priority=3, requests_per_second=1.0, burst=5, max_pending=200, drop_when_full=True),
+    'error': seventeenlands.scheduling_utils.PriorityClass(priority=4, requests_per_second=0.1, burst=1, max_pending=50, drop_when_full=True),
+}
+
+DEFAULT_ENDPOINT_PRIORITY_CLASSES = {
+    'api/client/add_pack': 'draft',
+    'api/client/add_pick': 'draft',
+    'api/client/add_human_draft_pack': 'draft',
+    'api/client/add_human_draft_pick': 'draft',
+    'api/client/add_game': 'game',
+    'api/client/add_deck': 'game',
+    'api/client/add_event': 'event',
+    'api/client/record_event_join': 'event',
+    'api/client/mark_event_ended': 'event',
+    'api/client/update_event_course': 'event',
+    'api/client/add_mtga_account': 'state',
+    'api/client/add_rank': 'state',
+    'api/client/update_card_collection': 'state',
+    'api/client/update_inventory': 'state',
+    'api/client/update_ongoing_events': 'state',
+    'api/client/update_player_progress': 'state',
+    'api/client/log_errors': 'error',
+}
+_FALLBACK_PRIORITY_CLASS = 'state'
+
+# Endpoints that receive full snapshots of account state. Only the newest snapshot per account
+# is sent, and it is skipped if it matches the last acknowledged one when it comes up.
+_SNAPSHOT_ENDPOINTS = {
+    'api/client/add_mtga_account',
+    'api/client/add_rank',
+    'api/client/update_inventory',
+    'api/client/update_ongoing_events',
+    'api/client/update_player_progress',
+}
+# Envelope fields that change with every submission and so don't count as a change in state
+_VOLATILE_FIELDS = {'token', 'client_version', 'time', 'utc_time', 'event_time', 'raw_time'}
+
+_REQUEST_LOG_LIMIT = 500
+_RESPONSE_LOG_LIMIT = 500
+
+
+def _get_timeout() -> Tuple[float, float]:
+    return (_CONNECT_TIMEOUT.total_seconds(), _READ_TIMEOUT.total_seconds())
+
+
+def _get_snapshot_hash(blob: Dict) -> str:
+    content = {k: v for k, v in blob.items() if k not in _VOLATILE_FIELDS}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf8')).hexdigest()
+
+
+class _Post:
+    """A POST to be sent, along with how it has been retried so far."""
+
+    __slots__ = (
+        '_attempt', 'endpoint', 'blob', 'use_gzip', 'body', 'priority_class', 'trace',
+        'args', 'backoff', 'snapshot_key', 'snapshot_hash', 'snapshot_sequence',
+    )
+
+    def __init__(
+        self,
+        attempt: Callable[['_Post'], None],
+        endpoint: str,
+        blob: Any,
+        use_gzip: bool,
+        body: Optional[bytes],
+        priority_class: str,
+        trace: Optional[seventeenlands.tracing.Trace],
+    ):
+        self._attempt = attempt
+        self.endpoint = endpoint
+        self.blob = blob
+        self.use_gzip = use_gzip
+        self.body = body
+        self.priority_class = priority_class
+        self.trace = trace
+        # Built on the first attempt
+        self.args: Optional[Dict[str, Any]] = None
+        self.backoff: Optional[seventeenlands.retry_utils.Backoff] = None
+        # Set for account snapshots, which are skipped if they match the last acknowledged one
+        self.snapshot_key: Optional[Tuple[str, Any]] = None
+        self.snapshot_hash: Optional[str] = None
+        # Orders snapshots with the same key, so an older one is never sent after a newer one
+        self.snapshot_sequence: Optional[int] = None
+
+    def __call__(self):
+        self._attempt(self)
 
 
 class ApiClient:
 
-    def __init__(self, host: str):
+    def __init__(
+        self,
+        host: str,
+        priority_classes: Optional[Dict[str, seventeenlands.scheduling_utils.PriorityClass]] = None,
+        endpoint_priority_classes: Optional[Dict[str, str]] = None,
+        max_requests_per_second: float = DEFAULT_MAX_REQUESTS_PER_SECOND,
+        clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
+        send_post: Optional[Callable[..., requests.Response]] = None,
+    ):
+        """
+        :param host:                      Host to send requests to.
+        :param priority_classes:          Overrides for DEFAULT_PRIORITY_CLASSES.
+        :param endpoint_priority_classes: Overrides for DEFAULT_ENDPOINT_PRIORITY_CLASSES.
+        :param max_requests_per_second:   Ceiling on submissions per second to the host.
+        :param clock:                     Clock for retry delays, rate limits and the host's circuit.
+        :param send_post:                 Sends a POST, taking the arguments of requests.post.
+                                          Replaced to record submissions (e.g. in replays).
+        """
         self.host = host
-        self._last_error_posted_at = datetime.datetime.utcnow() - _ERROR_COOLDOWN
+        self._clock = clock
+        self._send_post = requests.post if send_post is None else send_post
+        self._circuit_breaker = seventeenlands.retry_utils.get_circuit_breaker(host, clock)
+        self._endpoint_priority_classes = {
+            **DEFAULT_ENDPOINT_PRIORITY_CLASSES,
+            **(endpoint_priority_classes or {}),
+        }
+        self._acknowledged_snapshot_hashes: Dict[Tuple[str, Any], str] = {}
+        self._latest_snapshot_sequences: Dict[Tuple[str, Any], int] = {}
+        self._snapshot_sequence = itertools.count()
+        self._snapshots_lock = threading.Lock()
+        self._scheduler = seventeenlands.scheduling_utils.PriorityScheduler(
+            name=f'submissions to {host}',
+            priority_classes={**DEFAULT_PRIORITY_CLASSES, **(priority_classes or {})},
+            max_requests_per_second=max_requests_per_second,
+            on_discard=self._discard_post,
+            # Hold every submission while the host's circuit is open, rather than trying each
+            gate=self._circuit_breaker.get_wait_time,
+            clock=clock,
+        )
 
-    def _retry_post(self, endpoint: str, blob: Any, use_gzip=False):
-        def _send_request() -> requests.Response:
-            args: Dict[str, Any] = {
-                "url": f'{self.host}/{endpoint}',
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all queued submissions have been sent."""
+        return self._scheduler.flush(timeout=timeout)
+
+    def _enqueue_post(self, endpoint: str, blob: Any, use_gzip=False, body: Optional[bytes] = None):
+        """
+        Queue a POST to be sent (with retries) according to the endpoint's priority class.
+
+        :param body: The blob already serialized as JSON, if the caller has it.
+        """
+        priority_class = self._endpoint_priority_classes.get(endpoint, _FALLBACK_PRIORITY_CLASS)
+        # The trace of the event being submitted, if it is sampled, is finished once it is sent
+        trace = seventeenlands.tracing.get_active_trace()
+        post = _Post(self._attempt_post, endpoint, blob, use_gzip, body, priority_class, trace)
+        if endpoint in _SNAPSHOT_ENDPOINTS:
+            self._enqueue_snapshot_post(post)
+            return
+
+        if trace is not None:
+            trace.stamp(seventeenlands.tracing.ENQUEUED)
+            trace.awaits_acknowledgement = True
+        self._scheduler.submit(priority_class=priority_class, callback=post)
+
+    def _enqueue_snapshot_post(self, post: '_Post'):
+        # Whether the snapshot is unchanged is only decided when it is sent, since a snapshot
+        # pending now may yet be replaced by one matching the last acknowledged snapshot
+        post.snapshot_key = (post.endpoint, post.blob.get('player_id'))
+        post.snapshot_hash = _get_snapshot_hash(post.blob)
+        if post.trace is not None:
+            post.trace.stamp(seventeenlands.tracing.ENQUEUED)
+            post.trace.awaits_acknowledgement = True
+
+        with self._snapshots_lock:
+            post.snapshot_sequence = next(self._snapshot_sequence)
+            self._latest_snapshot_sequences[post.snapshot_key] = post.snapshot_sequence
+            is_new = self._scheduler.submit(
+                priority_class=post.priority_class,
+                callback=post,
+                coalesce_key=post.snapshot_key,
+            )
+        if not is_new:
+            logger.debug('Replaced pending %s snapshot for %s with a newer one', post.endpoint, post.snapshot_key[1])
+
+    def _get_snapshot_skip_reason(self, post: '_Post') -> Optional[str]:
+        """Why the snapshot should not be sent, if it should not. Called with the snapshots lock held."""
+        if self._latest_snapshot_sequences.get(post.snapshot_key) != post.snapshot_sequence:
+            return 'superseded'
+        if self._acknowledged_snapshot_hashes.get(post.snapshot_key) == post.snapshot_hash:
+            return 'unchanged'
+        return None
+
+    def _get_post_args(self, post: '_Post') -> Dict[str, Any]:
+        args: Dict[str, Any] = {
+            "url": f'{self.host}/{post.endpoint}',
+            "timeout": _get_timeout(),
+        }
+
+        if post.use_gzip:
+            args["data"] = gzip.compress(post.body if post.body is not None else seventeenlands.records.serialize(post.blob))
+            args["headers"] = {
+                "content-type": "application/json",
+                "content-encoding": "gzip",
             }
+        elif post.body is not None:
+            args["data"] = post.body
+            args["headers"] = {
+                "content-type": "application/json",
+            }
+        else:
+            args["json"] = post.blob
+        return args
+
+    def _attempt_post(self, post: '_Post'):
+        """
+        Send a POST once. If it fails in a way worth retrying, it is scheduled again after a
+        backoff delay, so the worker carries on with other submissions in the meantime.
+        """
+        if post.args is None:
+            post.args = self._get_post_args(post)
+            post.backoff = seventeenlands.retry_utils.Backoff(clock=self._clock)
+
+        if post.snapshot_key is not None:
+            with self._snapshots_lock:
+                skip_reason = self._get_snapshot_skip_reason(post)
+            if skip_reason is not None:
+                logger.debug('Skipping %s %s snapshot for %s', skip_reason, post.endpoint, post.snapshot_key[1])
+                self._finish_post(post, response=None)
+                return
+
+        if not self._circuit_breaker.wait_until_allowed(timeout=0):
+            # Another submission is probing whether the host has recovered
+            self._schedule_retry(post, delay=self._circuit_breaker.get_wait_time())
+            return
 
-            if use_gzip:
-                args["data"] = gzip.compress(json.dumps(blob).encode('utf8'))
-                args["headers"] = {
-                    "content-type": "application/json",
-                    "content-encoding": "gzip",
-                }
+        logger.debug('Sending POST request: %s', seventeenlands.logging_utils.abbreviate(post.args, _REQUEST_LOG_LIMIT))
+        if post.trace is not None:
+            post.trace.stamp(seventeenlands.tracing.SENT)
+        try:
+            response = self._send_post(**post.args)
+        except Exception as e:
+            logger.exception(f'Error: {e}')
+            if seventeenlands.retry_utils.is_retryable_api_error(e):
+                self._circuit_breaker.record_failure()
+                self._schedule_retry(post)
             else:
-                args["json"] = blob
+                self._circuit_breaker.release()
+                self._finish_post(post, response=None)
+            return
 
-            logger.debug(f'Sending POST request: {args}')
-            return requests.post(**args)
+        logger.debug('%s -> %s Response: %s', post.endpoint, response.status_code, seventeenlands.logging_utils.defer(lambda: response.text, _RESPONSE_LOG_LIMIT))
+        if 500 <= response.status_code < 600:
+            self._circuit_breaker.record_failure()
+            self._schedule_retry(post)
+            return
 
-        def _validate_response(response: requests.Response) -> bool:
-            logger.debug(f'{endpoint} -> {response.status_code} Response: {response.text}')
-            return response.status_code < 500 or response.status_code >= 600
+        self._circuit_breaker.record_success()
+        self._finish_post(post, response=response)
 
-        return seventeenlands.retry_utils.retry_api_call(
-            callback=_send_request,
-            response_validator=_validate_response,
-        )
+    def _schedule_retry(self, post: '_Post', delay: Optional[float] = None):
+        if post.backoff.is_exhausted():
+            logger.warning(f'Giving up on POST to {post.endpoint}: out of retries')
+            self._finish_post(post, response=None)
+            return
+        delay = post.backoff.next_delay() if delay is None else delay
+        if post.snapshot_key is None:
+            self._scheduler.submit(priority_class=post.priority_class, callback=post, delay=delay)
+            return
+
+        # A snapshot's retry is coalesced like the snapshot was, so a newer snapshot replaces it.
+        # If a newer one is already queued or sent, the retry is not needed at all.
+        with self._snapshots_lock:
+            if self._latest_snapshot_sequences.get(post.snapshot_key) == post.snapshot_sequence:
+                self._scheduler.submit(
+                    priority_class=post.priority_class,
+                    callback=post,
+                    coalesce_key=post.snapshot_key,
+                    delay=delay,
+                )
+                return
+        logger.debug('Not retrying %s snapshot for %s, which a newer one superseded', post.endpoint, post.snapshot_key[1])
+        self._finish_post(post, response=None)
+
+    def _finish_post(self, post: '_Post', response: Optional[requests.Response]):
+        is_acknowledged = response is not None and response.status_code < 400
+        if is_acknowledged and post.snapshot_key is not None:
+            with self._snapshots_lock:
+                self._acknowledged_snapshot_hashes[post.snapshot_key] = post.snapshot_hash
+        if post.trace is not None:
+            if is_acknowledged:
+                post.trace.stamp(seventeenlands.tracing.ACKNOWLEDGED)
+            post.trace.finish()
+
+    def _discard_post(self, post: '_Post'):
+        """Clean up after a submission the scheduler dropped or replaced without sending."""
+        if post.trace is not None:
+            post.trace.finish()
 
     def _retry_get(self, endpoint, params):
         def _send_request() -> requests.Response:
-            logger.debug(f'Sending GET to {self.host}/{endpoint}: {params}')
-            return requests.get(f'{self.host}/{endpoint}', params=params)
+            logger.debug('Sending GET to %s/%s: %s', self.host, endpoint, params)
+            return requests.get(f'{self.host}/{endpoint}', params=params, timeout=_get_timeout())
 
         def _validate_response(response: requests.Response) -> bool:
-            logger.debug(f'{response.status_code} Response: {response.text}')
+            logger.debug('%s Response: %s', response.status_code, seventeenlands.logging_utils.defer(lambda: response.text, _RESPONSE_LOG_LIMIT))
             return response.status_code < 500 or response.status_code >= 600
 
         return seventeenlands.retry_utils.retry_api_call(
             callback=_send_request,
             response_validator=_validate_response,
+            circuit_breaker=self._circuit_breaker,
+            clock=self._clock,
         )
 
     def get_client_version_info(self, params: Dict):
@@ -69,112 +343,123 @@ class ApiClient:
             params=params,
         )
 
-    def submit_collection(self, blob: Dict):
-        return self._retry_post(
+    def submit_collection(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/update_card_collection",  # Formerly /collection
             blob=blob,
+            body=body,
         )
 
-    def submit_deck_submission(self, blob: Dict):
-        return self._retry_post(
+    def submit_deck_submission(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_deck",  # Formerly /deck
             blob=blob,
+            body=body,
         )
 
-    def submit_draft_pack(self, blob: Dict):
-        return self._retry_post(
+    def submit_draft_pack(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_pack",  # Formerly /pack
             blob=blob,
+            body=body,
         )
 
-    def submit_draft_pick(self, blob: Dict):
-        return self._retry_post(
+    def submit_draft_pick(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_pick",  # Formerly /pick
             blob=blob,
+            body=body,
         )
 
-    def submit_event_course_submission(self, blob: Dict):
-        return self._retry_post(
+    def submit_event_course_submission(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/update_event_course",  # Formerly /event_course
             blob=blob,
+            body=body,
         )
 
-    def submit_joined_event(self, blob: Dict):
-        return self._retry_post(
+    def submit_joined_event(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/record_event_join",
             blob=blob,
+            body=body,
         )
 
-    def submit_event_ended(self, blob: Dict):
-        return self._retry_post(
+    def submit_event_ended(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/mark_event_ended",  # Formerly /event_ended
             blob=blob,
+            body=body,
         )
 
-    def submit_event_submission(self, blob: Dict):
-        return self._retry_post(
+    def submit_event_submission(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_event",  # Formerly /event
             blob=blob,
+            body=body,
         )
 
-    def submit_game_result(self, blob: Dict):
-        return self._retry_post(
+    def submit_game_result(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_game",  # Formerly /game
             blob=blob,
+            body=body,
             use_gzip=True,
         )
 
-    def submit_human_draft_pack(self, blob: Dict):
-        return self._retry_post(
+    def submit_human_draft_pack(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_human_draft_pack",  # Formerly /human_draft_pack
             blob=blob,
+            body=body,
         )
 
-    def submit_human_draft_pick(self, blob: Dict):
-        return self._retry_post(
+    def submit_human_draft_pick(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_human_draft_pick",  # Formerly /human_draft_pick
             blob=blob,
+            body=body,
         )
 
-    def submit_inventory(self, blob: Dict):
-        return self._retry_post(
+    def submit_inventory(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/update_inventory",  # Formerly /inventory
             blob=blob,
+            body=body,
         )
 
-    def submit_ongoing_events(self, blob: Dict):
-        return self._retry_post(
+    def submit_ongoing_events(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/update_ongoing_events",  # Formerly /ongoing_events
             blob=blob,
+            body=body,
         )
 
-    def submit_player_progress(self, blob: Dict):
-        return self._retry_post(
+    def submit_player_progress(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/update_player_progress",  # Formerly /player_progress
             blob=blob,
+            body=body,
         )
 
-    def submit_rank(self, blob: Dict):
-        return self._retry_post(
+    def submit_rank(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_rank",  # Formerly /api/rank
             blob=blob,
+            body=body,
         )
 
-    def submit_user(self, blob: Dict):
-        return self._retry_post(
+    def submit_user(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/add_mtga_account",  # Formerly /api/account
             blob=blob,
+            body=body,
         )
 
-    def submit_error_info(self, blob: Dict):
-        now = datetime.datetime.utcnow()
-        if self._last_error_posted_at > now - _ERROR_COOLDOWN:
-            logger.warning(f'Waiting to post another error; last message was sent too recently ({self._last_error_posted_at.isoformat()})')
-            return
-
-        self._last_error_posted_at = now
-        return self._retry_post(
+    def submit_error_info(self, blob: Dict, body: Optional[bytes] = None):
+        return self._enqueue_post(
             endpoint="api/client/log_errors",  # Formerly /api/client_errors
             blob=blob,
+            body=body,
             use_gzip=True,
         )
@@ -0,0 +1,62 @@
+import threading
+import time
+from typing import Callable, List
+
+
+class Clock:
+    """Source of time for the follower and retries. Replaced with a VirtualClock in replays."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        """Time for measuring intervals, which never goes backwards."""
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def wait(self, condition: threading.Condition, timeout: float):
+        """
+        Wait on a condition the caller holds, until it is notified or `timeout` seconds of this
+        clock's time have passed.
+        """
+        condition.wait(timeout=timeout)
+
+
+SYSTEM_CLOCK = Clock()
+
+
+class VirtualClock(Clock):
+    """
+    A clock that only moves when something sleeps on it. Sleeping advances the time
+    immediately and then notifies listeners, which lets a driver (e.g. a log replay) inject
+    whatever should have happened during the sleep.
+    """
+
+    def __init__(self, start_time: float):
+        self._now = start_time
+        self._listeners: List[Callable[[float], None]] = []
+
+    def add_listener(self, listener: Callable[[float], None]):
+        self._listeners.append(listener)
+
+    def time(self) -> float:
+        return self._now
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float):
+        self._now += max(seconds, 0)
+        for listener in self._listeners:
+            listener(self._now)
+
+    def wait(self, condition: threading.Condition, timeout: float):
+        # Virtual time only moves when something sleeps, so waiting sleeps out the timeout,
+        # letting the listeners act on (and possibly notify) what is being waited for
+        condition.release()
+        try:
+            self.sleep(timeout)
+        finally:
+            condition.acquire()
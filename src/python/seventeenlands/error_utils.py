@@ -0,0 +1,152 @@
+"""
+Local aggregation of errors, so an error storm costs one sample per distinct error rather
+than one report per occurrence.
+
+Errors are fingerprinted by the handler that caught them, the exception type and the
+innermost frame that raised it. The first occurrence of each fingerprint keeps a sample
+(message, stack trace, truncated entry and recent lines); later occurrences only bump its
+count. The aggregates are taken in batches to be uploaded periodically.
+"""
+
+import hashlib
+import os
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# How long errors are aggregated before a batch is due
+DEFAULT_BATCH_INTERVAL_SECONDS = 5 * 60.0
+# How much of the entry being handled is kept with a sample
+DEFAULT_SAMPLE_BLOB_SIZE = 10 * 1024
+# Beyond this many distinct errors in a batch, further ones are only counted
+_MAX_FINGERPRINTS = 100
+
+
+def get_error_site(error: BaseException) -> str:
+    """The innermost frame of an exception's traceback, as 'file:line:function'."""
+    tb = error.__traceback__
+    if tb is None:
+        return ''
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    code = tb.tb_frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{tb.tb_lineno}:{code.co_name}'
+
+
+def get_fingerprint(handler: str, error: BaseException) -> str:
+    key = f'{handler}|{type(error).__name__}|{get_error_site(error)}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+class ErrorAggregate:
+    """Count and representative sample of one distinct error."""
+
+    __slots__ = ('fingerprint', 'handler', 'error_type', 'site', 'count', 'first_time', 'last_time', 'sample')
+
+    def __init__(self, fingerprint: str, handler: str, error: BaseException, now: float, sample: Dict[str, Any]):
+        self.fingerprint = fingerprint
+        self.handler = handler
+        self.error_type = type(error).__name__
+        self.site = get_error_site(error)
+        self.count = 0
+        self.first_time = now
+        self.last_time = now
+        self.sample = sample
+
+    def to_blob(self) -> Dict[str, Any]:
+        return {
+            'fingerprint': self.fingerprint,
+            'handler': self.handler,
+            'error_type': self.error_type,
+            'site': self.site,
+            'count': self.count,
+            'first_time': self.first_time,
+            'last_time': self.last_time,
+            **self.sample,
+        }
+
+
+class ErrorAggregator:
+    """
+    Collects errors between uploads.
+
+    :param batch_interval: Seconds between batches, measured from the last batch taken.
+    :param sample_blob_size: Bytes of the entry being handled kept with each sample.
+    """
+
+    def __init__(
+        self,
+        batch_interval: float = DEFAULT_BATCH_INTERVAL_SECONDS,
+        sample_blob_size: int = DEFAULT_SAMPLE_BLOB_SIZE,
+    ):
+        self._batch_interval = batch_interval
+        self._sample_blob_size = sample_blob_size
+        self._aggregates: Dict[str, ErrorAggregate] = {}
+        self._dropped_count = 0
+        self._last_batch_time: Optional[float] = None
+
+    def __len__(self):
+        return len(self._aggregates)
+
+    def record(
+        self,
+        handler: str,
+        error: BaseException,
+        message: str,
+        now: float,
+        get_blob: Callable[[int], str],
+        get_recent_lines: Callable[[], Iterable[str]],
+    ):
+        """
+        Count an occurrence of an error. The sample is only built for a new fingerprint.
+
+        :param handler:          Name of the function that caught the error.
+        :param now:              Current time, in seconds since the epoch.
+        :param get_blob:         Returns up to the given number of bytes of the entry being handled.
+        :param get_recent_lines: Returns previews of the most recently read lines.
+        """
+        fingerprint = get_fingerprint(handler, error)
+        aggregate = self._aggregates.get(fingerprint)
+        if aggregate is None:
+            if len(self._aggregates) >= _MAX_FINGERPRINTS:
+                self._dropped_count += 1
+                return
+            sample = {
+                'message': message,
+                'blob': get_blob(self._sample_blob_size),
+                'recent_lines': list(get_recent_lines()),
+                'stacktrace': ''.join(traceback.format_exception(type(error), error, error.__traceback__)),
+            }
+            aggregate = ErrorAggregate(fingerprint, handler, error, now, sample)
+            self._aggregates[fingerprint] = aggregate
+        aggregate.count += 1
+        aggregate.last_time = now
+
+    def is_batch_due(self, now: float) -> bool:
+        if not self._aggregates and not self._dropped_count:
+            return False
+        return self._last_batch_time is None or now - self._last_batch_time >= self._batch_interval
+
+    def take_batch(self, now: float) -> Optional[Dict[str, Any]]:
+        """
+        Take the errors collected so far, or None if there are none.
+
+        The top-level blob, recent lines and stack trace are those of the most frequent error,
+        so the batch is also a valid single error report.
+        """
+        self._last_batch_time = now
+        if not self._aggregates and not self._dropped_count:
+            return None
+
+        aggregates: List[ErrorAggregate] = sorted(self._aggregates.values(), key=lambda a: a.count, reverse=True)
+        dropped_count = self._dropped_count
+        self._aggregates = {}
+        self._dropped_count = 0
+
+        top_sample = aggregates[0].sample if aggregates else {}
+        return {
+            'blob': top_sample.get('blob', ''),
+            'recent_lines': top_sample.get('recent_lines', []),
+            'stacktrace': top_sample.get('stacktrace', ''),
+            'errors': [aggregate.to_blob() for aggregate in aggregates],
+            'dropped_error_count': dropped_count,
+        }
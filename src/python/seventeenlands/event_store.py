@@ -0,0 +1,245 @@
+"""
+Local SQLite store of every event the follower produces.
+
+Events are indexed by player, event name, draft and match, so questions like "all games in
+an event" or "every pick in a draft" can be answered without reparsing logs. The store can
+also be used as the source to re-upload events.
+
+Usage: python -m seventeenlands.event_store [--kind KIND] [--event_name NAME] ...
+           [--start_time TIME] [--end_time TIME] [--reupload]
+"""
+
+import argparse
+import datetime
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Any, Iterator, List, Optional, Tuple
+
+import dateutil.parser
+
+import seventeenlands.api_client
+import seventeenlands.logging_utils
+import seventeenlands.sinks
+
+logger = seventeenlands.logging_utils.get_logger('event_store')
+
+DEFAULT_FILENAME = os.path.join(seventeenlands.logging_utils.get_log_folder(), 'events.sqlite3')
+
+# Pending events are written in a single transaction once there are this many...
+_BATCH_SIZE = 100
+# ...or once the oldest pending event has waited this long, even if no more events arrive
+_MAX_BATCH_DELAY_SECONDS = 5.0
+# Blobs of these kinds carry full game histories and are stored zlib-compressed
+_COMPRESSED_KINDS = frozenset(('game_result', 'error_info'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    player_id TEXT,
+    event_name TEXT,
+    draft_id TEXT,
+    match_id TEXT,
+    time TEXT,
+    compressed INTEGER NOT NULL,
+    blob BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_player_id ON events (player_id, kind);
+CREATE INDEX IF NOT EXISTS events_event_name ON events (event_name, kind);
+CREATE INDEX IF NOT EXISTS events_draft_id ON events (draft_id, kind);
+CREATE INDEX IF NOT EXISTS events_match_id ON events (match_id, kind);
+"""
+
+_FILTER_COLUMNS = ('kind', 'player_id', 'event_name', 'draft_id', 'match_id')
+
+
+def _get_row(event: seventeenlands.sinks.Event) -> Tuple[Any, ...]:
+    blob = event.blob
+    data = event.serialize()
+    compressed = event.kind in _COMPRESSED_KINDS
+    if compressed:
+        data = zlib.compress(data)
+    return (
+        event.kind,
+        blob.get('player_id'),
+        blob.get('event_name'),
+        blob.get('draft_id'),
+        blob.get('match_id'),
+        blob.get('time'),
+        int(compressed),
+        data,
+    )
+
+
+class EventStore(seventeenlands.sinks.Sink):
+    """
+    A sink that persists events to SQLite, batching writes into transactions.
+
+    :param filename: Path of the database, created if it does not exist.
+    """
+
+    def __init__(self, filename: str = DEFAULT_FILENAME):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = sqlite3.connect(filename, check_same_thread=False)
+        # WAL lets queries run while a follower is writing
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(_SCHEMA)
+        self._pending: List[Tuple[Any, ...]] = []
+        # Started with the first pending event, to write the batch once it has waited long enough
+        self._flush_timer: Optional[threading.Timer] = None
+
+    def emit(self, event: seventeenlands.sinks.Event):
+        with self._lock:
+            self._pending.append(_get_row(event))
+            if len(self._pending) >= _BATCH_SIZE:
+                self._write_pending()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(_MAX_BATCH_DELAY_SECONDS, self._flush_on_timer)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception(f'Error writing pending events to {self.filename}')
+
+    def _write_pending(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._pending:
+            return
+        if self._connection is None:
+            raise ValueError(f'{self.filename} is already closed')
+        with self._connection:
+            self._connection.executemany(
+                'INSERT INTO events (kind, player_id, event_name, draft_id, match_id, time, compressed, blob) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                self._pending,
+            )
+        self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+
+    def close(self):
+        with self._lock:
+            self._write_pending()
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def get_events(
+        self,
+        kind: Optional[str] = None,
+        player_id: Optional[str] = None,
+        event_name: Optional[str] = None,
+        draft_id: Optional[str] = None,
+        match_id: Optional[str] = None,
+        start_time: Optional[datetime.datetime] = None,
+        end_time: Optional[datetime.datetime] = None,
+    ) -> Iterator[seventeenlands.sinks.Event]:
+        """
+        Iterate over the stored events matching every given filter, in the order they were stored.
+
+        :param start_time: Only include events logged at or after this (local) time.
+        :param end_time:   Only include events logged at or before this (local) time.
+        """
+        filters = dict(kind=kind, player_id=player_id, event_name=event_name, draft_id=draft_id, match_id=match_id)
+        conditions = [f'{column} = ?' for column in _FILTER_COLUMNS if filters[column] is not None]
+        params: List[Any] = [filters[column] for column in _FILTER_COLUMNS if filters[column] is not None]
+        # Times are stored in ISO format, which sorts in time order
+        if start_time is not None:
+            conditions.append('time >= ?')
+            params.append(start_time.isoformat())
+        if end_time is not None:
+            conditions.append('time <= ?')
+            params.append(end_time.isoformat())
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        self.flush()
+        # Queries read through their own connection, as the flush timer may be writing through
+        # the store's connection at any time. WAL gives each query a consistent view.
+        connection = sqlite3.connect(self.filename)
+        try:
+            rows = connection.execute(f'SELECT kind, compressed, blob FROM events {where} ORDER BY id', params)
+            for row_kind, compressed, data in rows:
+                if compressed:
+                    data = zlib.decompress(data)
+                yield seventeenlands.sinks.Event.from_serialized(row_kind, data)
+        finally:
+            connection.close()
+
+    def get_games(self, event_name: str, player_id: Optional[str] = None) -> List[seventeenlands.sinks.Event]:
+        return list(self.get_events(kind='game_result', event_name=event_name, player_id=player_id))
+
+    def get_draft_picks(self, draft_id: str) -> List[seventeenlands.sinks.Event]:
+        """
+        Picks made in a human draft. Bot draft events carry no draft id, so their picks are
+        found by event and time with get_bot_draft_picks.
+        """
+        return list(self.get_events(kind='human_draft_pick', draft_id=draft_id))
+
+    def get_bot_draft_picks(
+        self,
+        event_name: str,
+        start_time: Optional[datetime.datetime] = None,
+        end_time: Optional[datetime.datetime] = None,
+    ) -> List[seventeenlands.sinks.Event]:
+        """Picks made in bot drafts of an event, optionally only those made between two times."""
+        return list(self.get_events(kind='draft_pick', event_name=event_name, start_time=start_time, end_time=end_time))
+
+    def reupload(self, sink: seventeenlands.sinks.Sink, **filters) -> int:
+        """
+        Send stored events to another sink, e.g. an ApiSink to re-upload them.
+
+        :returns: The number of events sent.
+        """
+        count = 0
+        for event in self.get_events(**filters):
+            sink.emit(event)
+            count += 1
+        sink.flush()
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query or re-upload events from the local event store')
+    parser.add_argument('--database', default=DEFAULT_FILENAME,
+        help=f'Event store to read. If not specified, will use {DEFAULT_FILENAME}')
+    for column in _FILTER_COLUMNS:
+        parser.add_argument(f'--{column}', help=f'Only include events with this {column}')
+    parser.add_argument('--start_time', type=dateutil.parser.parse,
+        help='Only include events logged from this (local) time on')
+    parser.add_argument('--end_time', type=dateutil.parser.parse,
+        help='Only include events logged up to this (local) time')
+    parser.add_argument('--reupload', action='store_true',
+        help='Submit the matching events to the host instead of listing them')
+    parser.add_argument('--host', default=seventeenlands.api_client.DEFAULT_HOST,
+        help=f'Host to re-upload to. If not specified, will use {seventeenlands.api_client.DEFAULT_HOST}')
+
+    args = parser.parse_args()
+    filters = {column: getattr(args, column) for column in _FILTER_COLUMNS}
+    filters.update(start_time=args.start_time, end_time=args.end_time)
+
+    store = EventStore(args.database)
+    if args.reupload:
+        sink = seventeenlands.sinks.ApiSink(seventeenlands.api_client.ApiClient(host=args.host))
+        count = store.reupload(sink, **filters)
+        print(f'Re-uploaded {count} events to {args.host}')
+    else:
+        for event in store.get_events(**filters):
+            blob = event.blob
+            print(f'{event.kind:<25} {blob.get("time")} {blob.get("event_name")} {blob.get("draft_id") or blob.get("match_id") or ""}')
+
+    store.close()
+    seventeenlands.logging_utils.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import enum
+import hashlib
+import os
+from typing import BinaryIO, Optional, Union
+
+# How much of the start of a file is used to recognize it
+_FINGERPRINT_SIZE = 4096
+# How much of a file LineReader reads at a time
+_READ_CHUNK_SIZE = 1024 * 1024
+
+
+class FileChange(enum.Enum):
+    UNCHANGED = 'unchanged'
+    """Same file, possibly with more data appended."""
+    REPLACED = 'replaced'
+    """A different file now exists at the path (e.g. after the log was rotated)."""
+    TRUNCATED = 'truncated'
+    """Same file, but it was truncated or rewritten from the start."""
+    MISSING = 'missing'
+    """Nothing exists at the path (e.g. in the middle of a rotation)."""
+
+
+def read_at(f: BinaryIO, offset: int, size: int) -> bytes:
+    """Read part of a file without moving its position."""
+    position = f.tell()
+    try:
+        f.seek(offset)
+        return f.read(size)
+    finally:
+        f.seek(position)
+
+
+def _read_head(f: BinaryIO, size: int) -> bytes:
+    return read_at(f, 0, size)
+
+
+def _get_creation_time(stat: os.stat_result) -> Optional[float]:
+    birth_time = getattr(stat, 'st_birthtime', None)
+    if birth_time is not None:
+        return birth_time
+    # Only Windows reports the creation time as st_ctime; elsewhere it is the last metadata change
+    return stat.st_ctime if os.name == 'nt' else None
+
+
+class FileIdentity:
+    """
+    Identifies an open log file by device/inode and a fingerprint of its first bytes, to tell
+    whether the file at its path is still the same file.
+
+    The fingerprint covers up to the first 4KB. While the file is shorter than that, it is
+    extended as the file grows.
+    """
+
+    def __init__(self, f: BinaryIO):
+        stat = os.fstat(f.fileno())
+        self.device = stat.st_dev
+        self.inode = stat.st_ino
+        self.creation_time = _get_creation_time(stat)
+        self._head_size = 0
+        self._head_hash = b''
+        self._last_mtime = None
+        self._last_size = None
+        self._update_head(f)
+
+    def _update_head(self, f: BinaryIO):
+        head = _read_head(f, _FINGERPRINT_SIZE)
+        self._head_size = len(head)
+        self._head_hash = hashlib.sha1(head).digest()
+
+    def _head_matches(self, f: BinaryIO) -> bool:
+        head = _read_head(f, self._head_size)
+        return len(head) == self._head_size and hashlib.sha1(head).digest() == self._head_hash
+
+    def get_fingerprint(self) -> Optional[str]:
+        """A stable identifier for the file's contents, once the file is long enough to have one."""
+        if self._head_size < _FINGERPRINT_SIZE:
+            return None
+        return self._head_hash.hex()
+
+    def get_index_key(self) -> Optional[str]:
+        """
+        Names the file's index: its fingerprint along with its inode and creation time (where
+        the platform has them), so that a new file starting with the same bytes gets a new index.
+        """
+        fingerprint = self.get_fingerprint()
+        if fingerprint is None:
+            return None
+        return f'{fingerprint}-{self.inode}-{int(self.creation_time or 0)}'
+
+    def check(self, path: str, f: BinaryIO) -> FileChange:
+        """
+        Compare the file at `path` with the open file `f` this identity was created from.
+
+        :param path: The path the file was opened from.
+        :param f:    The open file, positioned at the next byte to read.
+        """
+        try:
+            path_stat = os.stat(path)
+        except FileNotFoundError:
+            return FileChange.MISSING
+
+        # Inode numbers are unavailable (0) on some filesystems; the fingerprint still applies there
+        if self.inode and (path_stat.st_dev, path_stat.st_ino) != (self.device, self.inode):
+            return FileChange.REPLACED
+
+        size = os.fstat(f.fileno()).st_size
+        if size < f.tell():
+            return FileChange.TRUNCATED
+
+        # Only reread the head when the file has been written to since the last check
+        if (path_stat.st_mtime, size) == (self._last_mtime, self._last_size):
+            return FileChange.UNCHANGED
+        self._last_mtime = path_stat.st_mtime
+        self._last_size = size
+
+        if not self._head_matches(f):
+            return FileChange.REPLACED if not self.inode else FileChange.TRUNCATED
+        if self._head_size < _FINGERPRINT_SIZE:
+            self._update_head(f)
+        return FileChange.UNCHANGED
+
+
+def decode_text(data: Union[bytes, bytearray, memoryview]) -> str:
+    """
+    Decode text read in binary mode the way a text-mode read would, normalizing line endings.
+    A CRLF can only occur at a line end, so this is the same as decoding line by line.
+    """
+    return str(data, 'utf-8', errors='replace').replace('\r\n', '\n')
+
+
+class LineReader:
+    """
+    Reads lines from a binary file through a reusable buffer, without decoding them.
+
+    Lines are returned as memoryview slices of the buffer, so they are only valid until the
+    next call to readline. The buffer grows to fit the longest line seen (up to
+    `max_line_size`) and shrinks back once long lines are consumed. Longer lines are returned
+    in pieces; `is_continuation` tells whether the last piece returned continues a line.
+
+    :param offset: The file's current position, from which `offset` is kept up to date.
+    """
+
+    def __init__(
+        self,
+        f: BinaryIO,
+        offset: int = 0,
+        chunk_size: int = _READ_CHUNK_SIZE,
+        max_line_size: Optional[int] = None,
+    ):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._max_line_size = max_line_size
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._in_line = False
+        self.offset = offset
+        self.is_continuation = False
+
+    def readline(self, allow_partial: bool) -> Optional[memoryview]:
+        """
+        Read the next line, including its line ending.
+
+        :param allow_partial: Whether to return an unterminated line at the end of the file. If
+                              not, it is kept until the rest of the line is written.
+        :returns: The line, or None at the end of the file.
+        """
+        search_start = self._start
+        newline = self._buffer.find(b'\n', search_start, self._end)
+        while newline < 0:
+            if self._max_line_size is not None and self._end - self._start >= self._max_line_size:
+                newline = self._start + self._max_line_size - 1
+                break
+            search_start = self._end - self._start
+            if not self._fill():
+                if not allow_partial or self._end == self._start:
+                    return None
+                newline = self._end - 1
+                break
+            newline = self._buffer.find(b'\n', self._start + search_start, self._end)
+
+        line = self._view[self._start:newline + 1]
+        self._start = newline + 1
+        self.offset += len(line)
+        self.is_continuation = self._in_line
+        self._in_line = line[-1:] != b'\n'
+        return line
+
+    def _fill(self) -> bool:
+        """Read more of the file after the unconsumed data. Returns False at the end of the file."""
+        unconsumed = self._end - self._start
+        if unconsumed * 2 > len(self._buffer):
+            size = len(self._buffer) * 2
+            if self._max_line_size is not None:
+                size = min(size, self._max_line_size + self._chunk_size)
+            self._reallocate(size)
+        elif len(self._buffer) > self._chunk_size and unconsumed * 2 <= self._chunk_size:
+            self._reallocate(self._chunk_size)
+        elif self._start > 0:
+            self._view[:unconsumed] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = unconsumed
+
+        count = self._f.readinto(self._view[self._end:])
+        if not count:
+            return False
+        self._end += count
+        return True
+
+    def _reallocate(self, size: int):
+        # A new buffer rather than a resize, since returned lines may still reference the old one
+        unconsumed = self._end - self._start
+        buffer = bytearray(size)
+        buffer[:unconsumed] = self._view[self._start:self._end]
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._start = 0
+        self._end = unconsumed
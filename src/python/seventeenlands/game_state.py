@@ -0,0 +1,133 @@
+import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_CARD_OBJECT_TYPES = ('GameObjectType_Card', 'GameObjectType_SplitCard')
+_HAND_ZONE_TYPE = 'ZoneType_Hand'
+
+
+class GameObject:
+    __slots__ = ('instance_id', 'owner_seat_id', 'card_id')
+
+    def __init__(self, instance_id: int, owner_seat_id: int, card_id: int):
+        self.instance_id = instance_id
+        self.owner_seat_id = owner_seat_id
+        self.card_id = card_id
+
+
+class Zone:
+    __slots__ = ('zone_id', 'zone_type', 'owner_seat_id', 'instance_ids')
+
+    def __init__(self, zone_id: int, zone_type: str, owner_seat_id: Optional[int], instance_ids: Tuple[int, ...]):
+        self.zone_id = zone_id
+        self.zone_type = zone_type
+        self.owner_seat_id = owner_seat_id
+        self.instance_ids = instance_ids
+
+
+class GameStateTracker:
+    """
+    Tracks the cards in a single game from GRE GameStateMessages.
+
+    Messages are applied as diffs: only the objects and zones present in a message are
+    touched, so the cost of each message is proportional to the size of the diff. Objects
+    listed in `diffDeletedInstanceIds` are retired from the live state; their final card ids
+    are kept in a compact per-owner array so that every card seen during the game is still
+    reported.
+    """
+
+    def __init__(self):
+        self._live_objects: Dict[int, GameObject] = {}
+        self._retired_card_ids: Dict[int, array.array] = {}
+        self._zones: Dict[int, Zone] = {}
+        self._drawn_card_ids: Dict[int, Dict[int, int]] = {}
+        self.cards_in_hand: Dict[int, List[Optional[int]]] = {}
+        # Incremented whenever the tracked cards may have changed
+        self.version = 0
+
+    def clear(self):
+        self.version += 1
+        self._live_objects.clear()
+        self._retired_card_ids.clear()
+        self._zones.clear()
+        self._drawn_card_ids.clear()
+        self.cards_in_hand.clear()
+
+    def is_empty(self) -> bool:
+        return not (self._live_objects or self._retired_card_ids or self._zones or self._drawn_card_ids or self.cards_in_hand)
+
+    def apply(self, game_state_message: Dict):
+        """Apply the objects, zones and deletions from a GameStateMessage."""
+        self.version += 1
+        for game_object in game_state_message.get('gameObjects', ()):
+            if game_object['type'] not in _CARD_OBJECT_TYPES:
+                continue
+            instance_id = game_object['instanceId']
+            existing = self._live_objects.get(instance_id)
+            if existing is None:
+                self._live_objects[instance_id] = GameObject(
+                    instance_id=instance_id,
+                    owner_seat_id=game_object['ownerSeatId'],
+                    card_id=game_object['overlayGrpId'],
+                )
+            else:
+                existing.owner_seat_id = game_object['ownerSeatId']
+                existing.card_id = game_object['overlayGrpId']
+
+        for zone in game_state_message.get('zones', ()):
+            self._apply_zone(zone)
+
+        self._delete_instances(game_state_message.get('diffDeletedInstanceIds', ()))
+
+    def _apply_zone(self, zone_blob: Dict):
+        zone = Zone(
+            zone_id=zone_blob.get('zoneId'),
+            zone_type=zone_blob['type'],
+            owner_seat_id=zone_blob.get('ownerSeatId'),
+            instance_ids=tuple(zone_blob.get('objectInstanceIds', ())),
+        )
+        self._zones[zone.zone_id] = zone
+
+        if zone.zone_type != _HAND_ZONE_TYPE:
+            return
+
+        owner = zone.owner_seat_id
+        hand = []
+        drawn_card_ids = self._drawn_card_ids.setdefault(owner, {})
+        for instance_id in zone.instance_ids:
+            if not instance_id:
+                continue
+            card_id = self._get_owned_card_id(owner, instance_id)
+            hand.append(card_id)
+            if card_id is not None:
+                drawn_card_ids[instance_id] = card_id
+        self.cards_in_hand[owner] = hand
+
+    def _get_owned_card_id(self, owner: int, instance_id: int) -> Optional[int]:
+        game_object = self._live_objects.get(instance_id)
+        if game_object is None or game_object.owner_seat_id != owner:
+            return None
+        return game_object.card_id
+
+    def _delete_instances(self, instance_ids: Iterable[int]):
+        for instance_id in instance_ids:
+            game_object = self._live_objects.pop(instance_id, None)
+            if game_object is None:
+                continue
+            retired = self._retired_card_ids.get(game_object.owner_seat_id)
+            if retired is None:
+                retired = self._retired_card_ids[game_object.owner_seat_id] = array.array('l')
+            retired.append(game_object.card_id)
+
+    def has_drawn_cards(self) -> bool:
+        return any(self._drawn_card_ids.values())
+
+    def get_drawn_card_ids(self, owner: int) -> List[int]:
+        return list(self._drawn_card_ids.get(owner, {}).values())
+
+    def get_seen_card_ids(self, owner: int) -> List[int]:
+        """Card ids of every object the owner had during the game, including retired ones."""
+        return list(self._retired_card_ids.get(owner, ())) + [
+            game_object.card_id
+            for game_object in self._live_objects.values()
+            if game_object.owner_seat_id == owner
+        ]
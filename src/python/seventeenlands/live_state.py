@@ -0,0 +1,203 @@
+"""
+Serving the follower's live state to local tools such as deck trackers and draft overlays,
+so they need not tail and parse the log themselves.
+
+The state is kept in sections: the current draft (pack and picks so far), taken from the
+events emitted, and the current match and the player's rank, published by the Follower
+when an entry it handles while following a log changes them. Each change is serialized once and pushed
+to every subscriber.
+
+The HTTP server only listens on the loopback interface, and only answers requests addressed
+to 127.0.0.1 or localhost on its port, so that web pages cannot read the state by pointing
+another host name at the loopback address (DNS rebinding):
+
+    GET /state   The current state, as JSON.
+    GET /events  Server-sent events: the current state, then the whole state on every change.
+"""
+
+import http.server
+import json
+import socketserver
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import seventeenlands.logging_utils
+import seventeenlands.sinks
+
+logger = seventeenlands.logging_utils.get_logger('live_state')
+
+DEFAULT_HOST = '127.0.0.1'
+# Comments are sent this often on idle event streams, so closed connections are noticed
+_KEEPALIVE_INTERVAL_SECONDS = 15.0
+
+_DRAFT_PACK_KINDS = ('draft_pack', 'human_draft_pack')
+_DRAFT_PICK_KINDS = ('draft_pick', 'human_draft_pick')
+
+
+class LiveState(seventeenlands.sinks.Sink):
+    """
+    The latest parsed state, shared between the follower and the server's threads.
+
+    As a sink it follows the current draft from the draft pack and pick events.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._state: Dict[str, Any] = {'draft': None, 'match': None, 'rank': None}
+        self._version = 0
+        self._serialized = self._serialize()
+        self._closed = False
+
+    def _serialize(self) -> bytes:
+        return json.dumps({'version': self._version, **self._state}).encode('utf8')
+
+    def update(self, section: str, value: Any):
+        """Replace a section of the state, notifying subscribers if it changed."""
+        with self._condition:
+            if self._state.get(section) == value:
+                return
+            self._state[section] = value
+            self._version += 1
+            self._serialized = self._serialize()
+            self._condition.notify_all()
+
+    def get(self) -> Tuple[int, bytes]:
+        """The current version of the state, and the state as JSON."""
+        with self._condition:
+            return self._version, self._serialized
+
+    def wait_for_change(self, version: int, timeout: float) -> Optional[Tuple[int, bytes]]:
+        """
+        Wait until the state is newer than the given version.
+
+        :return: The new version and state, or None on timeout or once closed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != version or self._closed, timeout)
+            if self._version == version or self._closed:
+                return None
+            return self._version, self._serialized
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def emit(self, event: seventeenlands.sinks.Event):
+        if event.kind in _DRAFT_PACK_KINDS:
+            draft = self._get_draft(event.blob)
+            draft['pack_number'] = event.blob.get('pack_number')
+            draft['pick_number'] = event.blob.get('pick_number')
+            draft['pack'] = event.blob.get('card_ids')
+            self.update('draft', draft)
+        elif event.kind in _DRAFT_PICK_KINDS:
+            draft = self._get_draft(event.blob)
+            card_id = event.blob.get('card_id')
+            if card_id is not None:
+                draft['picks'] = draft['picks'] + [card_id]
+            self.update('draft', draft)
+
+    def _get_draft(self, blob: Dict[str, Any]) -> Dict[str, Any]:
+        """A copy of the current draft, or a new one if the event is from another draft."""
+        with self._condition:
+            draft = self._state['draft']
+        key = {'event_name': blob.get('event_name'), 'draft_id': blob.get('draft_id')}
+        if draft is None or any(draft[k] != v for k, v in key.items() if v is not None):
+            return {**key, 'pack_number': None, 'pick_number': None, 'pack': None, 'picks': []}
+        return dict(draft)
+
+    def close(self):
+        """Release the subscribers waiting for changes."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    server: 'LiveStateServer'
+
+    def do_GET(self):
+        if not self._is_allowed_host():
+            self.send_error(403)
+            return
+        path = self.path.split('?', 1)[0]
+        if path == '/state':
+            self._send_state()
+        elif path == '/events':
+            self._send_events()
+        else:
+            self.send_error(404)
+
+    def _is_allowed_host(self) -> bool:
+        host = self.headers.get('Host', '').lower()
+        return host in (f'127.0.0.1:{self.server.port}', f'localhost:{self.server.port}')
+
+    def _send_state(self):
+        _, serialized = self.server.live_state.get()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(serialized)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(serialized)
+
+    def _send_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        live_state = self.server.live_state
+        version, serialized = live_state.get()
+        try:
+            while True:
+                if serialized is None:
+                    self.wfile.write(b': keepalive\n\n')
+                else:
+                    self.wfile.write(b'id: %d\ndata: %s\n\n' % (version, serialized))
+                self.wfile.flush()
+
+                changed = live_state.wait_for_change(version, _KEEPALIVE_INTERVAL_SECONDS)
+                if self.server.is_closing or live_state.closed:
+                    return
+                if changed is None:
+                    serialized = None
+                else:
+                    version, serialized = changed
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug('Event stream client disconnected')
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+
+class LiveStateServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Serves a LiveState over HTTP on the loopback interface, from a background thread.
+
+    :param port: Port to listen on (0 to pick a free one; see `port`).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, live_state: LiveState, port: int, host: str = DEFAULT_HOST):
+        super().__init__((host, port), _RequestHandler)
+        self.live_state = live_state
+        self.is_closing = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='live_state_server', daemon=True)
+        self._thread.start()
+        logger.info(f'Serving live state on http://{self.server_address[0]}:{self.port}/events')
+
+    def close(self):
+        self.is_closing = True
+        self.live_state.close()
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+        self.server_close()
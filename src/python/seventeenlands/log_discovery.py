@@ -0,0 +1,232 @@
+"""
+Finding the MTGA log to follow among the possible install locations, and noticing when
+another one becomes the active log (e.g. a Wine prefix or Steam library mounted later, or a
+moved install).
+
+Candidates are checked concurrently, each with a timeout, so a slow network or Wine mount
+does not hold up the others; a check that is still running is not started again. Logs are
+ranked by write activity. The ranking is cached, so at startup only the logs found last time
+are checked before following begins.
+"""
+
+import concurrent.futures
+import json
+import os
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set
+
+import seventeenlands.clock_utils
+import seventeenlands.logging_utils
+
+logger = seventeenlands.logging_utils.get_logger('log_discovery')
+
+DEFAULT_CACHE_FILENAME = os.path.join(seventeenlands.logging_utils.get_log_folder(), 'log_discovery.json')
+DEFAULT_PROBE_INTERVAL_SECONDS = 30.0
+DEFAULT_PROBE_TIMEOUT_SECONDS = 2.0
+# The followed log must have been idle this long before switching to a more active one
+_SWITCH_IDLE_SECONDS = 60.0
+_CACHE_VERSION = 1
+
+
+class LogStat(NamedTuple):
+    path: str
+    mtime: float
+    size: int
+
+
+def _stat_log(path: str) -> Optional[LogStat]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return LogStat(path, stat.st_mtime, stat.st_size)
+
+
+def rank_logs(stats: Sequence[LogStat], previous: Dict[str, LogStat]) -> List[LogStat]:
+    """Order logs by write activity: those that grew since the previous check first, then by last write."""
+    def grew(stat: LogStat) -> bool:
+        previous_stat = previous.get(stat.path)
+        return previous_stat is not None and stat.size != previous_stat.size
+
+    return sorted(stats, key=lambda stat: (grew(stat), stat.mtime), reverse=True)
+
+
+class LogDiscovery:
+    """
+    Checks the candidate log paths and picks the one to follow.
+
+    :param paths:          Candidate log paths, e.g. mtga_follower.POSSIBLE_CURRENT_FILEPATHS.
+    :param cache_filename: Where the last ranking is kept between runs (None to not cache it).
+    :param probe_timeout:  Seconds to wait for the candidates to be checked.
+    """
+
+    def __init__(
+        self,
+        paths: Sequence[str],
+        cache_filename: Optional[str] = DEFAULT_CACHE_FILENAME,
+        probe_timeout: float = DEFAULT_PROBE_TIMEOUT_SECONDS,
+        clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
+    ):
+        self._paths = list(paths)
+        self._cache_filename = cache_filename
+        self._probe_timeout = probe_timeout
+        self._clock = clock
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(self._paths), 1))
+        # Checks that have not finished yet, which are waited on rather than repeated
+        self._pending: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._previous_stats: Dict[str, LogStat] = {}
+        # The latest stat of every log seen, kept while it is missing
+        self._last_known_stats: Dict[str, LogStat] = {}
+        # Logs whose latest check finished without finding them
+        self._missing_paths: Set[str] = set()
+        self._cached_paths: Optional[List[str]] = None
+
+    def _stat_all(self, paths: Sequence[str]) -> List[LogStat]:
+        with self._lock:
+            return self._stat_all_locked(paths)
+
+    def _stat_all_locked(self, paths: Sequence[str]) -> List[LogStat]:
+        for path in paths:
+            if path not in self._pending:
+                self._pending[path] = self._executor.submit(_stat_log, path)
+        concurrent.futures.wait([self._pending[path] for path in paths], timeout=self._probe_timeout)
+
+        stats = []
+        for path in paths:
+            future = self._pending[path]
+            if not future.done():
+                logger.debug(f'Still checking {path}')
+                continue
+            del self._pending[path]
+            stat = future.result()
+            if stat is None:
+                self._missing_paths.add(path)
+            else:
+                self._missing_paths.discard(path)
+                stats.append(stat)
+        return stats
+
+    def probe(self) -> List[LogStat]:
+        """Check every candidate, returning the logs found, most active first."""
+        ranked = rank_logs(self._stat_all(self._paths), self._previous_stats)
+        self._previous_stats = {stat.path: stat for stat in ranked}
+        self._last_known_stats.update(self._previous_stats)
+        self._save_cache([stat.path for stat in ranked])
+        return ranked
+
+    def find_log(self) -> Optional[str]:
+        """The log to start following: the most active of those cached, or else of every candidate."""
+        cached_paths = self._load_cache()
+        if cached_paths:
+            stats = self._stat_all(cached_paths)
+            if stats:
+                return rank_logs(stats, {})[0].path
+        ranked = self.probe()
+        return ranked[0].path if ranked else None
+
+    def wait_for_log(self, interval: float = DEFAULT_PROBE_INTERVAL_SECONDS) -> str:
+        """Find the log to follow, checking again every so often until there is one."""
+        filename = self.find_log()
+        if filename is None:
+            logger.warning("Found no log to follow yet. Waiting for Arena's Player.log to appear (or pass it with -l)")
+        while filename is None:
+            self._clock.sleep(interval)
+            filename = self.find_log()
+        return filename
+
+    def choose_log(self, current: str, ranked: Sequence[LogStat]) -> str:
+        """
+        The log to follow given a fresh ranking. Switches away from the current log only once
+        it has been idle for a while and another log has been written since. A current log that
+        was not checked in time is kept; one that is gone is judged by its last known stat.
+        """
+        if not ranked or ranked[0].path == current:
+            return current
+        best = ranked[0]
+        current_stat = next((stat for stat in ranked if stat.path == current), None)
+        if current_stat is None:
+            if current not in self._missing_paths:
+                return current
+            current_stat = self._last_known_stats.get(current)
+            if current_stat is None:
+                return best.path
+        if self._clock.time() - current_stat.mtime >= _SWITCH_IDLE_SECONDS and best.mtime > current_stat.mtime:
+            return best.path
+        return current
+
+    def _load_cache(self) -> Optional[List[str]]:
+        if self._cache_filename is None:
+            return None
+        try:
+            with open(self._cache_filename) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring unreadable log discovery cache {self._cache_filename}: {e}')
+            return None
+        if data.get('version') != _CACHE_VERSION:
+            return None
+        self._cached_paths = data['paths']
+        return [path for path in self._cached_paths if path in self._paths]
+
+    def _save_cache(self, paths: List[str]):
+        if self._cache_filename is None or paths == self._cached_paths:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._cache_filename), exist_ok=True)
+            temp_path = f'{self._cache_filename}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'version': _CACHE_VERSION, 'paths': paths}, f)
+            os.replace(temp_path, self._cache_filename)
+        except OSError as e:
+            logger.warning(f'Could not save log discovery cache {self._cache_filename}: {e}')
+            return
+        self._cached_paths = paths
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class LogWatcher:
+    """
+    Keeps checking the candidates in a background thread, and calls `on_switch` when another
+    log should be followed instead of `current_log`.
+
+    :param on_switch: Called from the watcher's thread with the new log, e.g. to stop the
+                      Follower so that it starts over with `current_log`.
+    """
+
+    def __init__(
+        self,
+        discovery: LogDiscovery,
+        current_log: str,
+        on_switch: Callable[[str], None],
+        interval: float = DEFAULT_PROBE_INTERVAL_SECONDS,
+    ):
+        self._discovery = discovery
+        self.current_log = current_log
+        self._on_switch = on_switch
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='log_watcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                chosen = self._discovery.choose_log(self.current_log, self._discovery.probe())
+            except Exception:
+                logger.exception('Error while looking for logs')
+                continue
+            if chosen != self.current_log:
+                logger.info(f'Switching from {self.current_log} to the more recently written {chosen}')
+                self.current_log = chosen
+                self._on_switch(chosen)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
@@ -0,0 +1,248 @@
+"""
+Sparse sidecar index of a log file, mapping log times and match/draft boundaries to byte offsets.
+
+The follower builds the index as it parses, so a later `--once` run can seek straight to a
+time range, match or draft instead of parsing the whole file. Indexes are stored in the log
+folder, keyed by the fingerprint of the log file's first bytes, its inode and its creation time.
+
+An index is checked against the file when it is loaded: one that has offsets past the end of
+the file, or whose recorded content at an offset no longer matches, is rebuilt from scratch.
+"""
+
+import bisect
+import datetime
+import json
+import os
+import hashlib
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import seventeenlands.file_utils
+import seventeenlands.logging_utils
+
+logger = seventeenlands.logging_utils.get_logger('log_index')
+
+DEFAULT_INDEX_FOLDER = os.path.join(seventeenlands.logging_utils.get_log_folder(), 'log_index')
+_INDEX_VERSION = 2
+# How many bytes at a time point's offset are hashed to check that the index fits the file
+_CHECK_SIZE = 64
+# Minimum log time between two time points
+_TIME_POINT_INTERVAL = datetime.timedelta(minutes=1)
+# Minimum time between saves of an index that is being built
+_SAVE_INTERVAL_SECONDS = 10.0
+# Only the most recently used indexes are kept
+_MAX_INDEX_FILES = 20
+
+MATCH = 'match'
+DRAFT = 'draft'
+
+
+class OffsetRange:
+    """
+    A range of a log file to parse.
+
+    :param start_offset: Byte offset of the first entry in the range.
+    :param end_offset:   Byte offset just past the last entry, or None to parse to the end.
+    :param player_id:    The player logged in at the start of the range, if known.
+    """
+
+    __slots__ = ('start_offset', 'end_offset', 'player_id')
+
+    def __init__(self, start_offset: int, end_offset: Optional[int], player_id: Optional[str]):
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.player_id = player_id
+
+    def __repr__(self):
+        return f'OffsetRange({self.start_offset}, {self.end_offset}, {self.player_id!r})'
+
+
+class LogIndex:
+    """
+    Index of a single log file.
+
+    Time points are (timestamp, offset, player_id) for the first entry at least a minute of log
+    time after the previous point. Ranges span every entry that belonged to a match or draft.
+
+    :param folder: Where the indexes of logs are kept.
+    """
+
+    def __init__(self, key: str, folder: str = DEFAULT_INDEX_FOLDER):
+        self.key = key
+        self.folder = folder
+        self.path = os.path.join(folder, f'{key}.json')
+        self.indexed_offset = 0
+        self._times: List[float] = []
+        self._time_offsets: List[int] = []
+        self._time_player_ids: List[Optional[str]] = []
+        self._ranges: Dict[str, Dict[str, List[Any]]] = {MATCH: {}, DRAFT: {}}
+        # Hashes of the file's content at some time point offsets, as (offset, sha1)
+        self._checks: List[Tuple[int, str]] = []
+        self._dirty = False
+        self._saved_at = 0.0
+
+    @classmethod
+    def load(cls, key: str, f: BinaryIO, folder: str = DEFAULT_INDEX_FOLDER) -> 'LogIndex':
+        """
+        Load the index for a key, or start an empty one if there is none or it does not fit
+        the file.
+
+        :param f: The indexed log file.
+        """
+        index = cls(key, folder)
+        try:
+            with open(index.path) as index_file:
+                data = json.load(index_file)
+        except FileNotFoundError:
+            return index
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring unreadable log index {index.path}: {e}')
+            return index
+
+        if data.get('version') != _INDEX_VERSION:
+            return index
+        problem = _find_mismatch(data, f)
+        if problem is not None:
+            logger.warning(f'Rebuilding log index {index.path}, which does not match the log: {problem}')
+            return index
+
+        index.indexed_offset = data['indexed_offset']
+        for log_time, offset, player_id in data['time_points']:
+            index._times.append(log_time)
+            index._time_offsets.append(offset)
+            index._time_player_ids.append(player_id)
+        index._ranges = data['ranges']
+        index._checks = [tuple(check) for check in data['checks']]
+        return index
+
+    def save(self, f: BinaryIO, force: bool = False):
+        """
+        Write the index if it has changed (at most every few seconds, unless forced).
+
+        :param f: The indexed log file, from which the content checks are taken.
+        """
+        now = time.monotonic()
+        if not self._dirty or (not force and now - self._saved_at < _SAVE_INTERVAL_SECONDS):
+            return
+
+        if self._time_offsets:
+            self._checks = [
+                (offset, _get_content_hash(f, offset))
+                for offset in sorted({self._time_offsets[0], self._time_offsets[-1]})
+            ]
+        data = {
+            'version': _INDEX_VERSION,
+            'indexed_offset': self.indexed_offset,
+            'time_points': list(zip(self._times, self._time_offsets, self._time_player_ids)),
+            'ranges': self._ranges,
+            'checks': self._checks,
+        }
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w') as index_file:
+                json.dump(data, index_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f'Could not save log index {self.path}: {e}')
+            return
+
+        self._dirty = False
+        self._saved_at = now
+        _prune_index_files(self.folder)
+
+    def add_entry(self, log_time: datetime.datetime, start_offset: int, end_offset: int, player_id: Optional[str]):
+        """Record a parsed entry, adding a time point if enough log time has passed since the last one."""
+        if end_offset > self.indexed_offset:
+            self.indexed_offset = end_offset
+            self._dirty = True
+
+        timestamp = log_time.timestamp()
+        if timestamp <= 0:
+            return
+        if self._time_offsets and (
+            start_offset <= self._time_offsets[-1]
+            or timestamp < self._times[-1] + _TIME_POINT_INTERVAL.total_seconds()
+        ):
+            return
+        self._times.append(timestamp)
+        self._time_offsets.append(start_offset)
+        self._time_player_ids.append(player_id)
+        self._dirty = True
+
+    def mark_range(self, kind: str, key: str, start_offset: int, end_offset: int, player_id: Optional[str]):
+        """Extend the range of a match or draft to cover an entry."""
+        ranges = self._ranges[kind]
+        existing = ranges.get(key)
+        if existing is None:
+            ranges[key] = [start_offset, end_offset, player_id]
+        elif start_offset < existing[0] or end_offset > existing[1]:
+            existing[0] = min(existing[0], start_offset)
+            existing[1] = max(existing[1], end_offset)
+        else:
+            return
+        self._dirty = True
+
+    def get_range(self, kind: str, key: str) -> Optional[OffsetRange]:
+        existing = self._ranges[kind].get(key)
+        if existing is None:
+            return None
+        return OffsetRange(*existing)
+
+    def get_time_range(
+        self,
+        start_time: Optional[datetime.datetime],
+        end_time: Optional[datetime.datetime],
+    ) -> OffsetRange:
+        """
+        Get a range covering at least every entry logged between the given times. It may start
+        up to a minute early; entries beyond the indexed part of the file are always included.
+        """
+        start_index = 0
+        if start_time is not None:
+            start_index = max(bisect.bisect_right(self._times, start_time.timestamp()) - 1, 0)
+
+        end_offset = None
+        if end_time is not None:
+            end_index = bisect.bisect_right(self._times, end_time.timestamp())
+            if end_index < len(self._times):
+                end_offset = self._time_offsets[end_index]
+
+        if not self._times or start_time is None or start_time.timestamp() < self._times[0]:
+            return OffsetRange(0, end_offset, None)
+        return OffsetRange(self._time_offsets[start_index], end_offset, self._time_player_ids[start_index])
+
+
+def load_for_file(path: str, folder: str = DEFAULT_INDEX_FOLDER) -> Optional[LogIndex]:
+    """Load the index of the log file at a path, or None if the file is too short to be indexed."""
+    with open(path, 'rb') as f:
+        key = seventeenlands.file_utils.FileIdentity(f).get_index_key()
+        return None if key is None else LogIndex.load(key, f, folder)
+
+
+def _get_content_hash(f: BinaryIO, offset: int) -> str:
+    return hashlib.sha1(seventeenlands.file_utils.read_at(f, offset, _CHECK_SIZE)).hexdigest()
+
+
+def _find_mismatch(data: Dict[str, Any], f: BinaryIO) -> Optional[str]:
+    """Describe how a saved index does not fit the file, or return None if it fits."""
+    size = os.fstat(f.fileno()).st_size
+    if data['indexed_offset'] > size:
+        return f'indexed up to offset {data["indexed_offset"]}, past the end of the file at {size}'
+    for offset, expected_hash in data['checks']:
+        if offset + _CHECK_SIZE > data['indexed_offset']:
+            # Only fully indexed content is compared, since the file may have been cut mid-entry
+            continue
+        if _get_content_hash(f, offset) != expected_hash:
+            return f'the content at offset {offset} has changed'
+    return None
+
+
+def _prune_index_files(folder: str):
+    try:
+        paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.json')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[_MAX_INDEX_FILES:]:
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f'Could not prune old log indexes: {e}')
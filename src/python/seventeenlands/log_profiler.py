@@ -0,0 +1,300 @@
+"""
+Characterizes what MTGA logs are made of, to see which parts of parsing matter for real logs.
+
+Each log is split into entries the way the Follower splits it, and each entry is decoded and
+classified with the Follower's own classifier, without handling it or submitting anything.
+The report gives, by message type (the entry's header, e.g. `<== Event_GetCourses` or
+`greToClientEvent`) and by the Follower handler the entry goes to: the number of entries,
+their volume and the time spent decoding them. It also lists the largest entries, the message
+types with JSON that no handler takes, and the entries whose JSON could not be decoded.
+
+Several logs are profiled in parallel, one per worker process:
+
+    python -m seventeenlands.log_profiler Player.log Player-prev.log --json profile.json
+"""
+
+import argparse
+import concurrent.futures
+import heapq
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import seventeenlands.file_utils
+import seventeenlands.logging_utils
+import seventeenlands.mtga_follower
+
+logger = seventeenlands.logging_utils.get_logger('log_profiler')
+
+DEFAULT_LARGEST_ENTRY_COUNT = 20
+_ERROR_SAMPLE_COUNT = 10
+_ERROR_SAMPLE_LIMIT = 200
+
+# Pseudo-handlers of entries that are not classified
+NO_JSON = '(no JSON)'
+DECODE_ERROR = '(decode error)'
+NOT_HANDLED = '(not handled)'
+OVERSIZED = '(oversized)'
+
+_NO_HEADER = '(no header)'
+_MESSAGE_TYPE_REGEX_BYTES = re.compile(rb'[\s:]*((?:<==|==>)\s*)?([A-Za-z][\w.]*)')
+# Match connection lines name the player, which is left out of the message type
+_MATCH_CONNECTION_REGEX_BYTES = re.compile(rb'[\s:]*(\w+ to Match|Match to \w+):')
+
+
+def get_message_type(content: bytes) -> str:
+    """The header of an entry, from the text after its log prefix and time, without arguments or ids."""
+    if not content:
+        return _NO_HEADER
+    connection_match = _MATCH_CONNECTION_REGEX_BYTES.match(content)
+    if connection_match:
+        return 'to Match' if connection_match.group(1).endswith(b'to Match') else 'Match to'
+    match = _MESSAGE_TYPE_REGEX_BYTES.match(content)
+    if not match:
+        return _NO_HEADER
+    arrow = match.group(1)
+    name = match.group(2).decode('utf-8', errors='replace')
+    return name if arrow is None else f'{arrow.strip().decode()} {name}'
+
+
+class EntryStats:
+    """Totals over a group of entries."""
+
+    __slots__ = ('count', 'size', 'decode_seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.size = 0
+        self.decode_seconds = 0.0
+
+    def add(self, size: int, decode_seconds: float):
+        self.count += 1
+        self.size += size
+        self.decode_seconds += decode_seconds
+
+    def merge(self, other: 'EntryStats'):
+        self.count += other.count
+        self.size += other.size
+        self.decode_seconds += other.decode_seconds
+
+    def to_blob(self) -> Dict[str, Any]:
+        return {'count': self.count, 'size': self.size, 'decode_ms': self.decode_seconds * 1000}
+
+
+def _add_to(groups: Dict[str, EntryStats], key: str, size: int, decode_seconds: float):
+    stats = groups.get(key)
+    if stats is None:
+        stats = groups[key] = EntryStats()
+    stats.add(size, decode_seconds)
+
+
+def _merge_into(groups: Dict[str, EntryStats], others: Dict[str, EntryStats]):
+    for key, other in others.items():
+        groups.setdefault(key, EntryStats()).merge(other)
+
+
+class LogProfile:
+    """
+    What one or more logs are made of.
+
+    :param largest_entry_count: How many of the largest entries to keep.
+    """
+
+    def __init__(self, largest_entry_count: int = DEFAULT_LARGEST_ENTRY_COUNT):
+        self._largest_entry_count = largest_entry_count
+        # (filename, size in bytes, entries)
+        self.files: List[Tuple[str, int, int]] = []
+        self.by_message_type: Dict[str, EntryStats] = {}
+        self.by_handler: Dict[str, EntryStats] = {}
+        # Message types of entries with JSON that no handler takes
+        self.unhandled: Dict[str, EntryStats] = {}
+        self.decode_errors: Dict[str, int] = {}
+        self.error_samples: List[Dict[str, Any]] = []
+        # Entries the Follower skips because they repeat the previous one
+        self.repeated_count = 0
+        # Min-heap of (size, filename, offset, message type, handler)
+        self.largest_entries: List[Tuple[int, str, int, str, str]] = []
+
+    def add_entry(self, filename: str, offset: int, message_type: str, handler: str, size: int, decode_seconds: float):
+        _add_to(self.by_message_type, message_type, size, decode_seconds)
+        _add_to(self.by_handler, handler, size, decode_seconds)
+        if handler == NOT_HANDLED:
+            _add_to(self.unhandled, message_type, size, decode_seconds)
+        item = (size, filename, offset, message_type, handler)
+        if len(self.largest_entries) < self._largest_entry_count:
+            heapq.heappush(self.largest_entries, item)
+        elif size > self.largest_entries[0][0]:
+            heapq.heapreplace(self.largest_entries, item)
+
+    def add_decode_error(self, filename: str, offset: int, message_type: str, error: str):
+        self.decode_errors[message_type] = self.decode_errors.get(message_type, 0) + 1
+        if len(self.error_samples) < _ERROR_SAMPLE_COUNT:
+            self.error_samples.append({
+                'filename': filename,
+                'offset': offset,
+                'message_type': message_type,
+                'error': error[:_ERROR_SAMPLE_LIMIT],
+            })
+
+    def merge(self, other: 'LogProfile'):
+        self.files.extend(other.files)
+        _merge_into(self.by_message_type, other.by_message_type)
+        _merge_into(self.by_handler, other.by_handler)
+        _merge_into(self.unhandled, other.unhandled)
+        for message_type, count in other.decode_errors.items():
+            self.decode_errors[message_type] = self.decode_errors.get(message_type, 0) + count
+        self.error_samples.extend(other.error_samples[:_ERROR_SAMPLE_COUNT - len(self.error_samples)])
+        self.repeated_count += other.repeated_count
+        self.largest_entries = heapq.nlargest(self._largest_entry_count, self.largest_entries + other.largest_entries)
+        heapq.heapify(self.largest_entries)
+
+    def get_largest_entries(self) -> List[Tuple[int, str, int, str, str]]:
+        return sorted(self.largest_entries, reverse=True)
+
+    def to_blob(self) -> Dict[str, Any]:
+        def groups_to_blob(groups: Dict[str, EntryStats]) -> Dict[str, Dict[str, Any]]:
+            return {key: stats.to_blob() for key, stats in sorted(groups.items(), key=lambda item: -item[1].size)}
+
+        return {
+            'files': [{'filename': filename, 'size': size, 'entries': entries} for filename, size, entries in self.files],
+            'repeated_entries': self.repeated_count,
+            'by_message_type': groups_to_blob(self.by_message_type),
+            'by_handler': groups_to_blob(self.by_handler),
+            'unhandled': groups_to_blob(self.unhandled),
+            'decode_errors': self.decode_errors,
+            'error_samples': self.error_samples,
+            'largest_entries': [
+                {'size': size, 'filename': filename, 'offset': offset, 'message_type': message_type, 'handler': handler}
+                for size, filename, offset, message_type, handler in self.get_largest_entries()
+            ],
+        }
+
+    def format_report(self) -> List[str]:
+        total_size = sum(size for _, size, _ in self.files)
+        total_entries = sum(entries for _, _, entries in self.files)
+        lines = [f'Profiled {len(self.files)} logs: {total_size / 2**20:.1f} MiB, {total_entries} entries ({self.repeated_count} repeated)']
+        for title, groups in (('Message type', self.by_message_type), ('Handler', self.by_handler), ('Not handled', self.unhandled)):
+            if not groups:
+                continue
+            lines.append('')
+            lines.append(f'{title:<45} {"entries":>9} {"MiB":>9} {"decode ms":>11} {"ms/entry":>9}')
+            for key, stats in sorted(groups.items(), key=lambda item: -item[1].size):
+                lines.append(
+                    f'{key[:45]:<45} {stats.count:>9} {stats.size / 2**20:>9.2f} '
+                    f'{stats.decode_seconds * 1000:>11.1f} {stats.decode_seconds * 1000 / stats.count:>9.3f}'
+                )
+        if self.decode_errors:
+            lines.append('')
+            lines.append('Decode errors:')
+            lines.extend(f'  {count:>7}  {message_type}' for message_type, count in sorted(self.decode_errors.items(), key=lambda item: -item[1]))
+            lines.extend(f'  {sample["filename"]}@{sample["offset"]}: {sample["error"]}' for sample in self.error_samples)
+        if self.largest_entries:
+            lines.append('')
+            lines.append('Largest entries:')
+            lines.extend(
+                f'  {size / 1024:>10.1f} KiB  {filename}@{offset}  {message_type} -> {handler}'
+                for size, filename, offset, message_type, handler in self.get_largest_entries()
+            )
+        return lines
+
+
+def _profile_entry(profile: LogProfile, filename: str, offset: int, entry: bytearray, discarded_size: int, previous_key: Optional[bytes]) -> bytes:
+    """Add an entry to the profile. Returns its key, to spot the next entry repeating it."""
+    message_type = get_message_type(bytes(entry[:200]).split(b'\n', 1)[0])
+    if discarded_size:
+        profile.add_entry(filename, offset, message_type, OVERSIZED, discarded_size, 0.0)
+        return b''
+
+    entry_key = seventeenlands.mtga_follower.get_entry_key(entry)
+    if entry_key == previous_key:
+        profile.repeated_count += 1
+        return entry_key
+    if not seventeenlands.mtga_follower._JSON_START_REGEX_BYTES.search(entry):
+        profile.add_entry(filename, offset, message_type, NO_JSON, len(entry), 0.0)
+        return entry_key
+
+    start_time = time.perf_counter()
+    full_log = seventeenlands.file_utils.decode_text(entry)
+    json_obj, error = seventeenlands.mtga_follower.decode_entry(full_log)
+    decode_seconds = time.perf_counter() - start_time
+
+    if error is not None:
+        profile.add_decode_error(filename, offset, message_type, error)
+        handler = DECODE_ERROR
+    elif type(json_obj) != dict:
+        handler = NOT_HANDLED
+    else:
+        handler = seventeenlands.mtga_follower.classify_blob(json_obj, full_log) or NOT_HANDLED
+    profile.add_entry(filename, offset, message_type, handler, len(entry), decode_seconds)
+    return entry_key
+
+
+def profile_log(
+    filename: str,
+    largest_entry_count: int = DEFAULT_LARGEST_ENTRY_COUNT,
+    max_entry_size: int = seventeenlands.mtga_follower.DEFAULT_MAX_ENTRY_SIZE,
+) -> LogProfile:
+    """Profile one log, splitting it into entries as the Follower does."""
+    profile = LogProfile(largest_entry_count)
+    entry_count = 0
+    previous_key = None
+
+    with open(filename, 'rb') as f:
+        for entry in seventeenlands.mtga_follower.read_entries(f, max_entry_size):
+            previous_key = _profile_entry(profile, filename, entry.start_offset, entry.data, entry.discarded_size, previous_key)
+            entry_count += 1
+        profile.files.append((filename, f.tell(), entry_count))
+    return profile
+
+
+def profile_logs(filenames: Sequence[str], workers: int, largest_entry_count: int = DEFAULT_LARGEST_ENTRY_COUNT) -> LogProfile:
+    """Profile several logs, in parallel worker processes if there is more than one."""
+    profile = LogProfile(largest_entry_count)
+    workers = min(workers, len(filenames))
+    if workers <= 1:
+        for filename in filenames:
+            logger.info(f'Profiling {filename}')
+            profile.merge(profile_log(filename, largest_entry_count))
+        return profile
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(profile_log, filename, largest_entry_count) for filename in filenames]
+        for filename, future in zip(filenames, futures):
+            logger.info(f'Profiling {filename}')
+            profile.merge(future.result())
+    return profile
+
+
+def _find_default_logs() -> List[str]:
+    paths = seventeenlands.mtga_follower.POSSIBLE_CURRENT_FILEPATHS + seventeenlands.mtga_follower.POSSIBLE_PREVIOUS_FILEPATHS
+    return [path for path in paths if os.path.exists(path)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report what MTGA logs are made of, without submitting anything')
+    parser.add_argument('log_files', nargs='*',
+        help='Logs to profile (default is every Player.log and Player-prev.log found)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+        help='Logs to profile at once, each in its own process')
+    parser.add_argument('--largest', type=int, default=DEFAULT_LARGEST_ENTRY_COUNT,
+        help='How many of the largest entries to list')
+    parser.add_argument('--json', help='Also write the profile to this JSON file')
+
+    args = parser.parse_args()
+    filenames = args.log_files or _find_default_logs()
+    if not filenames:
+        parser.error('No logs found; pass the logs to profile')
+
+    profile = profile_logs(filenames, args.workers, args.largest)
+    print('\n'.join(profile.format_report()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(profile.to_blob(), f, indent=2)
+        print(f'Wrote the profile to {args.json}')
+    seventeenlands.logging_utils.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
+import atexit
+import collections
 import logging
 import logging.handlers
+import multiprocessing
 import os
-from typing import Dict
+import threading
+from typing import Any, Callable, Deque, Dict, List, Optional
 
 
 _LOG_FOLDER = os.path.join(os.path.expanduser('~'), '.seventeenlands')
@@ -13,16 +17,130 @@ _LOG_FORMATTER = logging.Formatter(
     "%(asctime)s.%(msecs)03d,%(levelname)s,%(name)s,%(message)s",
     datefmt='%Y%m%d %H%M%S',
 )
-_HANDLERS = {
-    logging.handlers.TimedRotatingFileHandler(
-        _LOG_FILENAME,
-        when='D',
-        interval=1,
-        backupCount=7,
-        utc=True,
-    ),
-    logging.StreamHandler(),
-}
+# Records at or below this level are discarded (oldest first) when the queue is full
+_LOW_SEVERITY_LEVEL = logging.INFO
+_MAX_QUEUED_RECORDS = 10000
+
+
+class _DropOldestQueue:
+    """
+    Bounded record queue between the QueueHandler and the writer thread. Putting never blocks:
+    when full, the oldest low-severity record is discarded to make room. Records above
+    _LOW_SEVERITY_LEVEL are always kept, even past the bound.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._records: Deque[Optional[logging.LogRecord]] = collections.deque()
+        self._low_severity_count = 0
+        self._unreported_drop_count = 0
+        self._condition = threading.Condition()
+
+    def put_nowait(self, record: Optional[logging.LogRecord]):
+        with self._condition:
+            if record is not None and len(self._records) >= self._max_size and not self._make_room(record):
+                self._unreported_drop_count += 1
+                return
+
+            if _is_low_severity(record):
+                self._low_severity_count += 1
+            self._records.append(record)
+            self._condition.notify()
+
+    def get(self, block: bool = True) -> Optional[logging.LogRecord]:
+        with self._condition:
+            while not self._records:
+                self._condition.wait()
+
+            if self._unreported_drop_count > 0:
+                drop_count = self._unreported_drop_count
+                self._unreported_drop_count = 0
+                return logging.makeLogRecord({
+                    'name': 'logging_utils',
+                    'levelno': logging.WARNING,
+                    'levelname': logging.getLevelName(logging.WARNING),
+                    'msg': f'Dropped {drop_count} low-severity log records because logging fell behind',
+                })
+
+            record = self._records.popleft()
+            if _is_low_severity(record):
+                self._low_severity_count -= 1
+            return record
+
+    def _make_room(self, record: logging.LogRecord) -> bool:
+        if self._low_severity_count > 0:
+            for index, queued_record in enumerate(self._records):
+                if _is_low_severity(queued_record):
+                    del self._records[index]
+                    self._low_severity_count -= 1
+                    self._unreported_drop_count += 1
+                    return True
+
+        return not _is_low_severity(record)
+
+
+def _is_low_severity(record: Optional[logging.LogRecord]) -> bool:
+    return record is not None and record.levelno <= _LOW_SEVERITY_LEVEL
+
+
+def _create_handlers() -> List[logging.Handler]:
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    # Worker processes only log to the console, so that one process owns the log file
+    if multiprocessing.current_process().name == 'MainProcess':
+        handlers.append(logging.handlers.TimedRotatingFileHandler(
+            _LOG_FILENAME,
+            when='D',
+            interval=1,
+            backupCount=7,
+            utc=True,
+        ))
+    for handler in handlers:
+        handler.setFormatter(_LOG_FORMATTER)
+    return handlers
+
+
+# The writer thread and its handlers are started with the first record, by the process that
+# logs it: a forked or spawned worker gets its own rather than the parent's.
+_START_LOCK = threading.Lock()
+_QUEUE: Optional[_DropOldestQueue] = None
+_HANDLERS: List[logging.Handler] = []
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+_listener_pid: Optional[int] = None
+
+
+def _ensure_started() -> _DropOldestQueue:
+    """Get this process's record queue, starting its writer thread if needed."""
+    global _QUEUE, _HANDLERS, _LISTENER, _listener_pid
+    with _START_LOCK:
+        if _listener_pid == os.getpid():
+            return _QUEUE
+
+        _QUEUE = _DropOldestQueue(_MAX_QUEUED_RECORDS)
+        _HANDLERS = _create_handlers()
+        _LISTENER = logging.handlers.QueueListener(_QUEUE, *_HANDLERS, respect_handler_level=True)
+        _LISTENER.start()
+        _listener_pid = os.getpid()
+        if any(isinstance(handler, logging.FileHandler) for handler in _HANDLERS):
+            _QUEUE.put_nowait(logging.makeLogRecord({
+                'name': 'logging_utils',
+                'levelno': logging.INFO,
+                'levelname': logging.getLevelName(logging.INFO),
+                'msg': f'Saving logs to {_LOG_FILENAME}',
+            }))
+        return _QUEUE
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the writer thread, starting it with the first record."""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def enqueue(self, record: logging.LogRecord):
+        _ensure_started().put_nowait(record)
+
+
+_QUEUE_HANDLER = _LazyQueueHandler()
 
 _loggers: Dict[str, logging.Logger] = {}
 
@@ -32,13 +150,135 @@ def get_logger(name: str) -> logging.Logger:
         return _loggers[name]
     
     logger = logging.getLogger(name)
-    for handler in _HANDLERS:
-        handler.setFormatter(_LOG_FORMATTER)
-        logger.addHandler(handler)
+    logger.addHandler(_QUEUE_HANDLER)
 
     logger.setLevel(logging.INFO)
-    logger.info(f'Saving logs to {_LOG_FILENAME}')
 
     _loggers[name] = logger
 
     return logger
+
+
+def get_log_folder() -> str:
+    return _LOG_FOLDER
+
+
+def shutdown():
+    """Write out every queued record and stop the writer thread. Safe to call more than once."""
+    global _LISTENER
+    with _START_LOCK:
+        # A forked process inherits its parent's writer, which is not running in it
+        if _listener_pid != os.getpid():
+            return
+        listener, _LISTENER = _LISTENER, None
+    if listener is None:
+        return
+
+    listener.stop()
+    for handler in _HANDLERS:
+        try:
+            handler.flush()
+        except (OSError, ValueError):
+            # e.g. the console stream was closed first, as by pytest
+            pass
+
+
+atexit.register(shutdown)
+
+
+DEFAULT_VALUE_LIMIT = 1000
+_TRUNCATION_MARKER = '...'
+
+
+class Abbreviated:
+    """
+    A log argument that renders its value only when the record is emitted, and never renders
+    more than `limit` characters of it. Pass it as a %-style argument, e.g.
+    `logger.info('Draft pack: %s', abbreviate(pack))`, so that nothing is formatted when the
+    level is disabled.
+    """
+
+    __slots__ = ('_value', '_limit', '_is_deferred')
+
+    def __init__(self, value: Any, limit: int, is_deferred: bool = False):
+        self._value = value
+        self._limit = limit
+        self._is_deferred = is_deferred
+
+    def __str__(self) -> str:
+        value = self._value() if self._is_deferred else self._value
+        return render_bounded(value, self._limit)
+
+    __repr__ = __str__
+
+
+def abbreviate(value: Any, limit: int = DEFAULT_VALUE_LIMIT) -> Abbreviated:
+    return Abbreviated(value, limit)
+
+
+def defer(value_getter: Callable[[], Any], limit: int = DEFAULT_VALUE_LIMIT) -> Abbreviated:
+    """Like abbreviate, but the value itself is only computed if the record is emitted."""
+    return Abbreviated(value_getter, limit, is_deferred=True)
+
+
+def render_bounded(value: Any, limit: int) -> str:
+    """
+    Render a value like repr() (or str() for strings), stopping after roughly `limit` characters.
+
+    Containers are walked lazily, so the cost is proportional to the limit, not the value.
+    """
+    pieces: List[str] = []
+    remaining = _render_into(value, pieces, limit, is_top_level=True)
+    if remaining >= 0:
+        return ''.join(pieces)
+
+    rendered = ''.join(pieces)[:limit]
+    if isinstance(value, (str, bytes, bytearray, dict, list, tuple)):
+        return f'{rendered}{_TRUNCATION_MARKER} ({len(value)} {"items" if isinstance(value, (dict, list, tuple)) else "chars"} total)'
+    return f'{rendered}{_TRUNCATION_MARKER}'
+
+
+def _render_into(value: Any, pieces: List[str], remaining: int, is_top_level: bool = False) -> int:
+    """Append the rendering of value to pieces. Returns the remaining budget (negative once exhausted)."""
+    if remaining < 0:
+        return remaining
+
+    if isinstance(value, dict):
+        pieces.append('{')
+        remaining -= 1
+        for index, (key, item) in enumerate(value.items()):
+            if remaining < 0:
+                return remaining
+            if index > 0:
+                pieces.append(', ')
+                remaining -= 2
+            remaining = _render_into(key, pieces, remaining)
+            pieces.append(': ')
+            remaining = _render_into(item, pieces, remaining - 2)
+        pieces.append('}')
+        return remaining - 1
+
+    if isinstance(value, (list, tuple)):
+        opening, closing = ('[', ']') if isinstance(value, list) else ('(', ')')
+        pieces.append(opening)
+        remaining -= 1
+        for index, item in enumerate(value):
+            if remaining < 0:
+                return remaining
+            if index > 0:
+                pieces.append(', ')
+                remaining -= 2
+            remaining = _render_into(item, pieces, remaining)
+        pieces.append(closing)
+        return remaining - 1
+
+    if isinstance(value, (str, bytes, bytearray)):
+        # Slice before rendering so huge strings are never copied in full
+        text = value[:remaining + 1]
+        text = text if is_top_level and isinstance(text, str) else repr(text)
+    else:
+        text = repr(value)
+
+    pieces.append(text)
+    return remaining - len(text)
+
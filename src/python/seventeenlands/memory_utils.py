@@ -0,0 +1,161 @@
+"""
+Measuring the process's memory, and a watchdog that sheds the follower's history when it
+grows too large.
+
+Resident set size is read with psutil when it is installed, and otherwise from /proc (Linux)
+or the Win32 API. Where none of these are available the watchdog does nothing.
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+from typing import Callable, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import seventeenlands.clock_utils
+import seventeenlands.logging_utils
+
+logger = seventeenlands.logging_utils.get_logger('memory_utils')
+
+DEFAULT_CHECK_INTERVAL_SECONDS = 60.0
+# Allocations are traced (for one check interval) at most this often while memory stays over the limit
+_REPORT_INTERVAL_SECONDS = 10 * 60.0
+_TRACEMALLOC_FRAMES = 1
+# Freed memory is often kept by the allocator, so after shedding, memory is only shed again
+# once it grows by this fraction of the limit beyond what was left
+_RESHED_GROWTH_FRACTION = 0.25
+_TOP_ALLOCATION_COUNT = 10
+
+
+def _get_rss_windows() -> Optional[int]:
+    import ctypes
+    import ctypes.wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ('cb', ctypes.wintypes.DWORD),
+            ('PageFaultCount', ctypes.wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.WorkingSetSize
+
+
+def get_rss() -> Optional[int]:
+    """The resident set size of this process in bytes, or None if it cannot be measured."""
+    try:
+        if psutil is not None:
+            return psutil.Process().memory_info().rss
+        if sys.platform == 'win32':
+            return _get_rss_windows()
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def format_top_allocations(
+    snapshot: tracemalloc.Snapshot,
+    baseline: Optional[tracemalloc.Snapshot] = None,
+    limit: int = _TOP_ALLOCATION_COUNT,
+) -> List[str]:
+    """
+    Describe the allocation sites holding the most memory, or with the most growth since a
+    baseline snapshot.
+    """
+    if baseline is None:
+        stats = snapshot.statistics('lineno')
+        return [f'{stat.size / 1024:10.1f} KiB {stat.count:8} blocks  {stat.traceback}' for stat in stats[:limit]]
+    stats = snapshot.compare_to(baseline, 'lineno')
+    return [
+        f'{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8} blocks  {stat.traceback}'
+        for stat in stats[:limit]
+    ]
+
+
+class MemoryWatchdog:
+    """
+    Checks the resident set size every so often. Once it exceeds the limit, calls `shed` to
+    free what it can, and traces allocations until the next check, which logs the top
+    allocators and stops tracing again. Shedding again requires further growth, so it does
+    not repeat while memory stays put.
+
+    :param limit:          Resident set size in bytes above which memory is shed.
+    :param shed:           Frees memory, e.g. Follower.shed_memory.
+    :param check_interval: Seconds between measurements.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        shed: Callable[[], None],
+        clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
+        check_interval: float = DEFAULT_CHECK_INTERVAL_SECONDS,
+    ):
+        self._limit = limit
+        self._shed_above = limit
+        self._shed = shed
+        self._clock = clock
+        self._check_interval = check_interval
+        self._next_check_time = clock.time() + check_interval
+        self._next_report_time = 0.0
+        # Whether the watchdog started tracing (and so should stop it)
+        self._is_tracing = False
+        self.shed_count = 0
+
+    def check(self):
+        """Measure memory if a check is due, shedding memory if it is over the limit."""
+        now = self._clock.time()
+        if now < self._next_check_time:
+            return
+        self._next_check_time = now + self._check_interval
+
+        if self._is_tracing:
+            self._report_traced_allocations()
+
+        rss = get_rss()
+        if rss is None or rss <= self._shed_above:
+            return
+
+        logger.warning(f'Memory use of {rss / 1024 / 1024:.1f} MiB is over the limit of {self._limit / 1024 / 1024:.1f} MiB')
+        if not tracemalloc.is_tracing() and now >= self._next_report_time:
+            # Only allocations until the next check are traced, so the report shows what is growing
+            self._next_report_time = now + _REPORT_INTERVAL_SECONDS
+            logger.info('Tracing memory allocations until the next check')
+            tracemalloc.start(_TRACEMALLOC_FRAMES)
+            self._is_tracing = True
+        elif not self._is_tracing and tracemalloc.is_tracing() and now >= self._next_report_time:
+            # Tracing was started elsewhere (e.g. PYTHONTRACEMALLOC), so it is left running
+            self._next_report_time = now + _REPORT_INTERVAL_SECONDS
+            logger.warning('Top memory allocations:\n%s', '\n'.join(format_top_allocations(tracemalloc.take_snapshot())))
+
+        self._shed()
+        gc.collect()
+        self.shed_count += 1
+        rss = get_rss()
+        if rss is not None:
+            logger.info(f'Memory use after shedding: {rss / 1024 / 1024:.1f} MiB')
+            self._shed_above = max(self._limit, rss + int(self._limit * _RESHED_GROWTH_FRACTION))
+
+    def _report_traced_allocations(self):
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        self._is_tracing = False
+        logger.warning('Top memory allocations since memory went over the limit:\n%s', '\n'.join(format_top_allocations(snapshot)))
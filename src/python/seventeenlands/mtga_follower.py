@@ -16,24 +16,37 @@ import copy
 import datetime
 import json
 import getpass
+import hashlib
 import itertools
 import os
 import os.path
-import pathlib
 import re
 import subprocess
 import sys
 import time
-import traceback
 import uuid
 from typing import Any, Dict
 
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import dateutil.parser
 
 import seventeenlands.api_client
+import seventeenlands.clock_utils
+import seventeenlands.error_utils
+import seventeenlands.event_store
+import seventeenlands.file_utils
+import seventeenlands.game_state
+import seventeenlands.live_state
+import seventeenlands.log_discovery
+import seventeenlands.log_index
 import seventeenlands.logging_utils
+import seventeenlands.memory_utils
+import seventeenlands.profiling_utils
+import seventeenlands.projection
+import seventeenlands.records
+import seventeenlands.sinks
+import seventeenlands.tracing
 
 logger = seventeenlands.logging_utils.get_logger('17Lands')
 
@@ -48,7 +61,6 @@ TOKEN_MISSING_TITLE = 'Error: Client Token Needed'
 TOKEN_MISSING_MESSAGE = 'Error: The program cannot continue without specifying a client token. Exiting.'
 TOKEN_INVALID_MESSAGE = 'That token is invalid. Please specify a valid client token. See 17lands.com/getting_started for more details.'
 
-FILE_UPDATED_FORCE_REFRESH_SECONDS = 60
 
 OSX_LOG_ROOT = os.path.join('Library','Logs')
 WINDOWS_LOG_ROOT = os.path.join(
@@ -132,6 +144,15 @@ LOGIN_REGEX = re.compile(r'.*Logged in successfully\. Display Name:(.*)')
 MATCH_ACCOUNT_INFO_REGEX = re.compile(r'.*: ((\w+) to Match|Match to (\w+)):')
 SLEEP_TIME = 0.5
 
+# Byte versions of the patterns matched against every raw line, so lines are only decoded when they match
+_LOG_START_REGEX_TIMED_BYTES = re.compile(LOG_START_REGEX_TIMED.pattern.encode('utf8'))
+_LOG_START_REGEX_UNTIMED_BYTES = re.compile(LOG_START_REGEX_UNTIMED.pattern.encode('utf8'))
+_TIMESTAMP_REGEX_BYTES = re.compile(TIMESTAMP_REGEX.pattern.encode('utf8'))
+_JSON_START_REGEX_BYTES = re.compile(JSON_START_REGEX.pattern.encode('utf8'))
+_ACCOUNT_INFO_REGEX_BYTES = re.compile(ACCOUNT_INFO_REGEX.pattern.encode('utf8'))
+_LOGIN_REGEX_BYTES = re.compile(LOGIN_REGEX.pattern.encode('utf8'))
+_MATCH_ACCOUNT_INFO_REGEX_BYTES = re.compile(MATCH_ACCOUNT_INFO_REGEX.pattern.encode('utf8'))
+
 TIME_FORMATS = (
     '%Y-%m-%d %I:%M:%S %p',
     '%Y-%m-%d %H:%M:%S',
@@ -149,6 +170,21 @@ OUTPUT_TIME_FORMAT = '%Y%m%d%H%M%S'
 MAX_MILLISECONDS_SINCE_EPOCH = int(1000 * datetime.datetime(3000, 1, 1).timestamp())
 
 _ERROR_LINES_RECENCY = 10
+# Only the start of each recent line is kept for error reports
+_RECENT_LINE_PREVIEW_SIZE = 1000
+# Entries larger than this are discarded as they are read, rather than held in memory
+DEFAULT_MAX_ENTRY_SIZE = 64 * 1024 * 1024
+# Failed attempts to decode an entry before it is last read, after which it is only decoded once complete
+_MAX_ENTRY_PROBES = 4
+_JSON_END_BYTES = (b'}', b']')
+
+# Maximum number of characters of a value to render into a single log message, by call site
+_DRAFT_LOG_LIMIT = 1000
+_EVENT_LOG_LIMIT = 1000
+_GAME_LOG_LIMIT = 2000
+_RESULT_LOG_LIMIT = 500
+_ENTRY_LOG_LIMIT = 500
+_ERROR_LOG_LIMIT = 2000
 
 
 def extract_time(time_str):
@@ -172,6 +208,206 @@ def extract_time(time_str):
     raise ValueError(f'Unsupported time format: "{time_str}"')
 
 
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _try_decode(blob, key):
+    try:
+        json_obj, _ = _JSON_DECODER.raw_decode(blob[key])
+        return json_obj
+    except Exception:
+        return blob[key]
+
+
+def extract_payload(blob):
+    """Unwrap the payload of a message, decoding payloads that were serialized as strings."""
+    if type(blob) != dict: return blob
+    if 'clientToMatchServiceMessageType' in blob: return blob
+
+    for key in ('payload', 'Payload', 'request'):
+        if key in blob:
+            # Some messages are recursively serialized
+            return extract_payload(_try_decode(blob, key))
+
+    return blob
+
+
+def get_entry_key(entry):
+    """A digest identifying an entry's bytes, so entries can be compared without keeping them."""
+    return hashlib.blake2b(entry, digest_size=16).digest()
+
+
+def decode_entry(full_log):
+    """
+    Decode the first JSON value in a complete log entry and extract its payload. This has no
+    side effects on the Follower.
+
+    :returns: The payload (None if the entry has no JSON), and the decoding error message, if any.
+    """
+    match = JSON_START_REGEX.search(full_log)
+    if not match:
+        return None, None
+
+    try:
+        json_obj, _ = _JSON_DECODER.raw_decode(full_log, match.start())
+    except json.JSONDecodeError as e:
+        return None, str(e)
+
+    return extract_payload(json_obj), None
+
+
+def classify_blob(json_obj, full_log):
+    """
+    Find which kind of message a decoded log entry is, i.e. how the Follower handles it.
+
+    :param json_obj: The entry's decoded payload, a dict.
+    :param full_log: The entry's text.
+
+    :returns: The name of the Follower's handler for the entry (a key of Follower._BLOB_HANDLERS),
+              or None if it is not handled.
+    """
+    if json_value_matches('Client.Connected', ['params', 'messageName'], json_obj): # Doesn't exist any more
+        return 'login'
+    elif contains_log_key(key='Event_Join', full_log=full_log) and 'EventName' in json_obj:
+        return 'joined_pod'
+    elif contains_log_key(key='Event_Join', full_log=full_log) and 'Course' in json_obj:
+        return 'joined_event_response'
+    elif 'DraftStatus' in json_obj:
+        return 'bot_draft_pack'
+    elif contains_log_key(key='BotDraft_DraftPick', full_log=full_log) and 'PickInfo' in json_obj:
+        return 'bot_draft_pick'
+    elif contains_log_key(key='LogBusinessEvents', full_log=full_log) and 'PickGrpId' in json_obj:
+        return 'human_draft_combined'
+    elif contains_log_key(key='LogBusinessEvents', full_log=full_log) and 'WinningType' in json_obj:
+        return 'log_business_game_end'
+    elif 'Draft.Notify ' in full_log and 'method' not in json_obj:
+        return 'human_draft_pack'
+    elif contains_log_key(key='Event_SetDeck', full_log=full_log) and 'EventName' in json_obj:
+        return 'deck_submission'
+    elif contains_log_key(key='Event_GetCourses', full_log=full_log) and 'Courses' in json_obj:
+        return 'ongoing_events'
+    elif contains_log_key(key='Event_ClaimPrize', full_log=full_log) and 'EventName' in json_obj:
+        return 'claim_prize'
+    elif contains_log_key(key='Draft_CompleteDraft', full_log=full_log) and 'DraftId' in json_obj:
+        return 'event_course'
+    elif 'authenticateResponse' in json_obj:
+        return 'screen_name'
+    elif 'matchGameRoomStateChangedEvent' in json_obj:
+        return 'match_state_changed'
+    elif 'greToClientEvent' in json_obj and 'greToClientMessages' in json_obj['greToClientEvent']:
+        return 'gre_to_client_messages'
+    elif json_value_matches('ClientToMatchServiceMessageType_ClientToGREMessage', ['clientToMatchServiceMessageType'], json_obj):
+        return 'client_to_gre_message'
+    elif json_value_matches('ClientToMatchServiceMessageType_ClientToGREUIMessage', ['clientToMatchServiceMessageType'], json_obj):
+        return 'client_to_gre_ui_message'
+    elif contains_log_key(key='Rank_GetCombinedRankInfo', full_log=full_log) and 'limitedSeasonOrdinal' in json_obj:
+        return 'self_rank_info'
+    elif ' PlayerInventory.GetPlayerCardsV3 ' in full_log and 'method' not in json_obj: # Doesn't exist any more
+        return 'collection'
+    elif 'DTO_InventoryInfo' in json_obj:
+        return 'inventory'
+    elif 'NodeStates' in json_obj and 'RewardTierUpgrade' in json_obj['NodeStates']:
+        return 'player_progress'
+    elif 'FrontDoorConnection.Close ' in full_log:
+        return 'reset_current_user'
+    elif 'Reconnect result : Connected' in full_log:
+        return 'reconnect_result'
+    return None
+
+
+def _payload_arguments(blob, timestamp):
+    return (blob,)
+
+
+def _no_arguments(blob, timestamp):
+    return ()
+
+
+def split_entry_line(line):
+    """
+    Split a raw line of the log the way Follower assembles entries.
+
+    :param line: The line as bytes or a memoryview, including its line ending.
+    :returns: Whether the line starts a new log entry, the raw time of the entry if it has one,
+              and the part of the line that belongs in the entry's text.
+    """
+    match = _LOG_START_REGEX_UNTIMED_BYTES.match(line)
+    if not match:
+        return False, None, line
+    timed_match = _LOG_START_REGEX_TIMED_BYTES.match(line)
+    if timed_match:
+        return True, timed_match.group(2).decode('utf-8', errors='replace'), line[timed_match.end():]
+    return True, None, line[match.end():]
+
+
+class EntryBuffer:
+    """
+    A log entry being assembled from the lines of the log. An entry larger than `max_size`
+    is not held: from then on only its size is kept, as `discarded_size`.
+    """
+
+    __slots__ = ('max_size', 'data', 'line_count', 'discarded_size', 'start_offset', 'end_offset')
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = bytearray()
+        self.line_count = 0
+        self.discarded_size = 0
+        self.start_offset = 0
+        self.end_offset = 0
+
+    def is_empty(self):
+        return self.line_count == 0
+
+    def add_line(self, content, start_offset, end_offset):
+        """Add the content of a line, as given by split_entry_line."""
+        if self.line_count == 0:
+            self.start_offset = start_offset
+        self._add(content)
+        self.line_count += 1
+        self.end_offset = end_offset
+
+    def add_continuation(self, content, end_offset):
+        """Add a further piece of an overlong line."""
+        self._add(content)
+        self.end_offset = end_offset
+
+    def _add(self, content):
+        if self.discarded_size:
+            self.discarded_size += len(content)
+        elif len(self.data) + len(content) > self.max_size:
+            # Stop holding an oversized entry; only its size is tracked from here on
+            self.discarded_size = len(self.data) + len(content)
+            self.data = bytearray()
+        else:
+            self.data += content
+
+
+def read_entries(f, max_entry_size=DEFAULT_MAX_ENTRY_SIZE):
+    """
+    Split a whole log into entries the way the Follower does, without handling them.
+
+    :returns: An iterator of the EntryBuffer of each entry.
+    """
+    reader = seventeenlands.file_utils.LineReader(f, f.tell(), max_line_size=max_entry_size)
+    entry = EntryBuffer(max_entry_size)
+    line_start_offset = reader.offset
+    line = reader.readline(allow_partial=True)
+    while line is not None:
+        if reader.is_continuation:
+            entry.add_continuation(line, reader.offset)
+        else:
+            is_start, _, content = split_entry_line(line)
+            if is_start and not entry.is_empty():
+                yield entry
+                entry = EntryBuffer(max_entry_size)
+            entry.add_line(content, line_start_offset, reader.offset)
+        line_start_offset = reader.offset
+        line = reader.readline(allow_partial=True)
+    if not entry.is_empty():
+        yield entry
+
+
 def json_value_matches(expectation, path, blob):
     """
     Check if the value nested at a given path in a JSON blob matches the expected value.
@@ -218,22 +454,243 @@ def contains_log_key(key: str, full_log: str) -> bool:
     return key in full_log or key.replace('_', '') in full_log
 
 
+# Parser state that outlives a match, and so carries from one part of a log to the next
+CARRIED_STATE_FIELDS = (
+    'cur_log_time',
+    'last_utc_time',
+    'last_event_time',
+    'last_raw_time',
+    'last_blob_key',
+    'cur_user',
+    'user_screen_name',
+    'full_screen_name',
+    'cur_rank_data',
+    'cur_draft_event',
+    'cur_opponent_level',
+    'cur_opponent_match_id',
+    'disconnected_user',
+    'disconnected_screen_name',
+    'disconnected_full_screen_name',
+    'disconnected_rank',
+)
+# Parser state of the current match and game, cleared when a match ends
+MATCH_STATE_FIELDS = (
+    'current_match_id',
+    'current_event_id',
+    'seat_id',
+    'starting_team_id',
+    'turn_count',
+    'screen_names',
+    'opening_hand_count_by_seat',
+    'opening_hand',
+    'drawn_hands',
+    'game_history_events',
+    'current_game_maindeck',
+    'current_game_sideboard',
+    'current_game_additional_deck_info',
+    'game_service_metadata',
+    'game_client_metadata',
+    'pending_game_submission',
+    'pending_game_result',
+    'pending_match_result',
+)
+
+
 class Follower:
     """Follows along a log, parses the messages, and passes along the parsed data to the API endpoint."""
 
-    def __init__(self, token, host):
+    def __init__(
+        self,
+        token,
+        host,
+        max_requests_per_second=seventeenlands.api_client.DEFAULT_MAX_REQUESTS_PER_SECOND,
+        clock=seventeenlands.clock_utils.SYSTEM_CLOCK,
+        api_client=None,
+        sinks=None,
+        max_entry_size=DEFAULT_MAX_ENTRY_SIZE,
+        projection=seventeenlands.projection.FULL_PAYLOADS,
+        memory_limit=None,
+        use_index=True,
+        index_folder=seventeenlands.log_index.DEFAULT_INDEX_FOLDER,
+        live_state=None,
+        tracer=None,
+    ):
+        """
+        :param api_client:     Client to submit events with, if sinks is not given.
+        :param sinks:          Where to send parsed events. Defaults to submitting them to the API.
+        :param max_entry_size: Size in bytes above which log entries are skipped.
+        :param projection:     Fields trimmed from events and game histories before they are sent.
+        :param memory_limit:   Resident set size in bytes above which the current game's history
+                               is dropped to free memory (None for no limit).
+        :param use_index:      Whether to build and save the log's index while parsing.
+        :param index_folder:   Where the log's index is kept.
+        :param live_state:     LiveState to publish the current match and rank to while following a log.
+        :param tracer:         tracing.Tracer sampling events to trace from the log to their acknowledgement.
+        """
         self.host = host
         self.token = token
-        self.json_decoder = json.JSONDecoder()
-        self._api_client = seventeenlands.api_client.ApiClient(host=host)
+        self._clock = clock
+        self._max_entry_size = max_entry_size
+        self._projection = projection
+        self._use_index = use_index
+        self._index_folder = index_folder
+        self._live_state = live_state
+        # What was last published to the live state, to publish only changes
+        self._published_match_key = None
+        self._published_rank_data = None
+        self._tracer = tracer
+        self._memory_watchdog = None
+        if memory_limit is not None:
+            self._memory_watchdog = seventeenlands.memory_utils.MemoryWatchdog(memory_limit, self.shed_memory, clock)
+        if sinks is None:
+            if api_client is None:
+                api_client = seventeenlands.api_client.ApiClient(
+                    host=host,
+                    max_requests_per_second=max_requests_per_second,
+                    clock=clock,
+                )
+            sinks = [seventeenlands.sinks.ApiSink(api_client)]
+        if not sinks:
+            self._sink = seventeenlands.sinks.NullSink()
+        elif len(sinks) == 1:
+            self._sink = sinks[0]
+        else:
+            self._sink = seventeenlands.sinks.FanOutSink(sinks)
+        self._stop_requested = False
+        # Kept across reinitialization, so a rotation does not cut a batch short
+        self._errors = seventeenlands.error_utils.ErrorAggregator()
         self._reinitialize()
 
+    def stop(self):
+        """Ask a running parse_log to return after the current line."""
+        self._stop_requested = True
+
+    def flush(self):
+        """Wait until everything parsed so far has been submitted."""
+        self._submit_errors(force=True)
+        self._sink.flush()
+
+    def close(self):
+        """Flush and close the sinks."""
+        self._submit_errors(force=True)
+        self._sink.close()
+
+    def forward(self, event):
+        """Send an event parsed by another Follower (e.g. in a worker process) to this one's sinks."""
+        self._sink.emit(event)
+
+    def has_match_state(self):
+        """Whether any state of a match or game is held, i.e. the parser is not between matches."""
+        return (
+            not self._entry_buffer.is_empty()
+            or any(getattr(self, field) for field in MATCH_STATE_FIELDS)
+            or not self.game_state.is_empty()
+        )
+
+    def __get_live_match_key(self):
+        """Changes whenever get_live_match_state does, and is much cheaper to get."""
+        if not self.current_match_id:
+            return None
+        opponent_id = 2 if self.seat_id == 1 else 1
+        return (
+            self.current_match_id,
+            self.current_event_id,
+            self.seat_id,
+            self.turn_count,
+            self.game_state.version,
+            len(self.opening_hand),
+            self.screen_names.get(opponent_id),
+            self.cur_opponent_level,
+            self.cur_opponent_match_id,
+        )
+
+    def __publish_live_state(self):
+        """Publish the current match and rank to the live state if they changed."""
+        match_key = self.__get_live_match_key()
+        if match_key != self._published_match_key:
+            self._published_match_key = match_key
+            self._live_state.update('match', self.get_live_match_state())
+        if self.cur_rank_data is not self._published_rank_data:
+            self._published_rank_data = self.cur_rank_data
+            self._live_state.update('rank', self.cur_rank_data)
+
+    def get_live_match_state(self):
+        """The state of the current match shown to local tools, or None between matches."""
+        if not self.current_match_id:
+            return None
+        opponent_id = 2 if self.seat_id == 1 else 1
+        return {
+            'match_id': self.current_match_id,
+            'event_name': self.current_event_id,
+            'seat_id': self.seat_id,
+            'turn_count': self.turn_count,
+            'cards_in_hand': {seat: hand.copy() for seat, hand in self.game_state.cards_in_hand.items()},
+            'opening_hand': {seat: hand.copy() for seat, hand in self.opening_hand.items()},
+            'opponent_screen_name': self.screen_names.get(opponent_id),
+            'opponent_card_ids': self.game_state.get_seen_card_ids(opponent_id),
+            'opponent_rank': self.cur_opponent_level if self.cur_opponent_match_id == self.current_match_id else None,
+        }
+
+    def shed_memory(self):
+        """
+        Free what can be freed without losing track of the log: the current game's history
+        and the recent lines kept for error reports. A game whose history is dropped is not
+        submitted; later games are.
+        """
+        if self.game_history_events:
+            logger.warning(
+                f'Dropping the history of the current game of match {self.current_match_id} '
+                + f'({len(self.game_history_events)} events) to free memory. The game will not be submitted.'
+            )
+            self.game_history_events.clear()
+            self._game_history_dropped = True
+        self.recent_lines.clear()
+
+    def _emit(self, kind, blob):
+        blob = self._projection.project_event(kind, blob)
+        trace = None if self._tracer is None else self._start_trace(kind)
+        self._sink.emit(seventeenlands.sinks.Event(kind=kind, blob=blob, trace=trace))
+        if trace is not None and not trace.awaits_acknowledgement:
+            trace.finish()
+        if self._index is not None:
+            start_offset, end_offset = self.current_entry_offset_range
+            for range_kind, key in ((seventeenlands.log_index.DRAFT, 'draft_id'), (seventeenlands.log_index.MATCH, 'match_id')):
+                if blob.get(key):
+                    self._index.mark_range(range_kind, blob[key], start_offset, end_offset, self.cur_user)
+
+    def _start_trace(self, kind):
+        trace = self._tracer.start_trace(kind)
+        if trace is None:
+            return None
+        # The log time only tells how long the entry took to be read while following the log
+        if self._entry_trace_times and self.cur_log_time is not None and self._handle_entries_early:
+            trace.stamp(seventeenlands.tracing.LOGGED, self.cur_log_time.timestamp())
+        for stage, stage_time in self._entry_trace_times.items():
+            trace.stamp(stage, stage_time)
+        trace.stamp(seventeenlands.tracing.HANDLED)
+        return trace
+
     def _reinitialize(self):
-        self.buffer = []
+        self._entry_buffer = EntryBuffer(self._max_entry_size)
+        self._entry_handled = False
+        self._entry_probe_count = 0
+        self._entry_probed_size = 0
+        # When the current entry reached each stage, for sampled traces of its events
+        self._entry_trace_times = {}
+        self._handle_entries_early = False
+        self.line_count = 0
+        self._buffer_start_line = 0
+        self._buffer_end_line = 0
+        self.current_entry_line_range = (0, 0)
+        self.current_entry_offset_range = (0, 0)
+        self._index = None
         self.cur_log_time = datetime.datetime.fromtimestamp(0)
         self.last_utc_time = datetime.datetime.fromtimestamp(0)
         self.last_event_time = None
         self.last_raw_time = ''
+        self._parsed_raw_time = None
+        self._envelope = None
+        self._envelope_key = None
         self.disconnected_user = None
         self.disconnected_screen_name = None
         self.disconnected_full_screen_name = None
@@ -252,95 +709,123 @@ class Follower:
         self.current_game_sideboard = None
         self.game_service_metadata = None
         self.game_client_metadata = None
-        self.objects_by_owner = defaultdict(dict)
+        self.game_state = seventeenlands.game_state.GameStateTracker()
         self.opening_hand_count_by_seat = defaultdict(int)
         self.opening_hand = defaultdict(list)
         self.drawn_hands = defaultdict(list)
-        self.drawn_cards_by_instance_id = defaultdict(dict)
-        self.cards_in_hand = defaultdict(list)
         self.user_screen_name = None
         self.full_screen_name = None
         self.screen_names = defaultdict(lambda: '')
         self.game_history_events = []
+        # Whether the current game's history was dropped by shed_memory
+        self._game_history_dropped = False
         self.pending_game_submission = {}
         self.pending_game_result = {}
         self.pending_match_result = {}
 
-        self.last_blob = ''
-        self.current_debug_blob = ''
-        self.recent_lines = []
+        # Entries are compared by digest, so the previous entry does not need to be kept
+        self.last_blob_key = None
+        self.current_debug_blob = b''
+        self.recent_lines = deque(maxlen=_ERROR_LINES_RECENCY)
 
         self.__clear_match_data()
 
+    def _get_envelope(self):
+        """The envelope of events from the current entry, rebuilt only when the player or log time changes."""
+        key = (self.cur_user, self.cur_log_time, self.last_utc_time, self.last_event_time, self.last_raw_time)
+        if key != self._envelope_key:
+            self._envelope = seventeenlands.records.Envelope(
+                token=self.token,
+                client_version=CLIENT_VERSION,
+                player_id=self.cur_user,
+                time=self.cur_log_time.isoformat(),
+                utc_time=self.last_utc_time.isoformat(),
+                event_time=self.last_event_time,
+                raw_time=self.last_raw_time,
+            )
+            self._envelope_key = key
+        return self._envelope
+
     def _add_base_api_data(self, blob):
-        return {
-            "token": self.token,
-            "client_version": CLIENT_VERSION,
-            "player_id": self.cur_user,
-            "time": self.cur_log_time.isoformat(),
-            "utc_time": self.last_utc_time.isoformat(),
-            "event_time": self.last_event_time,
-            "raw_time": self.last_raw_time,
-            **blob,
-        }
+        return {**self._get_envelope().to_dict(), **blob}
 
-    def parse_log(self, filename, follow):
+    def parse_log(self, filename, follow, offset_range=None):
         """
         Parse messages from a log file and pass the data along to the API endpoint.
 
-        :param filename: The filename for the log file to parse.
-        :param follow:   Whether or not to continue looking for updates to the file after parsing
-                         all the initial lines.
+        :param filename:     The filename for the log file to parse.
+        :param follow:       Whether or not to continue looking for updates to the file after parsing
+                             all the initial lines.
+        :param offset_range: A log_index.OffsetRange to parse instead of the whole file. Only
+                             allowed when not following.
         """
-        while True:
+        if offset_range is not None and follow:
+            raise ValueError('Cannot follow a log from an offset range')
+
+        self._stop_requested = False
+        while not self._stop_requested:
             self._reinitialize()
-            last_read_time = time.time()
-            last_file_size = 0
             try:
-                with open(filename, errors='replace') as f:
-                    while True:
-                        line = f.readline()
-                        file_size = pathlib.Path(filename).stat().st_size
-                        if line:
-                            self.__append_line(line)
-                            last_read_time = time.time()
-                            last_file_size = file_size
-                        else:
-                            self.__handle_complete_log_entry()
-                            last_modified_time = os.stat(filename).st_mtime
-                            if file_size < last_file_size:
-                                logger.info(f'Starting from beginning of file as file is smaller than before (previous = {last_file_size}; current = {file_size})')
-                                break
-                            elif last_modified_time > last_read_time + FILE_UPDATED_FORCE_REFRESH_SECONDS:
-                                logger.info(f'Starting from beginning of file as file has been updated much more recently than the last read (previous = {last_read_time}; current = {last_modified_time})')
-                                break
-                            elif follow:
-                                time.sleep(SLEEP_TIME)
-                            else:
-                                break
+                with open(filename, 'rb') as f:
+                    try:
+                        identity = seventeenlands.file_utils.FileIdentity(f)
+                        self.__update_index(identity, f)
+                        offset = 0
+                        end_offset = None
+                        if offset_range is not None:
+                            f.seek(offset_range.start_offset)
+                            offset = offset_range.start_offset
+                            end_offset = offset_range.end_offset
+                            if offset_range.player_id is not None:
+                                self.cur_user = offset_range.player_id
+
+                        self.__parse_lines(filename, f, identity, offset, end_offset, follow)
+                    finally:
+                        if self._index is not None:
+                            self._index.save(f, force=True)
             except FileNotFoundError:
-                time.sleep(SLEEP_TIME)
+                self._clock.sleep(SLEEP_TIME)
             except Exception as e:
                 self._log_error(
+                    handler='parse_log',
                     message=f'Error parsing log: {e}',
                     error=e,
-                    stacktrace=traceback.format_exc(),
                 )
 
             if not follow:
                 logger.info('Done processing file.')
                 break
 
-    def _log_error(self, message: str, error: Exception, stacktrace: str):
+    def _log_error(self, handler: str, message: str, error: Exception):
+        """
+        Record an error caught by a handler. Errors are aggregated by handler and exception
+        site, and uploaded in batches rather than one report per error.
+
+        :param handler: Name of the function that caught the error.
+        """
         logger.error(message)
-        self._api_client.submit_error_info(self._add_base_api_data({
-            "blob": self.current_debug_blob,
-            "recent_lines": self.recent_lines,
-            "stacktrace": traceback.format_exc(),
-        }))
+        self._errors.record(
+            handler=handler,
+            error=error,
+            message=message,
+            now=self._clock.time(),
+            get_blob=lambda size: seventeenlands.file_utils.decode_text(self.current_debug_blob[:size]),
+            get_recent_lines=lambda: [seventeenlands.file_utils.decode_text(line_preview) for line_preview in self.recent_lines],
+        )
+        self._submit_errors()
+
+    def _submit_errors(self, force: bool = False):
+        """Upload the aggregated errors as a single report, if a batch is due (or forced)."""
+        now = self._clock.time()
+        if not force and not self._errors.is_batch_due(now):
+            return
+        batch = self._errors.take_batch(now)
+        if batch is not None:
+            logger.info(f'Submitting {len(batch["errors"])} distinct errors')
+            self._emit('error_info', self._add_base_api_data(batch))
 
     def __check_detailed_logs(self, line):
-        if (line.startswith('DETAILED LOGS: DISABLED')):
+        if (line[:23] == b'DETAILED LOGS: DISABLED'):
             logger.warning('Detailed logs are disabled in MTGA.')
             show_message(
                 title='MTGA Logging Disabled (17Lands)',
@@ -350,65 +835,222 @@ class Follower:
                     'check "Detailed Logs", then restart MTGA.'
                 ),
             )
-        elif (line.startswith('DETAILED LOGS: ENABLED')):
+        elif (line[:22] == b'DETAILED LOGS: ENABLED'):
             logger.info('Detailed logs enabled in MTGA.')
 
-    def __append_line(self, line):
-        """Add a complete line (not necessarily a complete message) from the log."""
-        if len(self.recent_lines) >= _ERROR_LINES_RECENCY:
-            self.recent_lines.pop(0)
-        self.recent_lines.append(line)
+    def __parse_lines(self, filename, f, identity, offset, end_offset, follow):
+        """Read and handle lines from the open file until it ends, is replaced or is truncated."""
+        reader = seventeenlands.file_utils.LineReader(f, offset, max_line_size=self._max_entry_size)
+        # When following, entries are handled as soon as they are known to be complete
+        self._handle_entries_early = follow
+        while not self._stop_requested:
+            seventeenlands.profiling_utils.tick()
+            if end_offset is not None and reader.offset >= end_offset:
+                self.__handle_complete_log_entry()
+                break
+            line_start_offset = reader.offset
+            line = reader.readline(allow_partial=not follow)
+            if line is not None:
+                self.__append_line(line, line_start_offset, reader.offset, reader.is_continuation)
+                continue
+
+            # An entry whose JSON has not closed yet is still being written
+            if not follow or self.__probe_entry():
+                self.__handle_complete_log_entry()
+            self.__update_index(identity, f)
+            self._submit_errors()
+            change = identity.check(filename, f)
+            if change is seventeenlands.file_utils.FileChange.REPLACED:
+                # Finish anything written to the old file before it was replaced
+                line_start_offset = reader.offset
+                line = reader.readline(allow_partial=True)
+                while line is not None:
+                    self.__append_line(line, line_start_offset, reader.offset, reader.is_continuation)
+                    line_start_offset = reader.offset
+                    line = reader.readline(allow_partial=True)
+                self.__handle_complete_log_entry()
+                logger.info(f'Switching to the new file at {filename}')
+                break
+            elif change is seventeenlands.file_utils.FileChange.TRUNCATED:
+                self.__handle_complete_log_entry()
+                logger.info(f'Starting from beginning of file as it was truncated or rewritten (previous position = {f.tell()})')
+                break
+            elif follow:
+                self._clock.sleep(SLEEP_TIME)
+            else:
+                break
+
+    def __update_index(self, identity, f):
+        """Save the index of the file so far, starting one once the file can be fingerprinted."""
+        if not self._use_index:
+            return
+        if self._index is None:
+            key = identity.get_index_key()
+            if key is None:
+                return
+            self._index = seventeenlands.log_index.LogIndex.load(key, f, self._index_folder)
+        self._index.save(f)
+
+    def __append_line(self, line, start_offset=0, end_offset=0, is_continuation=False):
+        """
+        Add a complete line (not necessarily a complete message) from the log.
+
+        :param line:            The raw line, as bytes or a memoryview that only needs to stay
+                                valid during this call.
+        :param is_continuation: Whether this is a further piece of an overlong line, which only
+                                adds to the current entry.
+        """
+        if is_continuation:
+            self._entry_buffer.add_continuation(line, end_offset)
+            if self._handle_entries_early and bytes(line[-3:]).rstrip()[-1:] in _JSON_END_BYTES:
+                self.__probe_entry()
+            return
+
+        self.line_count += 1
+        self.recent_lines.append(bytes(line[:_RECENT_LINE_PREVIEW_SIZE]))
 
         self.__check_detailed_logs(line)
 
         self.__maybe_handle_account_info(line)
 
-        timestamp_match = TIMESTAMP_REGEX.match(line)
+        timestamp_match = _TIMESTAMP_REGEX_BYTES.match(line)
         if timestamp_match:
-            self.last_raw_time = timestamp_match.group(1)
-            self.cur_log_time = extract_time(self.last_raw_time)
+            self.__set_log_time(timestamp_match.group(1).decode('utf-8', errors='replace'))
 
-        match = LOG_START_REGEX_UNTIMED.match(line)
-        if match:
+        is_start, raw_time, content = split_entry_line(line)
+        if is_start:
             self.__handle_complete_log_entry()
+            if raw_time is not None:
+                self.__set_log_time(raw_time)
+
+        if self._entry_buffer.is_empty():
+            self._buffer_start_line = self.line_count - 1
+            if self._tracer is not None:
+                self._entry_trace_times[seventeenlands.tracing.READ] = time.time()
+        self._entry_buffer.add_line(content, start_offset, end_offset)
+        self._buffer_end_line = self.line_count
+
+        # Only lines that could close the entry's top-level value are worth a decode attempt:
+        # an unindented closing bracket, or the end of a single-line value near the entry's start
+        if (
+            self._handle_entries_early
+            and bytes(content[-3:]).rstrip()[-1:] in _JSON_END_BYTES
+            and (content[:1] in _JSON_END_BYTES or self._entry_buffer.line_count <= 2)
+        ):
+            self.__probe_entry()
+
+    def __set_log_time(self, raw_time):
+        self.last_raw_time = raw_time
+        # Consecutive entries usually share a timestamp, which only needs parsing once
+        if raw_time != self._parsed_raw_time:
+            self.cur_log_time = extract_time(raw_time)
+            self._parsed_raw_time = raw_time
+
+    def __clear_entry(self):
+        self._entry_buffer = EntryBuffer(self._max_entry_size)
+        self._entry_handled = False
+        self._entry_probe_count = 0
+        self._entry_probed_size = 0
+        # When the current entry reached each stage, for sampled traces of its events
+        self._entry_trace_times = {}
+
+    def __probe_entry(self):
+        """
+        Check whether the current entry's JSON value has closed by trying to decode it, and if
+        so handle the entry right away rather than when the next entry starts. The decode
+        stops at the end of the value, so its result is the same as for the complete entry.
 
-            timed_match = LOG_START_REGEX_TIMED.match(line)
-            if timed_match:
-                self.last_raw_time = timed_match.group(2)
-                self.cur_log_time = extract_time(self.last_raw_time)
-                self.buffer.append(line[timed_match.end():])
-            else:
-                self.buffer.append(line[match.end():])
+        :returns: False if the entry has a JSON value that is still being written.
+        """
+        entry = self._entry_buffer.data
+        if self._entry_handled or self._entry_buffer.discarded_size or self.cur_log_time is None:
+            return True
+        if self._entry_probe_count >= _MAX_ENTRY_PROBES:
+            return True
+        if len(entry) == self._entry_probed_size:
+            return False
+        if not _JSON_START_REGEX_BYTES.search(entry):
+            return True
+
+        full_log = seventeenlands.file_utils.decode_text(entry)
+        decoded = decode_entry(full_log)
+        if decoded[1] is not None:
+            self._entry_probe_count += 1
+            self._entry_probed_size = len(entry)
+            return False
+
+        self.__handle_entry(full_log, decoded)
+        self._entry_handled = True
+        return True
+
+    def __handle_entry(self, full_log=None, decoded=None):
+        """
+        Handle the entry read so far, unless it was too large or repeats the previous entry.
+
+        :param full_log: The entry's text, if it has been decoded already.
+        :param decoded:  The result of decode_entry for the entry, if already known.
+        """
+        entry_buffer = self._entry_buffer
+        self.current_entry_line_range = (self._buffer_start_line, self._buffer_end_line)
+        self.current_entry_offset_range = (entry_buffer.start_offset, entry_buffer.end_offset)
+        if self._tracer is not None:
+            self._entry_trace_times[seventeenlands.tracing.COMPLETED] = time.time()
+        # The entry's bytes are handed over rather than copied; the next entry starts a new buffer
+        entry = self.current_debug_blob = entry_buffer.data
+        entry_key = get_entry_key(entry)
+        if entry_buffer.discarded_size:
+            logger.warning(f'Skipping log entry of {entry_buffer.discarded_size} bytes at offset {entry_buffer.start_offset}, which is larger than the limit of {self._max_entry_size} bytes')
+        elif entry_key != self.last_blob_key:
+            # Entries without any JSON are never handled, so they are not even decoded
+            if full_log is not None or _JSON_START_REGEX_BYTES.search(entry):
+                if full_log is None:
+                    full_log = seventeenlands.file_utils.decode_text(entry)
+                try:
+                    self.__handle_blob(full_log, decoded)
+                except Exception as e:
+                    self._log_error(
+                        handler='__handle_entry',
+                        message=f'Error {e} while processing {seventeenlands.logging_utils.abbreviate(full_log, _ERROR_LOG_LIMIT)}',
+                        error=e,
+                    )
+
+            self.last_blob_key = entry_key
+            # Only published while following, when the state is that of the running game
+            if self._live_state is not None and self._handle_entries_early:
+                self.__publish_live_state()
         else:
-            self.buffer.append(line)
+            logger.info('Skipping repeated complete log entry: %s', seventeenlands.logging_utils.defer(
+                lambda: seventeenlands.file_utils.decode_text(entry),
+                _ENTRY_LOG_LIMIT,
+            ))
 
     def __handle_complete_log_entry(self):
         """Mark the current log message complete. Should be called when waiting for more log messages."""
-        if len(self.buffer) == 0:
+        if self._entry_buffer.is_empty():
             return
         if self.cur_log_time is None:
-            self.buffer = []
+            self.__clear_entry()
             return
 
-        full_log = ''.join(self.buffer)
-        self.current_debug_blob = full_log
-        if full_log != self.last_blob:
-            try:
-                self.__handle_blob(full_log)
-            except Exception as e:
-                self._log_error(
-                    message=f'Error {e} while processing {full_log}',
-                    error=e,
-                    stacktrace=traceback.format_exc(),
-                )
-
-            self.last_blob = full_log
+        if self._entry_handled:
+            self.current_entry_line_range = (self._buffer_start_line, self._buffer_end_line)
+            self.current_entry_offset_range = (self._entry_buffer.start_offset, self._entry_buffer.end_offset)
+            self.current_debug_blob = self._entry_buffer.data
         else:
-            logger.info(f'Skipping repeated complete log entry: {full_log}')
+            self.__handle_entry()
+
+        if self._index is not None:
+            start_offset, end_offset = self.current_entry_offset_range
+            self._index.add_entry(self.cur_log_time, start_offset, end_offset, self.cur_user)
+            if self.current_match_id:
+                self._index.mark_range(seventeenlands.log_index.MATCH, self.current_match_id, start_offset, end_offset, self.cur_user)
 
-        self.buffer = []
+        self.__clear_entry()
         # self.cur_log_time = None
 
+        if self._memory_watchdog is not None:
+            self._memory_watchdog.check()
+
     def __maybe_get_utc_timestamp(self, blob):
         timestamp = None
         if 'timestamp' in blob:
@@ -439,19 +1081,17 @@ class Follower:
         return blob.get('EventTime')
 
 
-    def __handle_blob(self, full_log):
+    def __handle_blob(self, full_log, decoded=None):
         """Attempt to parse a complete log message and send the data if relevant."""
-        match = JSON_START_REGEX.search(full_log)
-        if not match:
-            return
-
-        try:
-            json_obj, end = self.json_decoder.raw_decode(full_log, match.start())
-        except json.JSONDecodeError as e:
-            logger.debug(f'Ran into error {e} when parsing at {self.cur_log_time}. Data was: {full_log}')
+        if decoded is None:
+            decoded = decode_entry(full_log)
+        if self._tracer is not None:
+            self._entry_trace_times[seventeenlands.tracing.DECODED] = time.time()
+        json_obj, error = decoded
+        if error is not None:
+            logger.debug('Ran into error %s when parsing at %s. Data was: %s', error, self.cur_log_time, seventeenlands.logging_utils.abbreviate(full_log, _ENTRY_LOG_LIMIT))
             return
 
-        json_obj = self.__extract_payload(json_obj)
         if type(json_obj) != dict: return
 
         try:
@@ -468,80 +1108,11 @@ class Follower:
         except:
             pass
 
-        if json_value_matches('Client.Connected', ['params', 'messageName'], json_obj): # Doesn't exist any more
-            self.__handle_login(json_obj)
-        elif contains_log_key(key='Event_Join', full_log=full_log) and 'EventName' in json_obj:
-            self.__handle_joined_pod(json_obj)
-        elif contains_log_key(key='Event_Join', full_log=full_log) and 'Course' in json_obj:
-            self.__handle_joined_event_response(json_obj)
-        elif 'DraftStatus' in json_obj:
-            self.__handle_bot_draft_pack(json_obj)
-        elif contains_log_key(key='BotDraft_DraftPick', full_log=full_log) and 'PickInfo' in json_obj:
-            self.__handle_bot_draft_pick(json_obj['PickInfo'])
-        elif contains_log_key(key='LogBusinessEvents', full_log=full_log) and 'PickGrpId' in json_obj:
-            self.__handle_human_draft_combined(json_obj)
-        elif contains_log_key(key='LogBusinessEvents', full_log=full_log) and 'WinningType' in json_obj:
-            self.__handle_log_business_game_end(json_obj)
-        elif 'Draft.Notify ' in full_log and 'method' not in json_obj:
-            self.__handle_human_draft_pack(json_obj)
-        elif contains_log_key(key='Event_SetDeck', full_log=full_log) and 'EventName' in json_obj:
-            self.__handle_deck_submission(json_obj)
-        elif contains_log_key(key='Event_GetCourses', full_log=full_log) and 'Courses' in json_obj:
-            self.__handle_ongoing_events(json_obj)
-        elif contains_log_key(key='Event_ClaimPrize', full_log=full_log) and 'EventName' in json_obj:
-            self.__handle_claim_prize(json_obj)
-        elif contains_log_key(key='Draft_CompleteDraft', full_log=full_log) and 'DraftId' in json_obj:
-            self.__handle_event_course(json_obj)
-        elif 'authenticateResponse' in json_obj:
-            self.__update_screen_name(json_obj['authenticateResponse']['screenName'])
-        elif 'matchGameRoomStateChangedEvent' in json_obj:
-            self.__handle_match_state_changed(json_obj)
-        elif 'greToClientEvent' in json_obj and 'greToClientMessages' in json_obj['greToClientEvent']:
-            try:
-                for message in json_obj['greToClientEvent']['greToClientMessages']:
-                    self.__handle_gre_to_client_message(message, maybe_time)
-            except Exception as e:
-                self._log_error(
-                    message=f'Error {e} parsing GRE to client messages from {json_obj}',
-                    error=e,
-                    stacktrace=traceback.format_exc(),
-                )
-        elif json_value_matches('ClientToMatchServiceMessageType_ClientToGREMessage', ['clientToMatchServiceMessageType'], json_obj):
-            self.__handle_client_to_gre_message(json_obj.get('payload', {}), maybe_time)
-        elif json_value_matches('ClientToMatchServiceMessageType_ClientToGREUIMessage', ['clientToMatchServiceMessageType'], json_obj):
-            self.__handle_client_to_gre_ui_message(json_obj.get('payload', {}), maybe_time)
-        elif contains_log_key(key='Rank_GetCombinedRankInfo', full_log=full_log) and 'limitedSeasonOrdinal' in json_obj:
-            self.__handle_self_rank_info(json_obj)
-        elif ' PlayerInventory.GetPlayerCardsV3 ' in full_log and 'method' not in json_obj: # Doesn't exist any more
-            self.__handle_collection(json_obj)
-        elif 'DTO_InventoryInfo' in json_obj:
-            self.__handle_inventory(json_obj['DTO_InventoryInfo'])
-        elif 'NodeStates' in json_obj and 'RewardTierUpgrade' in json_obj['NodeStates']:
-            self.__handle_player_progress(json_obj)
-        elif 'FrontDoorConnection.Close ' in full_log:
-            self.__reset_current_user()
-        elif 'Reconnect result : Connected' in full_log:
-            self.__handle_reconnect_result()
-        elif 'Reconnect result : Connected' in full_log:
-            self.__handle_reconnect_result()
-
-    def __try_decode(self, blob, key):
-        try:
-            json_obj, _ = self.json_decoder.raw_decode(blob[key])
-            return json_obj
-        except Exception:
-            return blob[key]
-
-    def __extract_payload(self, blob):
-        if type(blob) != dict: return blob
-        if 'clientToMatchServiceMessageType' in blob: return blob
-
-        for key in ('payload', 'Payload', 'request'):
-            if key in blob:
-                # Some messages are recursively serialized
-                return self.__extract_payload(self.__try_decode(blob, key))
-
-        return blob
+        branch = classify_blob(json_obj, full_log)
+        if branch is None:
+            return
+        handler, get_arguments = self._BLOB_HANDLERS[branch]
+        handler(self, *get_arguments(json_obj, maybe_time))
 
     def __update_screen_name(self, screen_name):
         try:
@@ -554,14 +1125,14 @@ class Follower:
                 'screen_name': self.user_screen_name,
                 'full_screen_name': self.full_screen_name,
             }
-            logger.info(f'Updating user info: {user_info}')
-            self._api_client.submit_user(self._add_base_api_data(user_info))
+            logger.info('Updating user info: %s', user_info)
+            self._emit('user', self._add_base_api_data(user_info))
 
         except Exception as e:
             self._log_error(
+                handler='__update_screen_name',
                 message=f'Error {e} parsing screen name from {screen_name}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_match_state_changed(self, blob):
@@ -614,9 +1185,20 @@ class Follower:
     def _add_to_game_history(self, message_blob, timestamp):
         self.game_history_events.append({
             "_timestamp": None if timestamp is None else timestamp.isoformat(),
-            **message_blob,
+            **self._projection.project_gre_message(message_blob),
         })
 
+    def __handle_gre_to_client_event(self, blob, timestamp):
+        try:
+            for message in blob['greToClientEvent']['greToClientMessages']:
+                self.__handle_gre_to_client_message(message, timestamp)
+        except Exception as e:
+            self._log_error(
+                handler='__handle_gre_to_client_event',
+                message=f'Error {e} parsing GRE to client messages from {seventeenlands.logging_utils.abbreviate(blob, _ERROR_LOG_LIMIT)}',
+                error=e,
+            )
+
     def __handle_gre_to_client_message(self, message_blob, timestamp):
         """Handle messages in the 'greToClientEvent' field."""
         # Add to game history before processing the message, since we may submit the game right away.
@@ -654,25 +1236,7 @@ class Follower:
                     turns_sum = sum(p.get('turnNumber', 0) for p in players)
                     self.turn_count = max(self.turn_count, turns_sum)
 
-                for game_object in game_state_message.get('gameObjects', []):
-                    if game_object['type'] not in ('GameObjectType_Card', 'GameObjectType_SplitCard'):
-                        continue
-                    owner = game_object['ownerSeatId']
-                    instance_id = game_object['instanceId']
-                    card_id = game_object['overlayGrpId']
-
-                    self.objects_by_owner[owner][instance_id] = card_id
-
-                for zone in game_state_message.get('zones', []):
-                    if zone['type'] == 'ZoneType_Hand':
-                        owner = zone['ownerSeatId']
-                        player_objects = self.objects_by_owner[owner]
-                        hand_card_ids = zone.get('objectInstanceIds', [])
-                        self.cards_in_hand[owner] = [player_objects.get(instance_id) for instance_id in hand_card_ids if instance_id]
-                        for instance_id in hand_card_ids:
-                            card_id = player_objects.get(instance_id)
-                            if instance_id is not None and card_id is not None:
-                                self.drawn_cards_by_instance_id[owner][instance_id] = card_id
+                self.game_state.apply(game_state_message)
 
                 players_deciding_hand = {
                     (p['systemSeatNumber'], p.get('mulliganCount', 0))
@@ -685,19 +1249,19 @@ class Follower:
                     self.opening_hand_count_by_seat[player_id] += 1
 
                     if mulligan_count == len(self.drawn_hands[player_id]):
-                        self.drawn_hands[player_id].append(self.cards_in_hand[player_id].copy())
+                        self.drawn_hands[player_id].append(self.game_state.cards_in_hand.get(player_id, []).copy())
 
                 if len(self.opening_hand) == 0 and ('Phase_Beginning', 'Step_Upkeep', 1) == (turn_info.get('phase'), turn_info.get('step'), turn_info.get('turnNumber')):
-                    for (owner, hand) in self.cards_in_hand.items():
+                    for (owner, hand) in self.game_state.cards_in_hand.items():
                         self.opening_hand[owner] = hand.copy()
 
                 self.__maybe_handle_game_over_stage(game_state_message)
 
             except Exception as e:
                 self._log_error(
-                    message=f'Error {e} parsing GRE message from {message_blob}',
+                    handler='__handle_gre_to_client_message',
+                    message=f'Error {e} parsing GRE message from {seventeenlands.logging_utils.abbreviate(message_blob, _ERROR_LOG_LIMIT)}',
                     error=e,
-                    stacktrace=traceback.format_exc(),
                 )
 
 
@@ -710,9 +1274,9 @@ class Follower:
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing GRE connect response from {blob}',
+                handler='__handle_gre_connect_response',
+                message=f'Error {e} parsing GRE connect response from {seventeenlands.logging_utils.abbreviate(blob, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_client_to_gre_message(self, payload, timestamp):
@@ -730,16 +1294,16 @@ class Follower:
 
                 except Exception as e:
                     self._log_error(
-                        message=f'Error {e} parsing GRE deck submission from {payload}',
+                        handler='__handle_client_to_gre_message',
+                        message=f'Error {e} parsing GRE deck submission from {seventeenlands.logging_utils.abbreviate(payload, _ERROR_LOG_LIMIT)}',
                         error=e,
-                        stacktrace=traceback.format_exc(),
                     )
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing GRE to client messages from {payload}',
+                handler='__handle_client_to_gre_message',
+                message=f'Error {e} parsing GRE to client messages from {seventeenlands.logging_utils.abbreviate(payload, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_client_to_gre_ui_message(self, payload, timestamp):
@@ -749,9 +1313,9 @@ class Follower:
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing GRE to client UI messages from {payload}',
+                handler='__handle_client_to_gre_ui_message',
+                message=f'Error {e} parsing GRE to client UI messages from {seventeenlands.logging_utils.abbreviate(payload, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_gre_edictal_message(self, payload, timestamp):
@@ -761,9 +1325,9 @@ class Follower:
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing edictal message from {payload}',
+                handler='__handle_gre_edictal_message',
+                message=f'Error {e} parsing edictal message from {seventeenlands.logging_utils.abbreviate(payload, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
 
@@ -780,13 +1344,13 @@ class Follower:
                     'win_type': payload.get('WinningType'),
                     'game_end_reason': payload.get('WinningReason'),
                 }
-                logger.info(f'Added pending game result via LogBusinessEvents {self.pending_game_result}')
+                logger.info('Added pending game result via LogBusinessEvents %s', seventeenlands.logging_utils.abbreviate(self.pending_game_result, _RESULT_LOG_LIMIT))
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing game end from LogBusinessEvents: {payload}',
+                handler='__handle_log_business_game_end',
+                message=f'Error {e} parsing game end from LogBusinessEvents: {seventeenlands.logging_utils.abbreviate(payload, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __maybe_handle_game_over_stage(self, game_state_message):
@@ -807,7 +1371,7 @@ class Follower:
                 **self.pending_game_submission,
             }
             logger.info(f'Submitting queued game result')
-            self._api_client.submit_game_result(self._add_base_api_data(full_game))
+            self._emit('game_result', self._add_base_api_data(full_game))
             self.pending_game_submission = {}
             self.__clear_game_data()
 
@@ -816,13 +1380,13 @@ class Follower:
             self.__maybe_submit_pending_game()
 
         self.turn_count = 0
-        self.objects_by_owner.clear()
+        self.game_state.clear()
         self.opening_hand_count_by_seat.clear()
         self.opening_hand.clear()
         self.drawn_hands.clear()
-        self.drawn_cards_by_instance_id.clear()
         self.starting_team_id = None
         self.game_history_events.clear()
+        self._game_history_dropped = False
         self.current_game_maindeck = None
         self.current_game_sideboard = None
         self.current_game_additional_deck_info = None
@@ -839,76 +1403,80 @@ class Follower:
         self.__clear_game_data(submit_pending_game=submit_pending_game)
 
     def __maybe_handle_account_info(self, line):
-        match = ACCOUNT_INFO_REGEX.match(line)
+        match = _ACCOUNT_INFO_REGEX_BYTES.match(line)
         if match:
-            screen_name = match.group(1)
-            self.cur_user = match.group(2)
+            screen_name = match.group(1).decode('utf-8', errors='replace')
+            self.cur_user = match.group(2).decode('utf-8', errors='replace')
             self.__update_screen_name(screen_name)
             return
 
-        match = MATCH_ACCOUNT_INFO_REGEX.match(line)
+        match = _MATCH_ACCOUNT_INFO_REGEX_BYTES.match(line)
         if match:
-            self.cur_user = match.group(2) or match.group(3)
+            self.cur_user = (match.group(2) or match.group(3)).decode('utf-8', errors='replace')
             return
 
-        match = LOGIN_REGEX.match(line)
+        match = _LOGIN_REGEX_BYTES.match(line)
         if match:
-            self.full_screen_name = match.group(1)
+            # Unlike in text mode, '.' also matches the '\r' of a CRLF line ending
+            self.full_screen_name = match.group(1).rstrip(b'\r').decode('utf-8', errors='replace')
 
     def __handle_ongoing_events(self, json_obj):
         """Handle 'Event_GetCourses' messages."""
         try:
-            event = {
-                'courses': json_obj['Courses'],
-            }
+            event = seventeenlands.records.OngoingEvents(
+                self._get_envelope(),
+                courses=json_obj['Courses'],
+            )
             logger.info(f'Updated ongoing events')
-            self._api_client.submit_ongoing_events(self._add_base_api_data(event))
+            self._emit('ongoing_events', event)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing ongoing event from {json_obj}',
+                handler='__handle_ongoing_events',
+                message=f'Error {e} parsing ongoing event from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_claim_prize(self, json_obj):
         """Handle 'Event_ClaimPrize' messages."""
         try:
-            event = {
-                'event_name': json_obj['EventName'],
-            }
-            logger.info(f'Event ended: {event}')
-            self._api_client.submit_event_ended(self._add_base_api_data(event))
+            event = seventeenlands.records.EventEnded(
+                self._get_envelope(),
+                event_name=json_obj['EventName'],
+            )
+            logger.info('Event ended: %s', event.get_fields())
+            self._emit('event_ended', event)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing claim prize event from {json_obj}',
+                handler='__handle_claim_prize',
+                message=f'Error {e} parsing claim prize event from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_event_course(self, json_obj):
         """Handle messages linking draft id to event name."""
         try:
-            event = {
-                'payload': json_obj,
-                'event_name': json_obj['InternalEventName'],
-                'draft_id': json_obj['DraftId'],
-                'course_id': json_obj['CourseId'],
-                'card_pool': json_obj['CardPool'],
-            }
-            logger.info(f'Event course: {event}')
-            self._api_client.submit_event_course_submission(self._add_base_api_data(event))
+            event = seventeenlands.records.EventCourseSubmission(
+                self._get_envelope(),
+                payload=json_obj,
+                event_name=json_obj['InternalEventName'],
+                draft_id=json_obj['DraftId'],
+                course_id=json_obj['CourseId'],
+                card_pool=json_obj['CardPool'],
+            )
+            logger.info('Event course: %s', seventeenlands.logging_utils.defer(event.get_fields, _EVENT_LOG_LIMIT))
+            self._emit('event_course_submission', event)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing partial event course from {json_obj}',
+                handler='__handle_event_course',
+                message=f'Error {e} parsing partial event course from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __has_pending_game_data(self):
-        return len(self.drawn_cards_by_instance_id) > 0 and len(self.game_history_events) > 5
+        return self.game_state.has_drawn_cards() and len(self.game_history_events) > 5
 
     def __enqueue_game_results(self, results, match_game_room_state_changed_obj=None):
         try:
@@ -921,7 +1489,7 @@ class Follower:
                     'win_type': this_game_result.get('result'),
                     'game_end_reason': this_game_result.get('reason'),
                 }
-                logger.info(f'Added pending game result {self.pending_game_result}')
+                logger.info('Added pending game result %s', self.pending_game_result)
 
             match_result = next((r for r in results if r.get('scope') == 'MatchScope_Match'), {})
             if match_result:
@@ -932,22 +1500,25 @@ class Follower:
                 }
                 if match_game_room_state_changed_obj:
                     self.pending_match_result['match_result_payload'] = match_game_room_state_changed_obj
-                logger.info(f'Added pending match result {self.pending_match_result}')
+                logger.info('Added pending match result %s', seventeenlands.logging_utils.abbreviate(self.pending_match_result, _RESULT_LOG_LIMIT))
 
         except Exception as e:
             self._log_error(
+                handler='__enqueue_game_results',
                 message=f'Error {e} parsing game result',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __enqueue_game_data(self):
+        if self._game_history_dropped:
+            logger.info(f'Not submitting the game of match {self.current_match_id}, whose history was dropped')
+            return False
         if not self.__has_pending_game_data():
             return False
 
         try:
             opponent_id = 2 if self.seat_id == 1 else 1
-            opponent_card_ids = [c for c in self.objects_by_owner.get(opponent_id, {}).values()]
+            opponent_card_ids = self.game_state.get_seen_card_ids(opponent_id)
 
             if self.current_match_id != self.cur_opponent_match_id:
                 self.cur_opponent_level = None
@@ -959,7 +1530,7 @@ class Follower:
                 'opening_hand': self.opening_hand[self.seat_id],
                 'mulligans': self.drawn_hands[self.seat_id][:-1],
                 'drawn_hands': self.drawn_hands[self.seat_id],
-                'drawn_cards': list(self.drawn_cards_by_instance_id[self.seat_id].values()),
+                'drawn_cards': self.game_state.get_drawn_card_ids(self.seat_id),
                 'mulligan_count': self.opening_hand_count_by_seat[self.seat_id] - 1,
                 'opponent_mulligan_count': self.opening_hand_count_by_seat[opponent_id] - 1,
                 'turns': self.turn_count,
@@ -973,7 +1544,7 @@ class Follower:
                 'service_metadata': self.game_service_metadata,
                 'client_metadata': self.game_client_metadata,
             }
-            logger.info(f'Completed game: {game}')
+            logger.info('Completed game: %s', seventeenlands.logging_utils.abbreviate(game, _GAME_LOG_LIMIT))
 
             # Add the history to the blob after logging to avoid printing excessive logs
             logger.info(f'Adding game history ({len(self.game_history_events)} events)')
@@ -990,9 +1561,9 @@ class Follower:
 
         except Exception as e:
             self._log_error(
+                handler='__enqueue_game_data',
                 message=f'Error {e} parsing game data',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
             return False
 
@@ -1006,9 +1577,9 @@ class Follower:
             self.__update_screen_name(screen_name)
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing login from {json_obj}',
+                handler='__handle_login',
+                message=f'Error {e} parsing login from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_bot_draft_pack(self, json_obj):
@@ -1018,21 +1589,22 @@ class Follower:
 
             try:
                 self.cur_draft_event = json_obj['EventName']
-                pack = {
-                    'payload': json_obj,
-                    'event_name': json_obj['EventName'],
-                    'pack_number': int(json_obj['PackNumber']),
-                    'pick_number': int(json_obj['PickNumber']),
-                    'card_ids': [int(x) for x in json_obj['DraftPack']],
-                }
-                logger.info(f'Draft pack: {pack}')
-                self._api_client.submit_draft_pack(self._add_base_api_data(pack))
+                pack = seventeenlands.records.DraftPack(
+                    self._get_envelope(),
+                    payload=json_obj,
+                    event_name=json_obj['EventName'],
+                    pack_number=int(json_obj['PackNumber']),
+                    pick_number=int(json_obj['PickNumber']),
+                    card_ids=[int(x) for x in json_obj['DraftPack']],
+                )
+                logger.info('Draft pack: %s', seventeenlands.logging_utils.defer(pack.get_fields, _DRAFT_LOG_LIMIT))
+                self._emit('draft_pack', pack)
 
             except Exception as e:
                 self._log_error(
-                    message=f'Error {e} parsing draft pack from {json_obj}',
+                    handler='__handle_bot_draft_pack',
+                    message=f'Error {e} parsing draft pack from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                     error=e,
-                    stacktrace=traceback.format_exc(),
                 )
 
     def __handle_bot_draft_pick(self, json_obj):
@@ -1043,21 +1615,22 @@ class Follower:
             self.cur_draft_event = json_obj['EventName']
             card_id = json_obj.get('CardId')
             card_ids = json_obj.get('CardIds')
-            pick = {
-                'event_name': json_obj['EventName'],
-                'pack_number': int(json_obj['PackNumber']),
-                'pick_number': int(json_obj['PickNumber']),
-                'card_id': None if card_id is None else int(card_id),
-                'card_ids': None if card_ids is None else [int(x) for x in card_ids],
-            }
-            logger.info(f'Draft pick: {pick}')
-            self._api_client.submit_draft_pick(self._add_base_api_data(pick))
+            pick = seventeenlands.records.DraftPick(
+                self._get_envelope(),
+                event_name=json_obj['EventName'],
+                pack_number=int(json_obj['PackNumber']),
+                pick_number=int(json_obj['PickNumber']),
+                card_id=None if card_id is None else int(card_id),
+                card_ids=None if card_ids is None else [int(x) for x in card_ids],
+            )
+            logger.info('Draft pick: %s', seventeenlands.logging_utils.defer(pick.get_fields, _DRAFT_LOG_LIMIT))
+            self._emit('draft_pick', pick)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing draft pick from {json_obj}',
+                handler='__handle_bot_draft_pick',
+                message=f'Error {e} parsing draft pick from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_joined_pod(self, json_obj):
@@ -1070,9 +1643,9 @@ class Follower:
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing join pod event from {json_obj}',
+                handler='__handle_joined_pod',
+                message=f'Error {e} parsing join pod event from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_joined_event_response(self, json_obj):
@@ -1080,14 +1653,14 @@ class Follower:
         self.__clear_game_data()
 
         try:
-            self._api_client.submit_joined_event(self._add_base_api_data({"payload": json_obj}))
+            self._emit('joined_event', seventeenlands.records.JoinedEvent(self._get_envelope(), payload=json_obj))
             logger.info(f'Joined event successfully')
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing join event response from {json_obj}',
+                handler='__handle_joined_event_response',
+                message=f'Error {e} parsing join event response from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_human_draft_combined(self, json_obj):
@@ -1096,23 +1669,24 @@ class Follower:
 
         try:
             self.cur_draft_event = json_obj['EventId']
-            pack = {
-                'payload': json_obj,
-                'draft_id': json_obj['DraftId'],
-                'event_name': json_obj['EventId'],
-                'pack_number': int(json_obj['PackNumber']),
-                'pick_number': int(json_obj['PickNumber']),
-                'card_ids': json_obj['CardsInPack'],
-                'method': 'LogBusiness',
-            }
-            logger.info(f'Human draft pack (combined): {pack}')
-            self._api_client.submit_human_draft_pack(self._add_base_api_data(pack))
+            pack = seventeenlands.records.HumanDraftPack(
+                self._get_envelope(),
+                payload=json_obj,
+                draft_id=json_obj['DraftId'],
+                event_name=json_obj['EventId'],
+                pack_number=int(json_obj['PackNumber']),
+                pick_number=int(json_obj['PickNumber']),
+                card_ids=json_obj['CardsInPack'],
+                method='LogBusiness',
+            )
+            logger.info('Human draft pack (combined): %s', seventeenlands.logging_utils.defer(pack.get_fields, _DRAFT_LOG_LIMIT))
+            self._emit('human_draft_pack', pack)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing human draft pack from {json_obj}',
+                handler='__handle_human_draft_combined',
+                message=f'Error {e} parsing human draft pack from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
         try:
@@ -1121,24 +1695,25 @@ class Follower:
             pick_id = None
 
         try:
-            pick = {
-                'payload': json_obj,
-                'draft_id': json_obj['DraftId'],
-                'event_name': json_obj['EventId'],
-                'pack_number': int(json_obj['PackNumber']),
-                'pick_number': int(json_obj['PickNumber']),
-                'card_id': pick_id,
-                'auto_pick': json_obj['AutoPick'],
-                'time_remaining': json_obj['TimeRemainingOnPick'],
-            }
-            logger.info(f'Human draft pick (combined): {pick}')
-            self._api_client.submit_human_draft_pick(self._add_base_api_data(pick))
+            pick = seventeenlands.records.HumanDraftPick(
+                self._get_envelope(),
+                payload=json_obj,
+                draft_id=json_obj['DraftId'],
+                event_name=json_obj['EventId'],
+                pack_number=int(json_obj['PackNumber']),
+                pick_number=int(json_obj['PickNumber']),
+                card_id=pick_id,
+                auto_pick=json_obj['AutoPick'],
+                time_remaining=json_obj['TimeRemainingOnPick'],
+            )
+            logger.info('Human draft pick (combined): %s', seventeenlands.logging_utils.defer(pick.get_fields, _DRAFT_LOG_LIMIT))
+            self._emit('human_draft_pick', pick)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing human draft pick from {json_obj}',
+                handler='__handle_human_draft_combined',
+                message=f'Error {e} parsing human draft pick from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_human_draft_pack(self, json_obj):
@@ -1146,23 +1721,24 @@ class Follower:
         self.__clear_game_data()
 
         try:
-            pack = {
-                'payload': json_obj,
-                'draft_id': json_obj['draftId'],
-                'event_name': self.cur_draft_event,
-                'pack_number': int(json_obj['SelfPack']),
-                'pick_number': int(json_obj['SelfPick']),
-                'card_ids': [int(x) for x in json_obj['PackCards'].split(',')],
-                'method': 'Draft.Notify',
-            }
-            logger.info(f'Human draft pack (Draft.Notify): {pack}')
-            self._api_client.submit_human_draft_pack(self._add_base_api_data(pack))
+            pack = seventeenlands.records.HumanDraftPack(
+                self._get_envelope(),
+                payload=json_obj,
+                draft_id=json_obj['draftId'],
+                event_name=self.cur_draft_event,
+                pack_number=int(json_obj['SelfPack']),
+                pick_number=int(json_obj['SelfPick']),
+                card_ids=[int(x) for x in json_obj['PackCards'].split(',')],
+                method='Draft.Notify',
+            )
+            logger.info('Human draft pack (Draft.Notify): %s', seventeenlands.logging_utils.defer(pack.get_fields, _DRAFT_LOG_LIMIT))
+            self._emit('human_draft_pack', pack)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing human draft pack from {json_obj}',
+                handler='__handle_human_draft_pack',
+                message=f'Error {e} parsing human draft pack from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_deck_submission(self, json_obj):
@@ -1171,22 +1747,23 @@ class Follower:
 
         try:
             decks = json_obj['Deck']
-            deck = {
-                'payload': json_obj,
-                'event_name': json_obj['EventName'],
-                'maindeck_card_ids': [d['cardId'] for d in decks['MainDeck'] for i in range(d['quantity'])],
-                'sideboard_card_ids': [d['cardId'] for d in decks['Sideboard'] for i in range(d['quantity'])],
-                'companion': decks['Companions'][0]['cardId'] if len(decks['Companions']) > 0 else 0,
-                'is_during_match': False,
-            }
-            logger.info(f'Deck submission (Event_SetDeck): {deck}')
-            self._api_client.submit_deck_submission(self._add_base_api_data(deck))
+            deck = seventeenlands.records.DeckSubmission(
+                self._get_envelope(),
+                payload=json_obj,
+                event_name=json_obj['EventName'],
+                maindeck_card_ids=[d['cardId'] for d in decks['MainDeck'] for i in range(d['quantity'])],
+                sideboard_card_ids=[d['cardId'] for d in decks['Sideboard'] for i in range(d['quantity'])],
+                companion=decks['Companions'][0]['cardId'] if len(decks['Companions']) > 0 else 0,
+                is_during_match=False,
+            )
+            logger.info('Deck submission (Event_SetDeck): %s', seventeenlands.logging_utils.defer(deck.get_fields, _EVENT_LOG_LIMIT))
+            self._emit('deck_submission', deck)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing deck submission from {json_obj}',
+                handler='__handle_deck_submission',
+                message=f'Error {e} parsing deck submission from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_self_rank_info(self, json_obj):
@@ -1194,19 +1771,20 @@ class Follower:
         try:
             self.cur_rank_data = json_obj
             self.cur_user = json_obj.get('playerId', self.cur_user)
-            logger.info(f'Parsed rank info for {self.cur_user}: {self.cur_rank_data}')
-            data = {
-                'rank_data': self.cur_rank_data,
-                'limited_rank': None,
-                'constructed_rank': None,
-            }
-            self._api_client.submit_rank(self._add_base_api_data(data))
+            logger.info('Parsed rank info for %s: %s', self.cur_user, seventeenlands.logging_utils.abbreviate(self.cur_rank_data, _EVENT_LOG_LIMIT))
+            data = seventeenlands.records.Rank(
+                self._get_envelope(),
+                rank_data=self.cur_rank_data,
+                limited_rank=None,
+                constructed_rank=None,
+            )
+            self._emit('rank', data)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing self rank info from {json_obj}',
+                handler='__handle_self_rank_info',
+                message=f'Error {e} parsing self rank info from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_collection(self, json_obj):
@@ -1215,11 +1793,9 @@ class Follower:
             logger.info(f'Skipping collection submission because player id is still unknown')
             return
 
-        collection = {
-            'card_counts': json_obj,
-        }
+        collection = seventeenlands.records.Collection(self._get_envelope(), card_counts=json_obj)
         logger.info(f'Collection submission of {len(json_obj)} cards')
-        self._api_client.submit_collection(self._add_base_api_data(collection))
+        self._emit('collection', collection)
 
     def __handle_inventory(self, json_obj):
         """Handle 'InventoryInfo' messages."""
@@ -1238,33 +1814,29 @@ class Follower:
                 'Boosters',
                 'Changes',
             }}
-            blob = {
-                'inventory': json_obj,
-            }
-            logger.info(f'Submitting inventory: {blob}')
-            self._api_client.submit_inventory(self._add_base_api_data(blob))
+            blob = seventeenlands.records.Inventory(self._get_envelope(), inventory=json_obj)
+            logger.info('Submitting inventory: %s', seventeenlands.logging_utils.defer(blob.get_fields, _EVENT_LOG_LIMIT))
+            self._emit('inventory', blob)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing inventory from {json_obj}',
+                handler='__handle_inventory',
+                message=f'Error {e} parsing inventory from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __handle_player_progress(self, json_obj):
         """Handle mastery pass messages."""
         try:
-            blob = {
-                'progress': json_obj,
-            }
+            blob = seventeenlands.records.PlayerProgress(self._get_envelope(), progress=json_obj)
             logger.info(f'Submitting mastery progress')
-            self._api_client.submit_player_progress(self._add_base_api_data(blob))
+            self._emit('player_progress', blob)
 
         except Exception as e:
             self._log_error(
-                message=f'Error {e} parsing mastery progress from {json_obj}',
+                handler='__handle_player_progress',
+                message=f'Error {e} parsing mastery progress from {seventeenlands.logging_utils.abbreviate(json_obj, _ERROR_LOG_LIMIT)}',
                 error=e,
-                stacktrace=traceback.format_exc(),
             )
 
     def __reset_current_user(self):
@@ -1288,6 +1860,34 @@ class Follower:
         self.full_screen_name = self.disconnected_full_screen_name
         self.cur_rank_data = self.disconnected_rank
 
+    # The handler of each kind of entry named by classify_blob, and how its arguments are
+    # taken from the entry's payload and time
+    _BLOB_HANDLERS = {
+        'login': (__handle_login, _payload_arguments),
+        'joined_pod': (__handle_joined_pod, _payload_arguments),
+        'joined_event_response': (__handle_joined_event_response, _payload_arguments),
+        'bot_draft_pack': (__handle_bot_draft_pack, _payload_arguments),
+        'bot_draft_pick': (__handle_bot_draft_pick, lambda blob, timestamp: (blob['PickInfo'],)),
+        'human_draft_combined': (__handle_human_draft_combined, _payload_arguments),
+        'log_business_game_end': (__handle_log_business_game_end, _payload_arguments),
+        'human_draft_pack': (__handle_human_draft_pack, _payload_arguments),
+        'deck_submission': (__handle_deck_submission, _payload_arguments),
+        'ongoing_events': (__handle_ongoing_events, _payload_arguments),
+        'claim_prize': (__handle_claim_prize, _payload_arguments),
+        'event_course': (__handle_event_course, _payload_arguments),
+        'screen_name': (__update_screen_name, lambda blob, timestamp: (blob['authenticateResponse']['screenName'],)),
+        'match_state_changed': (__handle_match_state_changed, _payload_arguments),
+        'gre_to_client_messages': (__handle_gre_to_client_event, lambda blob, timestamp: (blob, timestamp)),
+        'client_to_gre_message': (__handle_client_to_gre_message, lambda blob, timestamp: (blob.get('payload', {}), timestamp)),
+        'client_to_gre_ui_message': (__handle_client_to_gre_ui_message, lambda blob, timestamp: (blob.get('payload', {}), timestamp)),
+        'self_rank_info': (__handle_self_rank_info, _payload_arguments),
+        'collection': (__handle_collection, _payload_arguments),
+        'inventory': (__handle_inventory, lambda blob, timestamp: (blob['DTO_InventoryInfo'],)),
+        'player_progress': (__handle_player_progress, _payload_arguments),
+        'reset_current_user': (__reset_current_user, _no_arguments),
+        'reconnect_result': (__handle_reconnect_result, _no_arguments),
+    }
+
 
 def validate_uuid_v4(maybe_uuid):
     if maybe_uuid is None:
@@ -1433,38 +2033,167 @@ def verify_version(host, prompt_if_update_required):
     return False
 
 
-def processing_loop(args, token):
-    filepaths = POSSIBLE_CURRENT_FILEPATHS
-    if args.log_file is not None:
-        filepaths = (args.log_file, )
+def get_offset_range(filename, args, token):
+    """
+    Find the part of a log covered by the --start_time/--end_time/--match_id/--draft_id options,
+    indexing the log first if it has not been indexed yet.
 
-    follow = not args.once
+    :returns: The log_index.OffsetRange to parse, or None if the match or draft is not in the log.
+    """
+    whole_file = seventeenlands.log_index.OffsetRange(0, None, None)
+    if not (args.start_time or args.end_time or args.match_id or args.draft_id):
+        return whole_file
+
+    index = seventeenlands.log_index.load_for_file(filename)
+    if index is None:
+        return whole_file
+
+    if args.match_id:
+        key = (seventeenlands.log_index.MATCH, args.match_id)
+    elif args.draft_id:
+        key = (seventeenlands.log_index.DRAFT, args.draft_id)
+    else:
+        key = None
+
+    is_missing = index.indexed_offset == 0 or (
+        key is not None
+        and index.get_range(*key) is None
+        and index.indexed_offset < os.path.getsize(filename)
+    )
+    if is_missing:
+        logger.info(f'Indexing {filename}')
+        Follower(token, host=args.host, sinks=[]).parse_log(filename=filename, follow=False)
+        index = seventeenlands.log_index.load_for_file(filename)
 
-    follower = Follower(token, host=args.host)
+    if key is None:
+        return index.get_time_range(args.start_time, args.end_time)
+    offset_range = index.get_range(*key)
+    if offset_range is None:
+        logger.warning(f'Found no {key[0]} {key[1]} in {filename}')
+    return offset_range
+
+
+def has_range_args(args):
+    return bool(args.start_time or args.end_time or args.match_id or args.draft_id)
+
+
+def follow_log(follower, args):
+    """
+    Follow the given log, or else the most active of the possible logs, switching to another
+    one when it becomes the active log. Runs until interrupted.
+    """
+    if args.log_file is not None:
+        if not os.path.exists(args.log_file):
+            logger.warning(f'Waiting for {args.log_file} to be created')
+        logger.info(f'Following along {args.log_file}')
+        follower.parse_log(filename=args.log_file, follow=True)
+        return
+
+    discovery = seventeenlands.log_discovery.LogDiscovery(POSSIBLE_CURRENT_FILEPATHS)
+    filename = discovery.wait_for_log()
 
     # if running in "normal" mode...
-    if (
-        args.log_file is None
-        and args.host == seventeenlands.api_client.DEFAULT_HOST
-        and follow
-    ):
+    if args.host == seventeenlands.api_client.DEFAULT_HOST:
         # parse previous log once at startup to catch up on any missed events
-        for filename in POSSIBLE_PREVIOUS_FILEPATHS:
-            if os.path.exists(filename):
-                logger.info(f'Parsing the previous log {filename} once')
-                follower.parse_log(filename=filename, follow=False)
-                break
+        previous_filename = os.path.join(os.path.dirname(filename), PREVIOUS_LOG)
+        if os.path.exists(previous_filename):
+            logger.info(f'Parsing the previous log {previous_filename} once')
+            follower.parse_log(filename=previous_filename, follow=False)
 
-    # tail and parse current logfile to handle ongoing events
-    any_found = False
-    for filename in filepaths:
-        if os.path.exists(filename):
-            any_found = True
+    watcher = seventeenlands.log_discovery.LogWatcher(discovery, filename, on_switch=lambda _: follower.stop())
+    watcher.start()
+    try:
+        while True:
             logger.info(f'Following along {filename}')
-            follower.parse_log(filename=filename, follow=follow)
+            follower.parse_log(filename=filename, follow=True)
+            filename = watcher.current_log
+    finally:
+        watcher.stop()
+        discovery.close()
 
-    if not any_found:
-        logger.warning("Found no files to parse. Try to find Arena's Player.log file and pass it as an argument with -l")
+
+def processing_loop(args, token):
+    follow = not args.once
+
+    sinks = []
+    if not args.no_upload:
+        sinks.append(seventeenlands.sinks.ApiSink(seventeenlands.api_client.ApiClient(
+            host=args.host,
+            max_requests_per_second=args.max_requests_per_second,
+        )))
+    if args.event_store:
+        logger.info(f'Storing parsed events in {args.event_store}')
+        sinks.append(seventeenlands.event_store.EventStore(args.event_store))
+    if args.output_file:
+        logger.info(f'Writing parsed events to {args.output_file}')
+        sinks.append(seventeenlands.sinks.JsonlSink(args.output_file))
+    tracer = None
+    if args.trace_sample_rate is not None:
+        tracer = seventeenlands.tracing.Tracer(sample_rate=args.trace_sample_rate)
+    live_state = None
+    live_state_server = None
+    if args.live_state_port is not None:
+        live_state = seventeenlands.live_state.LiveState()
+        sinks.append(live_state)
+        live_state_server = seventeenlands.live_state.LiveStateServer(live_state, args.live_state_port)
+        live_state_server.start()
+
+    parsing_options = dict(
+        max_entry_size=int(args.max_entry_size_mb * 1024 * 1024),
+        projection=seventeenlands.projection.TRIMMED_PAYLOADS if args.trim_payloads else seventeenlands.projection.FULL_PAYLOADS,
+    )
+    follower = Follower(
+        token,
+        host=args.host,
+        sinks=sinks,
+        memory_limit=None if args.memory_limit_mb is None else int(args.memory_limit_mb * 1024 * 1024),
+        live_state=live_state,
+        tracer=tracer,
+        **parsing_options,
+    )
+
+    # Following only ends when interrupted, so everything is flushed however the loop exits
+    try:
+        if follow:
+            follow_log(follower, args)
+        else:
+            if args.log_file is not None:
+                filepaths = [args.log_file]
+            else:
+                discovery = seventeenlands.log_discovery.LogDiscovery(POSSIBLE_CURRENT_FILEPATHS)
+                filepaths = [stat.path for stat in discovery.probe()]
+                discovery.close()
+            for filename in filepaths:
+                if not os.path.exists(filename):
+                    continue
+                if args.parse_workers > 1 and not has_range_args(args):
+                    # Imported here since the sharding module subclasses Follower
+                    import seventeenlands.sharding as sharding
+                    sharding.parse_sharded(
+                        follower,
+                        filename,
+                        workers=args.parse_workers,
+                        follower_options=dict(token=token, host=args.host, **parsing_options),
+                    )
+                    continue
+
+                offset_range = get_offset_range(filename, args, token)
+                if offset_range is not None:
+                    logger.info(f'Parsing {filename} from offset {offset_range.start_offset} to {offset_range.end_offset or "the end"}')
+                    follower.parse_log(filename=filename, follow=False, offset_range=offset_range)
+            if not any(os.path.exists(filename) for filename in filepaths):
+                logger.warning("Found no files to parse. Try to find Arena's Player.log file and pass it as an argument with -l")
+    finally:
+        logger.info('Waiting for pending submissions to be sent')
+        follower.close()
+        if live_state_server is not None:
+            live_state_server.close()
+        if tracer is not None:
+            tracer.log_summary()
+            tracer.export(os.path.join(
+                seventeenlands.logging_utils.get_log_folder(),
+                f'traces-{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}.json',
+            ))
 
     logger.info(f'Exiting')
 
@@ -1482,11 +2211,56 @@ def main():
                         help=f'Token of the user. If not specified, will use the token at {CONFIG_FILE}')
     parser.add_argument('--once', action='store_true',
         help='Whether to stop after parsing the file once (default is to continue waiting for updates to the file)')
+    parser.add_argument('--max_requests_per_second', type=float, default=seventeenlands.api_client.DEFAULT_MAX_REQUESTS_PER_SECOND,
+        help='Maximum rate of submissions to the host. Draft and game submissions are always sent before other updates.')
+    parser.add_argument('--profile', type=float, nargs='?', const=seventeenlands.profiling_utils.DEFAULT_PROFILE_DURATION.total_seconds(),
+        help='Profile parsing and uploads for this many seconds after startup. Profiles are saved to '
+        + f'{seventeenlands.logging_utils.get_log_folder()}. A profile can also be captured at any time by '
+        + 'sending the process SIGUSR1 (SIGBREAK on Windows).')
+    parser.add_argument('--output_file',
+        help='Also append every parsed event to this gzip-compressed JSON lines file')
+    parser.add_argument('--event_store', nargs='?', const=seventeenlands.event_store.DEFAULT_FILENAME,
+        help='Also store every parsed event in a local SQLite database, which can be queried or re-uploaded with '
+        + f'python -m seventeenlands.event_store. If no path is given, will use {seventeenlands.event_store.DEFAULT_FILENAME}')
+    parser.add_argument('--no_upload', action='store_true',
+        help='Do not submit anything to the host (e.g. to only write events with --output_file)')
+
+    parser.add_argument('--max_entry_size_mb', type=float, default=DEFAULT_MAX_ENTRY_SIZE / 1024 / 1024,
+        help='Skip log entries larger than this many megabytes instead of holding them in memory')
+    parser.add_argument('--memory_limit_mb', type=float,
+        help='Log the top memory allocators and drop the current game\'s history when memory use exceeds this many megabytes')
+    parser.add_argument('--trim_payloads', action='store_true',
+        help='Leave out fields of the parsed payloads that duplicate other fields (by default every field is sent)')
+    parser.add_argument('--live_state_port', type=int,
+        help='Serve the live draft, match and rank state to local tools on this localhost port, '
+        + 'at /state (JSON) and /events (server-sent events)')
+    parser.add_argument('--trace_sample_rate', type=float,
+        help='Trace this fraction of events from the log to the server, logging latency by stage every 10 minutes '
+        + 'and writing the histograms and slowest traces to the log folder on exit')
+    parser.add_argument('--parse_workers', type=int, default=1,
+        help='With --once and no range, parse the log in this many worker processes, split between matches')
+    range_group = parser.add_mutually_exclusive_group()
+    range_group.add_argument('--start_time', type=dateutil.parser.parse,
+        help='With --once, only parse entries logged from this (local) time on, using the log index to seek')
+    range_group.add_argument('--match_id', help='With --once, only parse the entries of this match')
+    range_group.add_argument('--draft_id', help='With --once, only parse the entries of this draft')
+    parser.add_argument('--end_time', type=dateutil.parser.parse,
+        help='With --once, only parse entries logged up to this (local) time')
 
     args = parser.parse_args()
+    if has_range_args(args) and not args.once:
+        parser.error('--start_time, --end_time, --match_id and --draft_id require --once')
+    if args.end_time and (args.match_id or args.draft_id):
+        parser.error('--end_time cannot be combined with --match_id or --draft_id')
+
+    signal_name = seventeenlands.profiling_utils.install_signal_trigger()
+    if signal_name is not None:
+        logger.info(f'Send {signal_name} to this process to capture a profile')
+    if args.profile:
+        seventeenlands.profiling_utils.request_profile(datetime.timedelta(seconds=args.profile))
 
     check_count = 0
-    while not verify_version(
+    while not args.no_upload and not verify_version(
         host=args.host,
         prompt_if_update_required=check_count % UPDATE_PROMPT_FREQUENCY == 0,
     ):
@@ -1498,6 +2272,9 @@ def main():
 
     processing_loop(args, token)
 
+    seventeenlands.profiling_utils.finish()
+    seventeenlands.logging_utils.shutdown()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,275 @@
+import cProfile
+import collections
+import datetime
+import io
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from typing import Counter, DefaultDict, List, Optional, Tuple
+
+import seventeenlands.logging_utils
+
+logger = seventeenlands.logging_utils.get_logger('profiling_utils')
+
+DEFAULT_PROFILE_DURATION = datetime.timedelta(seconds=60)
+
+_DISPATCH_FUNCTION_NAME = '__handle_blob'
+_SUMMARY_FUNCTION_COUNT = 40
+_SAMPLED_FUNCTION_COUNT = 15
+_SAMPLE_INTERVAL_SECONDS = 0.01
+_PROFILE_TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+# A function in a sampled stack: (filename, first line number, name)
+_FunctionKey = Tuple[str, int, str]
+
+
+class _Sampler:
+    """
+    Samples the stack of every thread at a fixed interval, from a thread of its own, counting
+    how often each function was running (self) or anywhere on the stack (cumulative).
+    """
+
+    def __init__(self, interval: float = _SAMPLE_INTERVAL_SECONDS):
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile sampler', daemon=True)
+        self.sample_counts: Counter[str] = collections.Counter()
+        self._self_counts: DefaultDict[str, Counter[_FunctionKey]] = collections.defaultdict(collections.Counter)
+        self._cumulative_counts: DefaultDict[str, Counter[_FunctionKey]] = collections.defaultdict(collections.Counter)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        sampler_thread_id = threading.get_ident()
+        while not self._stop_event.wait(self._interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_thread_id:
+                    continue
+                self._add_sample(thread_names.get(thread_id, str(thread_id)), frame)
+
+    def _add_sample(self, thread_name: str, frame):
+        self.sample_counts[thread_name] += 1
+        code = frame.f_code
+        self._self_counts[thread_name][(code.co_filename, code.co_firstlineno, code.co_name)] += 1
+        # Recursive functions count once per sample
+        on_stack = set()
+        while frame is not None:
+            code = frame.f_code
+            on_stack.add((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        self._cumulative_counts[thread_name].update(on_stack)
+
+    def get_summary(self) -> List[str]:
+        lines = []
+        for thread_name in sorted(self.sample_counts):
+            sample_count = self.sample_counts[thread_name]
+            lines.append(f'Thread {thread_name} ({sample_count} samples):')
+            lines.append(f'{"self %":>8} {"cum %":>8}  function')
+            self_counts = self._self_counts[thread_name]
+            for function_key, cumulative_count in self._cumulative_counts[thread_name].most_common(_SAMPLED_FUNCTION_COUNT):
+                filename, line_number, function_name = function_key
+                lines.append(
+                    f'{100 * self_counts[function_key] / sample_count:>8.1f} {100 * cumulative_count / sample_count:>8.1f}  '
+                    f'{function_name} ({os.path.basename(filename)}:{line_number})'
+                )
+            lines.append('')
+        return lines
+
+
+class _Profiler:
+    """
+    Captures profiling data for a bounded window.
+
+    Only one profiler may be enabled at a time (on Python 3.12+, cProfile claims
+    sys.monitoring for the whole process), so cProfile covers the first thread that calls
+    tick() within the window. Every thread, including that one, is also sampled for the
+    whole window. A timer ends the window and writes the report, whether or not that thread
+    is still ticking.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deadline: Optional[float] = None
+        self._is_active = False
+        self._profile: Optional[cProfile.Profile] = None
+        self._profile_thread_id: Optional[int] = None
+        self._profile_thread_name: Optional[str] = None
+        self._sampler: Optional[_Sampler] = None
+        self._timer: Optional[threading.Timer] = None
+        # A profile stopped by another thread, which its own thread must still unhook
+        self._stale_profile: Optional[Tuple[int, cProfile.Profile]] = None
+
+    def request(self, duration: datetime.timedelta):
+        # May be called from a signal handler, so this must not take the lock or start the timer.
+        self._deadline = time.monotonic() + duration.total_seconds()
+
+    def finish(self):
+        if self._deadline is not None:
+            self._stop()
+
+    def tick(self):
+        thread_id = threading.get_ident()
+        stale_profile = self._stale_profile
+        if stale_profile is not None and stale_profile[0] == thread_id:
+            self._stale_profile = None
+            stale_profile[1].disable()
+
+        if self._deadline is None or self._is_active:
+            return
+
+        with self._lock:
+            if self._deadline is None or self._is_active:
+                return
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger's) is already active
+                logger.warning('Only sampling threads, as another profiler is active')
+                profile = None
+            self._is_active = True
+            self._profile = profile
+            self._profile_thread_id = thread_id
+            self._profile_thread_name = threading.current_thread().name
+            self._sampler = _Sampler()
+            self._sampler.start()
+            self._schedule_stop()
+        logger.info(f'Starting profiler on thread {threading.current_thread().name}, and sampling every thread')
+
+    def _schedule_stop(self):
+        self._timer = threading.Timer(max(0.0, self._deadline - time.monotonic()), self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            deadline = self._deadline
+            if deadline is not None and time.monotonic() < deadline:
+                # The window was extended
+                self._schedule_stop()
+                return
+        self._stop()
+
+    def _stop(self):
+        with self._lock:
+            profile, self._profile = self._profile, None
+            thread_id, self._profile_thread_id = self._profile_thread_id, None
+            thread_name, self._profile_thread_name = self._profile_thread_name, None
+            sampler, self._sampler = self._sampler, None
+            timer, self._timer = self._timer, None
+            self._deadline = None
+            self._is_active = False
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+        if sampler is None:
+            return
+
+        sampler.stop()
+        if profile is not None:
+            profile.disable()
+            if thread_id != threading.get_ident():
+                # Before Python 3.12, only the profiled thread can unhook its profiler
+                self._stale_profile = (thread_id, profile)
+        _write_report(profile, thread_name, sampler)
+
+
+_profiler = _Profiler()
+
+
+def request_profile(duration: datetime.timedelta = DEFAULT_PROFILE_DURATION):
+    """Start (or extend) a profiling window of the given duration."""
+    _profiler.request(duration)
+
+
+def tick():
+    """
+    Start profiling the calling thread (and sampling every thread) if a window was requested.
+    Should be called regularly from hot loops.
+    """
+    _profiler.tick()
+
+
+def finish():
+    """End any in-progress profiling window early (e.g. on shutdown) so its report is written."""
+    _profiler.finish()
+
+
+def install_signal_trigger(duration: datetime.timedelta = DEFAULT_PROFILE_DURATION) -> Optional[str]:
+    """
+    Start a profiling window whenever the process receives SIGUSR1 (or SIGBREAK on Windows).
+
+    :returns: The name of the signal that was installed, if any.
+    """
+    for signal_name in ('SIGUSR1', 'SIGBREAK'):
+        signal_number = getattr(signal, signal_name, None)
+        if signal_number is None:
+            continue
+        try:
+            signal.signal(signal_number, lambda signum, frame: request_profile(duration))
+        except ValueError:
+            # Only the main thread may install signal handlers
+            return None
+        return signal_name
+    return None
+
+
+def _get_dispatch_summary(stats: pstats.Stats) -> List[str]:
+    """Summarize the calls made directly from Follower.__handle_blob, i.e. the per-message handler targets."""
+    rows = []
+    for (filename, line_number, function_name), (_, _, _, _, callers) in stats.stats.items():
+        for (_, _, caller_name), caller_stats in callers.items():
+            if caller_name != _DISPATCH_FUNCTION_NAME:
+                continue
+            _, call_count, total_time, cumulative_time = caller_stats
+            rows.append((cumulative_time, call_count, total_time, function_name))
+
+    lines = [f'{"calls":>10} {"tottime":>10} {"cumtime":>10} {"percall":>10}  target']
+    for cumulative_time, call_count, total_time, function_name in sorted(rows, reverse=True):
+        lines.append(
+            f'{call_count:>10} {total_time:>10.3f} {cumulative_time:>10.3f} '
+            f'{cumulative_time / call_count:>10.6f}  {function_name}'
+        )
+    return lines
+
+
+def _write_report(profile: Optional[cProfile.Profile], profiled_thread_name: str, sampler: _Sampler):
+    try:
+        base_filename = os.path.join(
+            seventeenlands.logging_utils.get_log_folder(),
+            f'profile-{datetime.datetime.utcnow().strftime(_PROFILE_TIME_FORMAT)}',
+        )
+        sampled_thread_names = ', '.join(sorted(sampler.sample_counts))
+        summary = io.StringIO()
+        summary.write(f'Sampled threads: {sampled_thread_names}\n')
+        if profile is not None:
+            summary.write(f'Profiled thread (cProfile): {profiled_thread_name}\n\n')
+            stats = pstats.Stats(profile)
+            stats.dump_stats(f'{base_filename}.prof')
+            summary.write('Per-target summary (calls from Follower.__handle_blob):\n')
+            summary.write('\n'.join(_get_dispatch_summary(stats)))
+            summary.write('\n\n')
+            stats.stream = summary
+            stats.sort_stats('cumulative').print_stats(_SUMMARY_FUNCTION_COUNT)
+        else:
+            summary.write('Profiled thread (cProfile): none, as another profiler was active\n')
+        summary.write(f'\nSamples of every thread, every {_SAMPLE_INTERVAL_SECONDS * 1000:.0f}ms:\n\n')
+        summary.write('\n'.join(sampler.get_summary()))
+        with open(f'{base_filename}.txt', 'w') as f:
+            f.write(summary.getvalue())
+
+        if profile is not None:
+            logger.info(f'Saved profile of thread {profiled_thread_name} to {base_filename}.prof and summary of threads {sampled_thread_names} to {base_filename}.txt')
+        else:
+            logger.info(f'Saved summary of threads {sampled_thread_names} to {base_filename}.txt')
+
+    except Exception:
+        logger.exception('Error writing profile')
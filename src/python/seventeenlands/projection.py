@@ -0,0 +1,164 @@
+"""
+Declarative trimming of redundant fields from events before they are serialized.
+
+Many events carry the raw log payload next to the fields extracted from it, and game
+histories carry every field of every GRE message. The projections below list, per event kind
+and per GRE message type, the fields that can be dropped. Fields are given as dotted paths, and
+objects along a path are copied rather than modified, so parser state is never affected.
+
+Trimming is opt-in: by default every field is sent.
+"""
+
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+import seventeenlands.records
+
+# Fields of each event kind that duplicate other fields of the event
+EVENT_PROJECTIONS: Dict[str, Iterable[str]] = {
+    'draft_pack': (
+        'payload.EventName',
+        'payload.PackNumber',
+        'payload.PickNumber',
+        'payload.DraftPack',
+    ),
+    'human_draft_pack': (
+        # Combined LogBusiness messages
+        'payload.DraftId',
+        'payload.EventId',
+        'payload.PackNumber',
+        'payload.PickNumber',
+        'payload.CardsInPack',
+        # Sent with the human_draft_pick from the same message
+        'payload.PickGrpId',
+        'payload.AutoPick',
+        'payload.TimeRemainingOnPick',
+        # Draft.Notify messages
+        'payload.draftId',
+        'payload.SelfPack',
+        'payload.SelfPick',
+        'payload.PackCards',
+    ),
+    'human_draft_pick': (
+        'payload.DraftId',
+        'payload.EventId',
+        'payload.PackNumber',
+        'payload.PickNumber',
+        'payload.PickGrpId',
+        'payload.AutoPick',
+        'payload.TimeRemainingOnPick',
+        # Sent with the human_draft_pack from the same message
+        'payload.CardsInPack',
+    ),
+    'deck_submission': (
+        'payload.EventName',
+        'payload.Deck.MainDeck',
+        'payload.Deck.Sideboard',
+    ),
+    'event_course_submission': (
+        'payload.InternalEventName',
+        'payload.DraftId',
+        'payload.CourseId',
+        'payload.CardPool',
+    ),
+}
+
+_GAME_STATE_FIELDS = (
+    'gameStateMessage.annotations',
+    'gameStateMessage.timers',
+)
+
+# Fields of GRE messages in game histories that are not used
+GRE_MESSAGE_PROJECTIONS: Dict[str, Iterable[str]] = {
+    'GREMessageType_GameStateMessage': _GAME_STATE_FIELDS,
+    'GREMessageType_QueuedGameStateMessage': _GAME_STATE_FIELDS,
+}
+
+
+def _compile(paths: Iterable[str]) -> Dict[str, Any]:
+    """Turn dotted paths into a tree of keys, where None marks a key to drop."""
+    tree: Dict[str, Any] = {}
+    for path in paths:
+        *parents, leaf = path.split('.')
+        node = tree
+        for key in parents:
+            node = node.setdefault(key, {})
+            if node is None:
+                break
+        else:
+            node[leaf] = None
+    return tree
+
+
+def _drop(value: Any, tree: Dict[str, Any]) -> Any:
+    if type(value) != dict:
+        return value
+    result = None
+    for key, subtree in tree.items():
+        if key not in value:
+            continue
+        if subtree is None:
+            projected = None
+        else:
+            projected = _drop(value[key], subtree)
+            if projected is value[key]:
+                continue
+        if result is None:
+            result = dict(value)
+        if subtree is None:
+            del result[key]
+        else:
+            result[key] = projected
+    return value if result is None else result
+
+
+def _drop_record_fields(record: seventeenlands.records.EventRecord, tree: Dict[str, Any]) -> seventeenlands.records.EventRecord:
+    changes = {}
+    for key, subtree in tree.items():
+        if key not in record.FIELDS or key not in record:
+            continue
+        if subtree is None:
+            changes[key] = seventeenlands.records.OMITTED
+        else:
+            projected = _drop(record[key], subtree)
+            if projected is not record[key]:
+                changes[key] = projected
+    return record.replace(**changes) if changes else record
+
+
+class Projection:
+    """
+    Removes fields from events and game history messages.
+
+    :param event_fields:       Dotted paths of fields to drop, by event kind.
+    :param gre_message_fields: Dotted paths of fields to drop, by GRE message type.
+    """
+
+    def __init__(
+        self,
+        event_fields: Optional[Dict[str, Iterable[str]]] = None,
+        gre_message_fields: Optional[Dict[str, Iterable[str]]] = None,
+    ):
+        if event_fields is None:
+            event_fields = EVENT_PROJECTIONS
+        if gre_message_fields is None:
+            gre_message_fields = GRE_MESSAGE_PROJECTIONS
+        self._event_trees = {kind: _compile(paths) for kind, paths in event_fields.items()}
+        self._gre_message_trees = {kind: _compile(paths) for kind, paths in gre_message_fields.items()}
+
+    def project_event(self, kind: str, blob: Mapping[str, Any]) -> Mapping[str, Any]:
+        tree = self._event_trees.get(kind)
+        if tree is None:
+            return blob
+        if isinstance(blob, seventeenlands.records.EventRecord):
+            return _drop_record_fields(blob, tree)
+        return _drop(blob, tree)
+
+    def project_gre_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        tree = self._gre_message_trees.get(message.get('type'))
+        return message if tree is None else _drop(message, tree)
+
+
+# The default: every field is sent, as the server has always received them
+FULL_PAYLOADS = Projection(event_fields={}, gre_message_fields={})
+# Opt-in: the fields listed above are dropped
+TRIMMED_PAYLOADS = Projection()
@@ -0,0 +1,214 @@
+"""
+Typed records for the events the follower submits most, and for the envelope shared by every
+event.
+
+An event record only holds its own fields and a reference to the envelope, which the
+Follower builds once for each change of player or log time rather than once per event. The
+envelope's JSON is also rendered once, so serializing a record only encodes its own fields.
+Records are read-only mappings with the same keys as the dicts they replace, so sinks and
+projections can treat them like any other event blob.
+"""
+
+import collections.abc
+import json
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
+
+_ENCODER = json.JSONEncoder()
+
+
+class _Omitted:
+    """Marks a record field left out of the event, e.g. by a projection."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'OMITTED'
+
+
+OMITTED = _Omitted()
+
+
+class Envelope:
+    """The fields sent with every event: who sent it, with which client, and when it was logged."""
+
+    __slots__ = ('token', 'client_version', 'player_id', 'time', 'utc_time', 'event_time', 'raw_time', '_serialized')
+
+    FIELDS = ('token', 'client_version', 'player_id', 'time', 'utc_time', 'event_time', 'raw_time')
+
+    def __init__(
+        self,
+        token: Optional[str],
+        client_version: str,
+        player_id: Optional[str],
+        time: str,
+        utc_time: str,
+        event_time: Any,
+        raw_time: Optional[str],
+    ):
+        self.token = token
+        self.client_version = client_version
+        self.player_id = player_id
+        self.time = time
+        self.utc_time = utc_time
+        self.event_time = event_time
+        self.raw_time = raw_time
+        self._serialized: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def serialize_fields(self) -> str:
+        """The envelope's members as a JSON fragment, without braces."""
+        if self._serialized is None:
+            self._serialized = _ENCODER.encode(self.to_dict())[1:-1]
+        return self._serialized
+
+
+# Event records by event kind
+RECORD_TYPES: Dict[str, type] = {}
+
+
+class EventRecord(collections.abc.Mapping):
+    """
+    An event of a fixed shape. Subclasses set `kind` and list their fields in `__slots__`.
+
+    :param envelope: The envelope fields of the event, which come before its own fields.
+    """
+
+    __slots__ = ('envelope',)
+
+    kind = ''
+    # The record's own fields, from __slots__
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = tuple(cls.__slots__)
+        RECORD_TYPES[cls.kind] = cls
+
+    def __init__(self, envelope: Envelope, **fields):
+        self.envelope = envelope
+        for field in self.FIELDS:
+            setattr(self, field, fields.pop(field, OMITTED))
+        if fields:
+            raise TypeError(f'Unknown {self.kind} fields: {", ".join(fields)}')
+
+    def get_fields(self) -> Dict[str, Any]:
+        """The event's own fields, without the envelope."""
+        fields = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not OMITTED:
+                fields[field] = value
+        return fields
+
+    def replace(self, **changes) -> 'EventRecord':
+        """A copy of the record with some of its fields changed (or set to OMITTED)."""
+        record = object.__new__(type(self))
+        record.envelope = self.envelope
+        for field in self.FIELDS:
+            setattr(record, field, changes[field] if field in changes else getattr(self, field))
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.envelope.to_dict(), **self.get_fields()}
+
+    def serialize(self) -> bytes:
+        """The event as JSON, the same as json.dumps(self.to_dict())."""
+        fields = self.get_fields()
+        if not fields:
+            return f'{{{self.envelope.serialize_fields()}}}'.encode('utf8')
+        return f'{{{self.envelope.serialize_fields()}, {_ENCODER.encode(fields)[1:]}'.encode('utf8')
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not OMITTED:
+                return value
+        elif key in Envelope.FIELDS:
+            return getattr(self.envelope, key)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from Envelope.FIELDS
+        for field in self.FIELDS:
+            if getattr(self, field) is not OMITTED:
+                yield field
+
+    def __len__(self) -> int:
+        return len(Envelope.FIELDS) + sum(1 for field in self.FIELDS if getattr(self, field) is not OMITTED)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.get_fields()!r})'
+
+
+def serialize(blob: Mapping[str, Any]) -> bytes:
+    """Serialize an event blob, either a record or a dict."""
+    if isinstance(blob, EventRecord):
+        return blob.serialize()
+    return json.dumps(blob).encode('utf8')
+
+
+class DraftPack(EventRecord):
+    kind = 'draft_pack'
+    __slots__ = ('payload', 'event_name', 'pack_number', 'pick_number', 'card_ids')
+
+
+class DraftPick(EventRecord):
+    kind = 'draft_pick'
+    __slots__ = ('event_name', 'pack_number', 'pick_number', 'card_id', 'card_ids')
+
+
+class HumanDraftPack(EventRecord):
+    kind = 'human_draft_pack'
+    __slots__ = ('payload', 'draft_id', 'event_name', 'pack_number', 'pick_number', 'card_ids', 'method')
+
+
+class HumanDraftPick(EventRecord):
+    kind = 'human_draft_pick'
+    __slots__ = ('payload', 'draft_id', 'event_name', 'pack_number', 'pick_number', 'card_id', 'auto_pick', 'time_remaining')
+
+
+class DeckSubmission(EventRecord):
+    kind = 'deck_submission'
+    __slots__ = ('payload', 'event_name', 'maindeck_card_ids', 'sideboard_card_ids', 'companion', 'is_during_match')
+
+
+class EventCourseSubmission(EventRecord):
+    kind = 'event_course_submission'
+    __slots__ = ('payload', 'event_name', 'draft_id', 'course_id', 'card_pool')
+
+
+class JoinedEvent(EventRecord):
+    kind = 'joined_event'
+    __slots__ = ('payload',)
+
+
+class EventEnded(EventRecord):
+    kind = 'event_ended'
+    __slots__ = ('event_name',)
+
+
+class OngoingEvents(EventRecord):
+    kind = 'ongoing_events'
+    __slots__ = ('courses',)
+
+
+class Rank(EventRecord):
+    kind = 'rank'
+    __slots__ = ('rank_data', 'limited_rank', 'constructed_rank')
+
+
+class Collection(EventRecord):
+    kind = 'collection'
+    __slots__ = ('card_counts',)
+
+
+class Inventory(EventRecord):
+    kind = 'inventory'
+    __slots__ = ('inventory',)
+
+
+class PlayerProgress(EventRecord):
+    kind = 'player_progress'
+    __slots__ = ('progress',)
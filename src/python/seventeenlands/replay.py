@@ -0,0 +1,322 @@
+"""
+Replays a recorded Player.log into a Follower under virtual time.
+
+The recorded entries are appended to a scratch log at real, accelerated or maximum speed
+while the Follower tails it in follow mode. Truncation and rotation of the log can be
+simulated at given entries. All sleeps (the follower's polling and any retries) happen on a
+VirtualClock, so a replay of hours of play finishes in seconds and is fully deterministic.
+
+Events are submitted by a real ApiClient on the same clock, so its scheduling, rate limits
+and retries are part of the replay. Only the HTTP requests are captured, by a
+RecordingTransport that acknowledges them instead of sending them. Every append and request
+is written to a timeline, from which event-to-submission latency is measured.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+import seventeenlands.api_client
+import seventeenlands.clock_utils
+import seventeenlands.logging_utils
+import seventeenlands.mtga_follower
+import seventeenlands.records
+import seventeenlands.sinks
+
+logger = seventeenlands.logging_utils.get_logger('replay')
+
+_REPLAY_TOKEN = 'replay'
+_REPLAY_HOST = 'replay'
+# How many follower polls to allow after the last entry is written before stopping
+_IDLE_POLLS_BEFORE_STOP = 4
+
+
+class RecordingTransport:
+    """
+    Stands in for requests.post under the replay's ApiClient. Each request is recorded on the
+    timeline, with the log entry its event came from, and acknowledged without being sent.
+    """
+
+    def __init__(self, clock: seventeenlands.clock_utils.Clock, timeline: List[Dict[str, Any]]):
+        self._clock = clock
+        self._timeline = timeline
+        # Entry line ranges of emitted events not yet submitted, by the event's serialized body
+        self._entry_lines_by_body: Dict[bytes, Deque[List[int]]] = defaultdict(deque)
+        self.requests: List[Tuple[str, bytes]] = []
+
+    def add_event(self, body: bytes, entry_lines: Tuple[int, int]):
+        self._entry_lines_by_body[body].append(list(entry_lines))
+
+    def __call__(self, url: str, json: Any = None, data: Optional[bytes] = None, headers: Optional[Dict] = None, **kwargs) -> requests.Response:
+        endpoint = url[len(_REPLAY_HOST) + 1:]
+        if data is None:
+            body = seventeenlands.records.serialize(json)
+        elif headers is not None and headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(data)
+        else:
+            body = data
+        self.requests.append((endpoint, body))
+
+        pending_entry_lines = self._entry_lines_by_body.get(body)
+        entry_lines = pending_entry_lines.popleft() if pending_entry_lines else None
+        if not pending_entry_lines:
+            self._entry_lines_by_body.pop(body, None)
+        self._timeline.append({
+            'type': 'submit',
+            'time': self._clock.time(),
+            'endpoint': endpoint,
+            'entry_lines': entry_lines,
+        })
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{}'
+        return response
+
+
+class _EntryRecordingSink(seventeenlands.sinks.Sink):
+    """Notes the log entry each event came from, so its request can be traced back to it."""
+
+    def __init__(self, transport: RecordingTransport):
+        self._transport = transport
+        self._follower: Optional[seventeenlands.mtga_follower.Follower] = None
+
+    def attach(self, follower: 'seventeenlands.mtga_follower.Follower'):
+        self._follower = follower
+
+    def emit(self, event: seventeenlands.sinks.Event):
+        entry_lines = (0, 0) if self._follower is None else self._follower.current_entry_line_range
+        self._transport.add_event(event.serialize(), entry_lines)
+
+
+def split_entries(lines: Sequence[str]) -> List[Tuple[Optional[float], List[str]]]:
+    """Group log lines into entries, each starting at a log-start line, with its log timestamp (if any)."""
+    entries: List[Tuple[Optional[float], List[str]]] = []
+    for line in lines:
+        if entries and not seventeenlands.mtga_follower.LOG_START_REGEX_UNTIMED.match(line):
+            entries[-1][1].append(line)
+            continue
+
+        log_time = None
+        timed_match = seventeenlands.mtga_follower.LOG_START_REGEX_TIMED.match(line)
+        if timed_match:
+            try:
+                log_time = seventeenlands.mtga_follower.extract_time(timed_match.group(2)).timestamp()
+            except ValueError:
+                pass
+        entries.append((log_time, [line]))
+    return entries
+
+
+class LogReplayer:
+    """
+    Appends recorded entries to a scratch log whenever the clock advances.
+
+    :param speed: Multiple of the recorded pace to replay at, or None to append one entry per
+                  follower poll regardless of the recorded timestamps.
+    """
+
+    def __init__(
+        self,
+        entries: List[Tuple[Optional[float], List[str]]],
+        log_path: str,
+        clock: seventeenlands.clock_utils.VirtualClock,
+        timeline: List[Dict[str, Any]],
+        speed: Optional[float],
+        truncate_at_entries: Sequence[int] = (),
+        rotate_at_entries: Sequence[int] = (),
+    ):
+        self._entries = entries
+        self._log_path = log_path
+        self._previous_log_path = os.path.join(os.path.dirname(log_path), seventeenlands.mtga_follower.PREVIOUS_LOG)
+        self._clock = clock
+        self._timeline = timeline
+        self._speed = speed
+        self._truncate_at_entries = set(truncate_at_entries)
+        self._rotate_at_entries = set(rotate_at_entries)
+
+        self._start_time = clock.time()
+        self._first_log_time = next((t for t, _ in entries if t is not None), None)
+        self._next_entry_index = 0
+        self._idle_polls = 0
+        self._follower: Optional[seventeenlands.mtga_follower.Follower] = None
+        # Write times of each line, per generation of the log file
+        self.line_write_times: List[List[float]] = [[]]
+
+    def attach(self, follower: 'seventeenlands.mtga_follower.Follower'):
+        self._follower = follower
+
+    def _get_due_time(self, index: int) -> float:
+        log_time = self._entries[index][0]
+        if log_time is None or self._first_log_time is None:
+            return self._clock.time()
+        return self._start_time + (log_time - self._first_log_time) / self._speed
+
+    def on_clock_advanced(self, now: float):
+        if self._next_entry_index >= len(self._entries):
+            self._idle_polls += 1
+            if self._idle_polls >= _IDLE_POLLS_BEFORE_STOP and self._follower is not None:
+                self._follower.stop()
+            return
+
+        if self._speed is None:
+            self._write_entry(self._next_entry_index, now)
+            return
+
+        while self._next_entry_index < len(self._entries) and self._get_due_time(self._next_entry_index) <= now:
+            self._write_entry(self._next_entry_index, now)
+
+    def _write_entry(self, index: int, now: float):
+        if index in self._rotate_at_entries and os.path.exists(self._log_path):
+            os.replace(self._log_path, self._previous_log_path)
+            self._start_generation('rotate', now)
+        elif index in self._truncate_at_entries:
+            open(self._log_path, 'w').close()
+            self._start_generation('truncate', now)
+
+        lines = self._entries[index][1]
+        with open(self._log_path, 'a', newline='') as f:
+            f.writelines(lines)
+
+        generation_write_times = self.line_write_times[-1]
+        self._timeline.append({
+            'type': 'append',
+            'time': now,
+            'entry': index,
+            'first_line': len(generation_write_times),
+            'line_count': len(lines),
+        })
+        generation_write_times.extend(now for _ in lines)
+        self._next_entry_index = index + 1
+
+    def _start_generation(self, event_type: str, now: float):
+        self.line_write_times.append([])
+        self._timeline.append({'type': event_type, 'time': now})
+
+    def get_line_write_time(self, line_index: int, before: float) -> Optional[float]:
+        """Find when a line was written, searching from the newest generation of the file."""
+        if line_index < 0:
+            return None
+        for write_times in reversed(self.line_write_times):
+            if line_index < len(write_times) and write_times[line_index] <= before:
+                return write_times[line_index]
+        return None
+
+
+def replay(
+    source_path: str,
+    speed: Optional[float],
+    truncate_at_entries: Sequence[int] = (),
+    rotate_at_entries: Sequence[int] = (),
+) -> Tuple[List[Dict[str, Any]], RecordingTransport]:
+    """
+    Replay a recorded log through a Follower.
+
+    :returns: The timeline (with latency attached to each submission) and the recording transport.
+    """
+    with open(source_path, errors='replace', newline='') as f:
+        entries = split_entries(f.readlines())
+
+    timeline: List[Dict[str, Any]] = []
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=time.time())
+    transport = RecordingTransport(clock=clock, timeline=timeline)
+    api_client = seventeenlands.api_client.ApiClient(host=_REPLAY_HOST, clock=clock, send_post=transport)
+    entry_recording_sink = _EntryRecordingSink(transport)
+
+    with tempfile.TemporaryDirectory() as scratch_folder:
+        log_path = os.path.join(scratch_folder, seventeenlands.mtga_follower.CURRENT_LOG)
+        replayer = LogReplayer(
+            entries=entries,
+            log_path=log_path,
+            clock=clock,
+            timeline=timeline,
+            speed=speed,
+            truncate_at_entries=truncate_at_entries,
+            rotate_at_entries=rotate_at_entries,
+        )
+        clock.add_listener(replayer.on_clock_advanced)
+
+        follower = seventeenlands.mtga_follower.Follower(
+            token=_REPLAY_TOKEN,
+            host=_REPLAY_HOST,
+            clock=clock,
+            # The entry is noted before the event is submitted
+            sinks=[entry_recording_sink, seventeenlands.sinks.ApiSink(api_client)],
+            index_folder=os.path.join(scratch_folder, 'log_index'),
+        )
+        entry_recording_sink.attach(follower)
+        replayer.attach(follower)
+        follower.parse_log(filename=log_path, follow=True)
+        # Send what is still queued, on virtual time
+        api_client.flush()
+
+    for event in timeline:
+        if event['type'] != 'submit' or event['entry_lines'] is None:
+            continue
+        _, end_line = event['entry_lines']
+        written_at = replayer.get_line_write_time(end_line - 1, before=event['time'])
+        event['latency'] = None if written_at is None else event['time'] - written_at
+
+    return timeline, transport
+
+
+def summarize_latencies(timeline: List[Dict[str, Any]]) -> List[str]:
+    latencies_by_endpoint: Dict[str, List[float]] = defaultdict(list)
+    for event in timeline:
+        if event['type'] == 'submit' and event.get('latency') is not None:
+            latencies_by_endpoint[event['endpoint']].append(event['latency'])
+
+    lines = [f'{"endpoint":<40} {"count":>6} {"mean":>8} {"p50":>8} {"p95":>8} {"max":>8}']
+    for endpoint, latencies in sorted(latencies_by_endpoint.items()):
+        latencies.sort()
+        lines.append(
+            f'{endpoint:<40} {len(latencies):>6} {statistics.mean(latencies):>8.3f} '
+            f'{latencies[len(latencies) // 2]:>8.3f} {latencies[int(len(latencies) * 0.95)]:>8.3f} '
+            f'{latencies[-1]:>8.3f}'
+        )
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded MTGA log through the follower under virtual time')
+    parser.add_argument('log_file', help='Recorded Player.log to replay')
+    speed_group = parser.add_mutually_exclusive_group()
+    speed_group.add_argument('--speed', type=float, default=1.0,
+        help='Multiple of the recorded pace to replay at (default is real time)')
+    speed_group.add_argument('--max_speed', action='store_true',
+        help='Append one entry per follower poll, ignoring recorded timestamps')
+    parser.add_argument('--truncate_at_entry', type=int, action='append', default=[],
+        help='Truncate the log before writing this entry (may be repeated)')
+    parser.add_argument('--rotate_at_entry', type=int, action='append', default=[],
+        help='Rotate the log to Player-prev.log before writing this entry (may be repeated)')
+    parser.add_argument('--timeline', help='Write the per-event timeline to this JSON lines file')
+
+    args = parser.parse_args()
+
+    timeline, transport = replay(
+        source_path=args.log_file,
+        speed=None if args.max_speed else args.speed,
+        truncate_at_entries=args.truncate_at_entry,
+        rotate_at_entries=args.rotate_at_entry,
+    )
+
+    if args.timeline:
+        with open(args.timeline, 'w') as f:
+            for event in timeline:
+                f.write(json.dumps(event) + '\n')
+
+    print(f'Replayed {args.log_file}: {len(transport.requests)} requests')
+    print('\n'.join(summarize_latencies(timeline)))
+    seventeenlands.logging_utils.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
 import datetime
-import time
-from typing import TypeVar, Callable, Optional
+import random
+import threading
+from typing import TypeVar, Callable, Dict, Optional, Tuple
 
 import requests.exceptions
 
+import seventeenlands.clock_utils
 import seventeenlands.logging_utils
 
 T = TypeVar('T')
@@ -14,11 +16,191 @@ _INITIAL_RETRY_DELAY = datetime.timedelta(seconds=1)
 _MAX_RETRY_DELAY = datetime.timedelta(minutes=10)
 _MAX_TOTAL_RETRY_DURATION = datetime.timedelta(hours=24)
 
+_CIRCUIT_FAILURE_THRESHOLD = 5
+_INITIAL_CIRCUIT_OPEN_DURATION = datetime.timedelta(seconds=30)
+_MAX_CIRCUIT_OPEN_DURATION = datetime.timedelta(minutes=10)
+_MAX_CIRCUIT_WAIT_INTERVAL = datetime.timedelta(seconds=5)
+
 
 class RetryLimitExceededError(Exception):
     pass
 
 
+def get_jittered_delay(delay: datetime.timedelta) -> datetime.timedelta:
+    """Spread a delay uniformly over [delay / 2, delay] so that callers don't retry in lockstep."""
+    return delay * random.uniform(0.5, 1)
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of a single host across every call made to it.
+
+    After enough consecutive failures the circuit opens and callers wait instead of sending
+    requests. Once the open period elapses, a single caller is let through as a half-open
+    probe: success closes the circuit, failure re-opens it for twice as long (up to a maximum).
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = _CIRCUIT_FAILURE_THRESHOLD,
+        initial_open_duration: datetime.timedelta = _INITIAL_CIRCUIT_OPEN_DURATION,
+        max_open_duration: datetime.timedelta = _MAX_CIRCUIT_OPEN_DURATION,
+        clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
+    ):
+        self.name = name
+        self._clock = clock
+        self._failure_threshold = failure_threshold
+        self._initial_open_duration = initial_open_duration
+        self._max_open_duration = max_open_duration
+
+        self._condition = threading.Condition()
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._open_duration = initial_open_duration
+        self._open_until = 0.0
+        self._probe_in_flight = False
+
+    def wait_until_allowed(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the caller may send a request to the host, or until the timeout.
+
+        :param timeout: Seconds to wait at most (None to wait as long as the circuit is open).
+        :returns: Whether the caller may send the request. If not, the caller should give up or
+                  try again later.
+        """
+        deadline = None if timeout is None else self._clock.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self.state == self.CLOSED:
+                    return True
+
+                now = self._clock.monotonic()
+                if self.state == self.OPEN and now >= self._open_until:
+                    logger.info(f'Circuit for {self.name} is half-open; sending a probe request')
+                    self.state = self.HALF_OPEN
+                    self._probe_in_flight = True
+                    return True
+
+                if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                    self._probe_in_flight = True
+                    return True
+
+                if deadline is not None and now >= deadline:
+                    return False
+
+                wait_seconds = min(
+                    max(self._open_until - now, 0) or _MAX_CIRCUIT_WAIT_INTERVAL.total_seconds(),
+                    _MAX_CIRCUIT_WAIT_INTERVAL.total_seconds(),
+                )
+                if deadline is not None:
+                    wait_seconds = min(wait_seconds, deadline - now)
+                self._clock.wait(self._condition, wait_seconds)
+
+    def get_wait_time(self) -> float:
+        """Seconds until the open period ends (0 if a request may be sent now, as far as is known)."""
+        with self._condition:
+            if self.state == self.OPEN:
+                return max(self._open_until - self._clock.monotonic(), 0.0)
+            if self.state == self.HALF_OPEN and self._probe_in_flight:
+                return _MAX_CIRCUIT_WAIT_INTERVAL.total_seconds()
+            return 0.0
+
+    def record_success(self):
+        with self._condition:
+            if self.state != self.CLOSED:
+                logger.info(f'Circuit for {self.name} is closed again')
+            self.state = self.CLOSED
+            self._consecutive_failures = 0
+            self._open_duration = self._initial_open_duration
+            self._probe_in_flight = False
+            self._condition.notify_all()
+
+    def record_failure(self):
+        with self._condition:
+            self._consecutive_failures += 1
+            if self.state == self.HALF_OPEN:
+                self._open_duration = min(self._open_duration * 2, self._max_open_duration)
+                self._open()
+            elif self.state == self.CLOSED and self._consecutive_failures >= self._failure_threshold:
+                self._open()
+            self._condition.notify_all()
+
+    def release(self):
+        """Give up a half-open probe without recording its outcome (e.g. for non-retryable errors)."""
+        with self._condition:
+            self._probe_in_flight = False
+            self._condition.notify_all()
+
+    def _open(self):
+        open_duration = get_jittered_delay(self._open_duration)
+        logger.warning(f'Circuit for {self.name} is open after {self._consecutive_failures} consecutive failures; pausing requests for {open_duration}')
+        self.state = self.OPEN
+        self._open_until = self._clock.monotonic() + open_duration.total_seconds()
+        self._probe_in_flight = False
+
+
+class Backoff:
+    """
+    The delays between the attempts of one call: jittered, doubling up to `max_delay`, until
+    `max_total_duration` has passed since the first attempt.
+    """
+
+    def __init__(
+        self,
+        initial_delay: datetime.timedelta = _INITIAL_RETRY_DELAY,
+        max_delay: Optional[datetime.timedelta] = _MAX_RETRY_DELAY,
+        max_total_duration: Optional[datetime.timedelta] = _MAX_TOTAL_RETRY_DURATION,
+        clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
+    ):
+        self._next_delay = initial_delay
+        self._max_delay = max_delay
+        self._clock = clock
+        self.give_up_at: Optional[float] = None
+        if max_total_duration:
+            self.give_up_at = clock.time() + max_total_duration.total_seconds()
+
+    def is_exhausted(self) -> bool:
+        """Whether the total retry duration has passed, so the next attempt is the last."""
+        return self.give_up_at is not None and self.give_up_at < self._clock.time()
+
+    def get_remaining_time(self) -> Optional[float]:
+        return None if self.give_up_at is None else max(self.give_up_at - self._clock.time(), 0.0)
+
+    def next_delay(self) -> float:
+        """Seconds to wait before the next attempt."""
+        delay = get_jittered_delay(self._next_delay)
+        self._next_delay *= 2
+        if self._max_delay and self._max_delay < self._next_delay:
+            self._next_delay = self._max_delay
+        return delay.total_seconds()
+
+
+def is_retryable_api_error(error: Exception) -> bool:
+    """Whether a request that raised this error is worth sending again."""
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+_circuit_breakers: Dict[Tuple[str, seventeenlands.clock_utils.Clock], CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(
+    host: str,
+    clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
+) -> CircuitBreaker:
+    """Get the circuit breaker shared by every client of the given host on the same clock."""
+    key = (host, clock)
+    with _circuit_breakers_lock:
+        if key not in _circuit_breakers:
+            _circuit_breakers[key] = CircuitBreaker(name=host, clock=clock)
+        return _circuit_breakers[key]
+
+
 def retry_until_successful(
     callback: Callable[[], T],
     response_validator: Callable[[T], bool],
@@ -26,44 +208,52 @@ def retry_until_successful(
     initial_retry_delay: datetime.timedelta,
     max_retry_delay: Optional[datetime.timedelta],
     max_total_retry_duration: Optional[datetime.timedelta],
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
 ) -> T:
-    last_call_at: Optional[datetime.datetime] = None
-    if max_total_retry_duration:
-        last_call_at = datetime.datetime.utcnow() + max_total_retry_duration
-
-    next_retry_delay = initial_retry_delay
+    backoff = Backoff(initial_retry_delay, max_retry_delay, max_total_retry_duration, clock)
     while True:
-        is_last_call = (
-            last_call_at is not None
-            and last_call_at < datetime.datetime.utcnow()
-        )
+        if circuit_breaker is not None:
+            if not circuit_breaker.wait_until_allowed(timeout=backoff.get_remaining_time()):
+                logger.warning(f'Giving up: the circuit for {circuit_breaker.name} stayed open past the retry deadline')
+                raise RetryLimitExceededError()
+
+        is_last_call = backoff.is_exhausted()
         try:
             result = callback()
             if response_validator(result):
+                if circuit_breaker is not None:
+                    circuit_breaker.record_success()
                 return result
-            elif is_last_call:
+            if circuit_breaker is not None:
+                circuit_breaker.record_failure()
+            if is_last_call:
                 raise RetryLimitExceededError()
+        except RetryLimitExceededError:
+            raise
         except Exception as e:
-            if is_last_call or not error_validator(e):
+            is_retryable = error_validator(e)
+            if circuit_breaker is not None:
+                if is_retryable:
+                    circuit_breaker.record_failure()
+                else:
+                    circuit_breaker.release()
+            if is_last_call or not is_retryable:
                 raise e
-            
-        time.sleep(next_retry_delay.total_seconds())
-        next_retry_delay *= 2
-        if max_retry_delay and max_retry_delay < next_retry_delay:
-            next_retry_delay = max_retry_delay
+
+        clock.sleep(backoff.next_delay())
 
 
 def retry_api_call(
     callback: Callable[[], T],
     response_validator: Callable[[T], bool],
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
 ) -> T:
     def _should_retry_error(error: Exception) -> bool:
         logger.exception(f'Error: {error}')
-        error_class = type(error)
-        if issubclass(error_class, requests.exceptions.ConnectionError):
-            return True
-        return False
-    
+        return is_retryable_api_error(error)
+
     return retry_until_successful(
         callback=callback,
         response_validator=response_validator,
@@ -71,4 +261,6 @@ def retry_api_call(
         initial_retry_delay=_INITIAL_RETRY_DELAY,
         max_retry_delay=_MAX_RETRY_DELAY,
         max_total_retry_duration=_MAX_TOTAL_RETRY_DURATION,
+        circuit_breaker=circuit_breaker,
+        clock=clock,
     )
@@ -0,0 +1,391 @@
+import collections
+import heapq
+import itertools
+import threading
+from typing import Callable, Deque, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import seventeenlands.clock_utils
+import seventeenlands.logging_utils
+import seventeenlands.profiling_utils
+
+logger = seventeenlands.logging_utils.get_logger('scheduling_utils')
+
+# Upper bound on how long the worker sleeps, so it keeps ticking the profiler
+_MAX_IDLE_WAIT_SECONDS = 1.0
+
+DEFAULT_MAX_PENDING_PER_CLASS = 1000
+DEFAULT_MAX_PENDING = 5000
+
+
+class PriorityClass(NamedTuple):
+    """
+    A class of work. Lower priority values are always drained first.
+
+    At most `max_pending` items of the class are held. Beyond that, submitting more waits until
+    there is room, or if `drop_when_full` (for work that a later submission supersedes), the
+    oldest is dropped instead.
+    """
+    priority: int
+    requests_per_second: float
+    burst: int
+    max_pending: int = DEFAULT_MAX_PENDING_PER_CLASS
+    drop_when_full: bool = False
+
+
+class TokenBucket:
+    """Classic token bucket: refills at `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
+    ):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = clock.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def get_wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    def take(self):
+        self._tokens -= 1
+
+
+class _Overflow:
+    """A period during which a class of work was full, until it drained to half its bound."""
+
+    __slots__ = ('started_at', 'dropped_count', 'held_count')
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.dropped_count = 0
+        self.held_count = 0
+
+
+class _Entry:
+    """Pending work. The callback is swapped in place when coalesced, and cleared when dropped."""
+
+    __slots__ = ('callback', 'class_name', 'coalesce_key')
+
+    def __init__(self, callback: Callable[[], None], class_name: str, coalesce_key: Optional[Hashable]):
+        self.callback: Optional[Callable[[], None]] = callback
+        self.class_name = class_name
+        self.coalesce_key = coalesce_key
+
+
+class PriorityScheduler:
+    """
+    Runs submitted callbacks in order on a single worker thread.
+
+    Pending work is kept in one FIFO per priority class. The worker always runs the most
+    urgent class that has both pending work and rate budget available, and never exceeds
+    the overall `max_requests_per_second` ceiling.
+
+    Work submitted with a `coalesce_key` is latest-wins: if work with the same key is still
+    pending, it is replaced in place rather than queued again.
+
+    Work can be submitted with a delay (e.g. a retry), which holds it aside until it is due
+    rather than blocking the worker. It then runs ahead of the rest of its class.
+
+    The pending work is bounded: each class holds at most its `max_pending` items, and all
+    classes together at most `max_pending`. When a class is full, submitting to it blocks
+    until the worker makes room, unless the class drops its oldest work instead. The overall
+    bound is kept by dropping the oldest work of the least urgent class that allows it, and
+    otherwise by blocking. Work resubmitted by the worker itself (e.g. a retry) never blocks.
+    Each period of being full is logged once, when it starts and when it ends.
+
+    :param on_discard: Called with the callbacks that are dropped or replaced by coalescing,
+                       so their owner can clean up.
+    :param gate:       Returns how many seconds to hold all work (e.g. while the host's
+                       circuit is open), or 0 to let it run.
+    :param clock:      Clock for delays, rate limits and waiting. On a VirtualClock, there is no
+                       worker thread: whichever thread advances the clock runs the work that has
+                       become runnable, so replays are deterministic.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        priority_classes: Dict[str, PriorityClass],
+        max_requests_per_second: float,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        on_discard: Optional[Callable[[Callable[[], None]], None]] = None,
+        gate: Optional[Callable[[], float]] = None,
+        clock: seventeenlands.clock_utils.Clock = seventeenlands.clock_utils.SYSTEM_CLOCK,
+    ):
+        self._name = name
+        self._clock = clock
+        self._priority_classes = priority_classes
+        self._class_names_by_priority = sorted(priority_classes, key=lambda c: priority_classes[c].priority)
+        self._max_pending = max_pending
+        self._on_discard = on_discard
+        self._gate = gate
+        self._pending: Dict[str, Deque[_Entry]] = {
+            class_name: collections.deque() for class_name in priority_classes
+        }
+        # Min-heap of (due time, sequence number, entry) for delayed work
+        self._delayed: List[Tuple[float, int, _Entry]] = []
+        self._sequence = itertools.count()
+        # Pending entries of each class, whether due or delayed
+        self._pending_counts: Dict[str, int] = {class_name: 0 for class_name in priority_classes}
+        self._pending_by_coalesce_key: Dict[Hashable, _Entry] = {}
+        self._class_buckets = {
+            class_name: TokenBucket(rate=c.requests_per_second, capacity=c.burst, clock=clock)
+            for class_name, c in priority_classes.items()
+        }
+        self._ceiling_bucket = TokenBucket(rate=max_requests_per_second, capacity=max(1.0, max_requests_per_second), clock=clock)
+
+        self._condition = threading.Condition()
+        self._in_flight_count = 0
+        self._overflows: Dict[str, _Overflow] = {}
+        self.dropped_count = 0
+        self._thread: Optional[threading.Thread] = None
+        # The thread running work, whose own submissions (e.g. retries) never wait for room
+        self._worker_thread_id: Optional[int] = None
+        self._runs_on_clock = isinstance(clock, seventeenlands.clock_utils.VirtualClock)
+        if self._runs_on_clock:
+            clock.add_listener(self._on_clock_advanced)
+
+    def submit(
+        self,
+        priority_class: str,
+        callback: Callable[[], None],
+        coalesce_key: Optional[Hashable] = None,
+        delay: float = 0.0,
+    ) -> bool:
+        """
+        Queue work to be run.
+
+        :param delay: Seconds before the work may run.
+        :returns: False if the work replaced pending work with the same coalesce_key.
+        """
+        if priority_class not in self._pending:
+            raise ValueError(f'Unknown priority class: {priority_class}')
+
+        discarded: List[Callable[[], None]] = []
+        with self._condition:
+            is_held = False
+            while self._must_wait_for_room(priority_class, coalesce_key):
+                if not is_held:
+                    self._get_overflow(priority_class).held_count += 1
+                    is_held = True
+                self._clock.wait(self._condition, _MAX_IDLE_WAIT_SECONDS)
+
+            if coalesce_key is not None and coalesce_key in self._pending_by_coalesce_key:
+                entry = self._pending_by_coalesce_key[coalesce_key]
+                discarded.append(entry.callback)
+                entry.callback = callback
+                is_new = False
+            else:
+                entry = _Entry(callback, priority_class, coalesce_key)
+                if coalesce_key is not None:
+                    self._pending_by_coalesce_key[coalesce_key] = entry
+                if delay > 0:
+                    heapq.heappush(self._delayed, (self._clock.monotonic() + delay, next(self._sequence), entry))
+                else:
+                    self._pending[priority_class].append(entry)
+                self._pending_counts[priority_class] += 1
+                discarded.extend(self._enforce_bounds(priority_class))
+                is_new = True
+
+            if self._thread is None and not self._runs_on_clock:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+        for discarded_callback in discarded:
+            self._discard(discarded_callback)
+        return is_new
+
+    def _must_wait_for_room(self, class_name: str, coalesce_key: Optional[Hashable]) -> bool:
+        if self._priority_classes[class_name].drop_when_full or threading.get_ident() == self._worker_thread_id:
+            return False
+        if coalesce_key is not None and coalesce_key in self._pending_by_coalesce_key:
+            # Replacing pending work takes no more room
+            return False
+        if self._pending_counts[class_name] >= self._priority_classes[class_name].max_pending:
+            return True
+        return (
+            sum(self._pending_counts.values()) >= self._max_pending
+            and self._get_droppable_class() is None
+        )
+
+    def _get_droppable_class(self) -> Optional[str]:
+        """The least urgent class with pending work that may be dropped, if any."""
+        return next(
+            (
+                c for c in reversed(self._class_names_by_priority)
+                if self._priority_classes[c].drop_when_full and self._pending_counts[c]
+            ),
+            None,
+        )
+
+    def _enforce_bounds(self, class_name: str) -> List[Callable[[], None]]:
+        """Drop the oldest droppable work beyond the class's bound, then beyond the overall bound."""
+        dropped = []
+        if self._priority_classes[class_name].drop_when_full:
+            while self._pending_counts[class_name] > self._priority_classes[class_name].max_pending:
+                dropped.append(self._drop_oldest(class_name))
+        while sum(self._pending_counts.values()) > self._max_pending:
+            droppable_class = self._get_droppable_class()
+            if droppable_class is None:
+                # Only work that waited for room, or that the worker resubmitted, is left
+                break
+            dropped.append(self._drop_oldest(droppable_class))
+        return dropped
+
+    def _get_overflow(self, class_name: str) -> _Overflow:
+        overflow = self._overflows.get(class_name)
+        if overflow is None:
+            overflow = self._overflows[class_name] = _Overflow(self._clock.monotonic())
+            action = 'dropping its oldest work' if self._priority_classes[class_name].drop_when_full else 'holding up new work'
+            logger.warning(f'{class_name} work for {self._name} is full; {action} until it drains')
+        return overflow
+
+    def _end_overflow_if_drained(self, class_name: str):
+        overflow = self._overflows.get(class_name)
+        if overflow is None or self._pending_counts[class_name] > self._priority_classes[class_name].max_pending // 2:
+            return
+        del self._overflows[class_name]
+        logger.warning(
+            f'{class_name} work for {self._name} drained after being full for '
+            + f'{self._clock.monotonic() - overflow.started_at:.1f}s: {overflow.dropped_count} dropped, '
+            + f'{overflow.held_count} held up'
+        )
+
+    def _drop_oldest(self, class_name: str) -> Callable[[], None]:
+        pending = self._pending[class_name]
+        if pending:
+            entry = pending.popleft()
+        else:
+            # All of the class's work is delayed: drop the item that has been waiting longest
+            _, _, entry = min(
+                (item for item in self._delayed if item[2].class_name == class_name and item[2].callback is not None),
+                key=lambda item: item[1],
+            )
+        self._get_overflow(class_name).dropped_count += 1
+        self.dropped_count += 1
+        return self._remove(entry)
+
+    def _remove(self, entry: _Entry) -> Callable[[], None]:
+        """Forget a pending entry (leaving a delayed one in the heap, to be skipped)."""
+        callback = entry.callback
+        entry.callback = None
+        self._pending_counts[entry.class_name] -= 1
+        if entry.coalesce_key is not None:
+            del self._pending_by_coalesce_key[entry.coalesce_key]
+        return callback
+
+    def _discard(self, callback: Callable[[], None]):
+        if self._on_discard is None:
+            return
+        try:
+            self._on_discard(callback)
+        except Exception:
+            logger.exception(f'Error discarding work from {self._name}')
+
+    def get_pending_count(self) -> int:
+        with self._condition:
+            return sum(self._pending_counts.values()) + self._in_flight_count
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all submitted work has run.
+
+        :returns: Whether the queue was drained before the timeout.
+        """
+        deadline = None if timeout is None else self._clock.monotonic() + timeout
+        with self._condition:
+            while any(self._pending_counts.values()) or self._in_flight_count > 0:
+                remaining = None if deadline is None else deadline - self._clock.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._clock.wait(self._condition, min(remaining or _MAX_IDLE_WAIT_SECONDS, _MAX_IDLE_WAIT_SECONDS))
+        return True
+
+    def _release_due_work(self, now: float):
+        """Move delayed work that is due to the front of its class's queue."""
+        due: Dict[str, List[_Entry]] = collections.defaultdict(list)
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, entry = heapq.heappop(self._delayed)
+            if entry.callback is not None:
+                due[entry.class_name].append(entry)
+        for class_name, entries in due.items():
+            self._pending[class_name].extendleft(reversed(entries))
+
+    def _take_next(self):
+        """Pop the next runnable callback, or return how long to wait before one may be runnable."""
+        now = self._clock.monotonic()
+        self._release_due_work(now)
+        delayed_wait = self._delayed[0][0] - now if self._delayed else None
+        if self._gate is not None and any(self._pending.values()):
+            gate_wait = self._gate()
+            if gate_wait > 0:
+                return None, gate_wait
+
+        ceiling_wait = self._ceiling_bucket.get_wait_time(now)
+        min_wait = delayed_wait
+        for class_name in self._class_names_by_priority:
+            if not self._pending[class_name]:
+                continue
+
+            wait = max(ceiling_wait, self._class_buckets[class_name].get_wait_time(now))
+            if wait == 0:
+                self._ceiling_bucket.take()
+                self._class_buckets[class_name].take()
+                entry = self._pending[class_name].popleft()
+                callback = self._remove(entry)
+                self._end_overflow_if_drained(class_name)
+                return callback, None
+            min_wait = wait if min_wait is None else min(min_wait, wait)
+
+        return None, min_wait
+
+    def _run(self):
+        self._worker_thread_id = threading.get_ident()
+        while True:
+            seventeenlands.profiling_utils.tick()
+            with self._condition:
+                callback, wait = self._take_next()
+                if callback is None:
+                    self._condition.wait(timeout=min(wait or _MAX_IDLE_WAIT_SECONDS, _MAX_IDLE_WAIT_SECONDS))
+                    continue
+                self._in_flight_count += 1
+            self._run_callback(callback)
+
+    def _on_clock_advanced(self, now: float):
+        """Run the work that has become runnable, on the thread that advanced the virtual clock."""
+        if self._worker_thread_id is not None:
+            # Work that advances the clock does not run more work from within itself
+            return
+        self._worker_thread_id = threading.get_ident()
+        try:
+            while True:
+                with self._condition:
+                    callback, _ = self._take_next()
+                    if callback is None:
+                        return
+                    self._in_flight_count += 1
+                self._run_callback(callback)
+        finally:
+            self._worker_thread_id = None
+
+    def _run_callback(self, callback: Callable[[], None]):
+        try:
+            callback()
+        except Exception:
+            logger.exception(f'Error running scheduled work on {self._name}')
+        finally:
+            with self._condition:
+                self._in_flight_count -= 1
+                self._condition.notify_all()
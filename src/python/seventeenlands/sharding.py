@@ -0,0 +1,347 @@
+"""
+Parsing a single log in several processes, split where the follower's match state resets.
+
+A pre-scan finds the entries that follow a match end, a log out or an account login, and
+the identity logged in at each, along with the player's last rank info and the last log
+time. The log is cut at some of these points into shards of similar size, and each shard is
+parsed in a worker process by a Follower seeded with that state.
+
+The parser state carried between shards is tracked: a worker records which carried fields
+its Follower read before writing them, and what it wrote. The shards are merged in order,
+and a shard is accepted only if the previous one ended between matches and every field the
+shard read matches the true state at its start. Any other shard is parsed again in this
+process from the true state, so the events are the same as those of a serial parse.
+"""
+
+import concurrent.futures
+import mmap
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import seventeenlands.file_utils
+import seventeenlands.log_index
+import seventeenlands.logging_utils
+import seventeenlands.mtga_follower
+import seventeenlands.sinks
+
+logger = seventeenlands.logging_utils.get_logger('sharding')
+
+# Files are not split into shards smaller than this
+DEFAULT_MIN_SHARD_SIZE = 16 * 1024 * 1024
+# Shards per worker, so that uneven shards still keep every worker busy
+_SHARDS_PER_WORKER = 4
+
+_BOUNDARY_MARKER_REGEX_BYTES = re.compile(rb'finalMatchResult|FrontDoorConnection\.Close |Updated account\. DisplayName:|Rank_?GetCombinedRankInfo')
+_LOG_OUT_MARKER = b'FrontDoorConnection.Close '
+_RANK_MARKERS = (b'Rank_GetCombinedRankInfo', b'RankGetCombinedRankInfo')
+_LOG_START_PREFIX_SIZE = 64
+# Carried fields only read to compare them with the value then written to them (the previous
+# entry's key, to skip repeated entries). A shard that assumed the wrong value for one still
+# parsed correctly as long as neither value equals the one it wrote.
+_COMPARED_FIELDS = frozenset(('last_blob_key',))
+
+
+class Boundary(NamedTuple):
+    """The offset of an entry at which match state has been reset, and the state known there."""
+    offset: int
+    seed_state: Dict[str, Any]
+
+
+def find_boundaries(filename: str) -> List[Boundary]:
+    """
+    Scan a log for the log-start lines at which a shard may begin, without parsing most
+    entries: the line after a match result or log out, and account login lines. Only rank
+    info entries are decoded, to carry the player's rank into the following shards.
+    """
+    boundaries: List[Boundary] = []
+    seed_state: Dict[str, Any] = {}
+    last_rank_entry_start = None
+    with open(filename, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            return boundaries
+        with data:
+            for marker in _BOUNDARY_MARKER_REGEX_BYTES.finditer(data):
+                if marker.group() in _RANK_MARKERS:
+                    entry_start = _find_entry_start(data, marker.start())
+                    if entry_start is not None and entry_start != last_rank_entry_start:
+                        last_rank_entry_start = entry_start
+                        seed_state = _apply_rank_entry(data, entry_start, seed_state)
+                    continue
+
+                line_start = data.rfind(b'\n', 0, marker.start()) + 1
+                account_match = seventeenlands.mtga_follower._ACCOUNT_INFO_REGEX_BYTES.match(data, line_start)
+                if account_match:
+                    # The login line itself sets the identity, so the shard can start at it
+                    offset = line_start
+                else:
+                    offset = _find_next_log_start(data, marker.end())
+                if offset is not None and offset > 0 and (not boundaries or offset > boundaries[-1].offset):
+                    boundaries.append(Boundary(offset, {**seed_state, **_get_log_time_state(data, offset)}))
+
+                if account_match:
+                    seed_state = {
+                        **seed_state,
+                        'cur_user': account_match.group(2).decode('utf-8', errors='replace'),
+                        'user_screen_name': account_match.group(1).decode('utf-8', errors='replace'),
+                    }
+                elif marker.group() == _LOG_OUT_MARKER:
+                    if seed_state.get('cur_user') is not None:
+                        seed_state = {
+                            **seed_state,
+                            'disconnected_user': seed_state.get('cur_user'),
+                            'disconnected_screen_name': seed_state.get('user_screen_name'),
+                            'disconnected_rank': seed_state.get('cur_rank_data'),
+                        }
+                    seed_state = {**seed_state, 'cur_user': None, 'user_screen_name': None, 'cur_rank_data': None}
+    return boundaries
+
+
+def _find_entry_start(data: mmap.mmap, position: int) -> Optional[int]:
+    """Find the log-start line of the entry containing a position."""
+    line_end = position
+    while line_end > 0:
+        line_start = data.rfind(b'\n', 0, line_end) + 1
+        if seventeenlands.mtga_follower._LOG_START_REGEX_UNTIMED_BYTES.match(data[line_start:line_start + _LOG_START_PREFIX_SIZE]):
+            return line_start
+        line_end = line_start - 1
+    return None
+
+
+def _apply_rank_entry(data: mmap.mmap, entry_start: int, seed_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Update the state as the follower would for an entry, if it is the player's rank info."""
+    entry_end = _find_next_log_start(data, entry_start)
+    lines = data[entry_start:entry_end].splitlines(keepends=True)
+    _, _, first_line_content = seventeenlands.mtga_follower.split_entry_line(lines[0])
+    full_log = seventeenlands.file_utils.decode_text(first_line_content + b''.join(lines[1:]))
+    json_obj, _ = seventeenlands.mtga_follower.decode_entry(full_log)
+    if json_obj is None or seventeenlands.mtga_follower.classify_blob(json_obj, full_log) != 'self_rank_info':
+        return seed_state
+    return {
+        **seed_state,
+        'cur_rank_data': json_obj,
+        'cur_user': json_obj.get('playerId', seed_state.get('cur_user')),
+    }
+
+
+def _get_log_time_state(data: mmap.mmap, position: int) -> Dict[str, Any]:
+    """The log time the follower holds at a position: that of the last timestamped line before it."""
+    line_end = position - 1
+    while line_end > 0:
+        line_start = data.rfind(b'\n', 0, line_end) + 1
+        prefix = data[line_start:line_start + _LOG_START_PREFIX_SIZE]
+        raw_time = None
+        timed_match = seventeenlands.mtga_follower._LOG_START_REGEX_TIMED_BYTES.match(prefix)
+        if timed_match:
+            raw_time = timed_match.group(2)
+        else:
+            timestamp_match = seventeenlands.mtga_follower._TIMESTAMP_REGEX_BYTES.match(prefix)
+            if timestamp_match:
+                raw_time = timestamp_match.group(1)
+        if raw_time is not None:
+            raw_time = raw_time.decode('utf-8', errors='replace')
+            try:
+                return {'cur_log_time': seventeenlands.mtga_follower.extract_time(raw_time), 'last_raw_time': raw_time}
+            except ValueError:
+                return {}
+        line_end = line_start - 1
+    return {}
+
+
+def _find_next_log_start(data: mmap.mmap, position: int) -> Optional[int]:
+    newline = data.find(b'\n', position)
+    while newline >= 0:
+        line_start = newline + 1
+        # Sliced since the pattern is anchored to the start of the string
+        if seventeenlands.mtga_follower._LOG_START_REGEX_UNTIMED_BYTES.match(data[line_start:line_start + _LOG_START_PREFIX_SIZE]):
+            return line_start
+        newline = data.find(b'\n', line_start)
+    return None
+
+
+def plan_shards(boundaries: List[Boundary], file_size: int, workers: int, min_shard_size: int) -> List[Tuple[int, Optional[int], Dict[str, Any]]]:
+    """Pick boundaries that cut the file into shards of about equal size, as (start, end, seed state)."""
+    target_size = max(min_shard_size, file_size // max(workers * _SHARDS_PER_WORKER, 1))
+    shards = []
+    start, seed_state = 0, {}
+    for boundary in boundaries:
+        if boundary.offset - start >= target_size and file_size - boundary.offset >= min_shard_size:
+            shards.append((start, boundary.offset, seed_state))
+            start, seed_state = boundary.offset, boundary.seed_state
+    shards.append((start, None, seed_state))
+    return shards
+
+
+class _TrackedField:
+    """A carried state field of a ShardFollower, recording whether it is read before being written."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self._name not in instance.written_fields:
+            instance.read_fields.add(self._name)
+        return instance.__dict__[self._name]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self._name] = value
+        if self._name not in instance.written_fields:
+            instance.written_fields.add(self._name)
+            instance.first_written_state[self._name] = value
+
+
+class ShardFollower(seventeenlands.mtga_follower.Follower):
+    """
+    A Follower starting from a given carried state, which tracks how its carried state is used.
+
+    :param seed_state: Values of carried state fields at the start of the shard; the other
+                       fields start as in a new Follower.
+    """
+
+    def __init__(self, *args, seed_state: Optional[Dict[str, Any]] = None, **kwargs):
+        self._seed_state = seed_state or {}
+        self.read_fields: Set[str] = set()
+        self.written_fields: Set[str] = set()
+        self.first_written_state: Dict[str, Any] = {}
+        super().__init__(*args, **kwargs)
+
+    def _reinitialize(self):
+        super()._reinitialize()
+        for field, value in self._seed_state.items():
+            setattr(self, field, value)
+        self.read_fields = set()
+        self.written_fields = set()
+        self.first_written_state = {}
+
+    def get_written_state(self) -> Dict[str, Any]:
+        return {field: self.__dict__[field] for field in self.written_fields}
+
+
+for _field in seventeenlands.mtga_follower.CARRIED_STATE_FIELDS:
+    setattr(ShardFollower, _field, _TrackedField(_field))
+
+
+class _CollectingSink(seventeenlands.sinks.Sink):
+    def __init__(self):
+        self.events: List[Tuple[str, bytes]] = []
+
+    def emit(self, event: seventeenlands.sinks.Event):
+        self.events.append((event.kind, event.serialize()))
+
+
+class ShardResult(NamedTuple):
+    events: List[Tuple[str, bytes]]
+    read_fields: Set[str]
+    first_written_state: Dict[str, Any]
+    written_state: Dict[str, Any]
+    has_match_state: bool
+
+    def is_valid_from(self, assumed_state: Dict[str, Any], true_state: Dict[str, Any]) -> bool:
+        """Whether the shard parsed from `assumed_state` as it would have from `true_state`."""
+        for field in self.read_fields:
+            if assumed_state[field] == true_state[field]:
+                continue
+            if field not in _COMPARED_FIELDS or field not in self.first_written_state:
+                return False
+            if self.first_written_state[field] in (assumed_state[field], true_state[field]):
+                return False
+        return True
+
+
+def parse_shard(
+    filename: str,
+    start_offset: int,
+    end_offset: Optional[int],
+    seed_state: Dict[str, Any],
+    follower_options: Dict[str, Any],
+) -> ShardResult:
+    """Parse part of a log, collecting its events as (kind, serialized blob)."""
+    sink = _CollectingSink()
+    follower = ShardFollower(sinks=[sink], use_index=False, seed_state=seed_state, **follower_options)
+    follower.parse_log(
+        filename=filename,
+        follow=False,
+        offset_range=seventeenlands.log_index.OffsetRange(start_offset, end_offset, None),
+    )
+    follower.close()
+    return ShardResult(
+        sink.events,
+        follower.read_fields,
+        follower.first_written_state,
+        follower.get_written_state(),
+        follower.has_match_state(),
+    )
+
+
+def _get_initial_state(follower_options: Dict[str, Any]) -> Dict[str, Any]:
+    follower = seventeenlands.mtga_follower.Follower(sinks=[], **follower_options)
+    return {field: getattr(follower, field) for field in seventeenlands.mtga_follower.CARRIED_STATE_FIELDS}
+
+
+def parse_sharded(
+    follower: seventeenlands.mtga_follower.Follower,
+    filename: str,
+    workers: int,
+    follower_options: Dict[str, Any],
+    min_shard_size: int = DEFAULT_MIN_SHARD_SIZE,
+) -> int:
+    """
+    Parse a whole log in worker processes, sending the events to `follower`'s sinks in order.
+
+    :param follower_options: Keyword arguments for the Followers parsing each shard (token,
+                             host and parsing options; not sinks).
+    :returns: How many shards had to be parsed again.
+    """
+    with open(filename, 'rb') as f:
+        file_size = f.seek(0, 2)
+    shards = plan_shards(find_boundaries(filename), file_size, workers, min_shard_size)
+    logger.info(f'Parsing {filename} in {len(shards)} shards with {workers} workers')
+
+    initial_state = _get_initial_state(follower_options)
+    # The events of the last range parsed are held until the next shard shows whether the range
+    # must be parsed again, along with where the range started and the true state there
+    held_events: List[Tuple[str, bytes]] = []
+    held_start = 0
+    held_start_state = dict(initial_state)
+    held_has_match_state = False
+    true_state = dict(initial_state)
+    reparsed_count = 0
+
+    def forward_held_events():
+        for kind, serialized in held_events:
+            follower.forward(seventeenlands.sinks.Event.from_serialized(kind, serialized))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(parse_shard, filename, start, end, seed_state, follower_options)
+            for start, end, seed_state in shards
+        ]
+        for index, ((start, end, seed_state), future) in enumerate(zip(shards, futures)):
+            result = future.result()
+            if held_has_match_state:
+                # The previous range ended mid-match, so it is parsed again along with this shard
+                logger.info(f'Reparsing from offset {held_start} to the end of shard {index}')
+                start = held_start
+                result = parse_shard(filename, start, end, held_start_state, follower_options)
+                start_state = held_start_state
+                reparsed_count += 1
+            else:
+                forward_held_events()
+                start_state = true_state
+                if not result.is_valid_from({**initial_state, **seed_state}, true_state):
+                    logger.info(f'Reparsing shard {index} from the state at its start')
+                    result = parse_shard(filename, start, end, true_state, follower_options)
+                    reparsed_count += 1
+
+            held_events = result.events
+            held_start = start
+            held_start_state = start_state
+            held_has_match_state = result.has_match_state
+            true_state = {**start_state, **result.written_state}
+
+    forward_held_events()
+    logger.info(f'Parsed {len(shards)} shards; {reparsed_count} were reparsed')
+    return reparsed_count
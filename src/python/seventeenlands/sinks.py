@@ -0,0 +1,162 @@
+import gzip
+import json
+import threading
+from typing import Any, List, Mapping, Optional, Sequence
+
+import seventeenlands.api_client
+import seventeenlands.logging_utils
+import seventeenlands.records
+import seventeenlands.tracing
+
+logger = seventeenlands.logging_utils.get_logger('sinks')
+
+# Kinds of events produced by the Follower. Each matches an ApiClient.submit_<kind> method.
+EVENT_KINDS = frozenset((
+    'collection',
+    'deck_submission',
+    'draft_pack',
+    'draft_pick',
+    'error_info',
+    'event_course_submission',
+    'event_ended',
+    'event_submission',
+    'game_result',
+    'human_draft_pack',
+    'human_draft_pick',
+    'inventory',
+    'joined_event',
+    'ongoing_events',
+    'player_progress',
+    'rank',
+    'user',
+))
+
+
+class Event:
+    """
+    A parsed event. The JSON serialization of its blob is computed at most once, however many sinks use it.
+
+    :param blob:  The event's fields, as a dict or a records.EventRecord.
+    :param trace: The event's latency trace, if it is sampled for tracing.
+    """
+
+    __slots__ = ('kind', 'blob', 'trace', '_serialized')
+
+    def __init__(self, kind: str, blob: Mapping[str, Any], trace: Optional['seventeenlands.tracing.Trace'] = None):
+        if kind not in EVENT_KINDS:
+            raise ValueError(f'Unknown event kind: {kind}')
+        self.kind = kind
+        self.blob = blob
+        self.trace = trace
+        self._serialized: Optional[bytes] = None
+
+    @classmethod
+    def from_serialized(cls, kind: str, serialized: bytes) -> 'Event':
+        event = cls(kind=kind, blob=json.loads(serialized))
+        event._serialized = serialized
+        return event
+
+    def serialize(self) -> bytes:
+        if self._serialized is None:
+            self._serialized = seventeenlands.records.serialize(self.blob)
+            if self.trace is not None:
+                self.trace.stamp(seventeenlands.tracing.SERIALIZED)
+        return self._serialized
+
+
+class Sink:
+    """Destination for parsed events."""
+
+    def emit(self, event: Event):
+        raise NotImplementedError()
+
+    def flush(self):
+        """Wait until every event emitted so far has been written or sent."""
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class NullSink(Sink):
+    """Discards every event. Useful for measuring parse throughput on its own."""
+
+    def emit(self, event: Event):
+        pass
+
+
+class ApiSink(Sink):
+    """Submits events to the 17Lands API."""
+
+    def __init__(self, api_client: 'seventeenlands.api_client.ApiClient'):
+        self._api_client = api_client
+
+    def emit(self, event: Event):
+        submit = getattr(self._api_client, f'submit_{event.kind}')
+        body = event.serialize()
+        with seventeenlands.tracing.active_trace(event.trace):
+            submit(event.blob, body=body)
+
+    def flush(self):
+        self._api_client.flush()
+
+
+class JsonlSink(Sink):
+    """
+    Appends events to a gzip-compressed JSON lines file, one `{"kind": ..., "blob": ...}` object
+    per line. Each run appends a new gzip member, which gzip readers handle transparently.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._file: Optional[gzip.GzipFile] = gzip.open(filename, 'ab')
+
+    def emit(self, event: Event):
+        with self._lock:
+            if self._file is None:
+                raise ValueError(f'{self.filename} is already closed')
+            self._file.write(b'{"kind": "%s", "blob": ' % event.kind.encode('utf8'))
+            self._file.write(event.serialize())
+            self._file.write(b'}\n')
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class FanOutSink(Sink):
+    """Passes each event to several sinks. A failing sink does not stop the others."""
+
+    def __init__(self, sinks: Sequence[Sink]):
+        self.sinks: List[Sink] = list(sinks)
+
+    def emit(self, event: Event):
+        for sink in self.sinks:
+            try:
+                sink.emit(event)
+            except Exception:
+                logger.exception(f'Error emitting {event.kind} event to {type(sink).__name__}')
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def read_jsonl_events(filename: str):
+    """Iterate over the events in a file written by JsonlSink."""
+    with gzip.open(filename, 'rt', encoding='utf8') as f:
+        for line in f:
+            record = json.loads(line)
+            yield Event(kind=record['kind'], blob=record['blob'])
@@ -0,0 +1,332 @@
+"""
+Soak test pushing days of synthetic play through a Follower to check that memory stays flat.
+
+Each simulated day starts a new Player.log (as restarting MTGA does) and contains several
+sessions: login, rank and inventory, a human draft, a deck submission and a few matches of
+full GRE game states. The log is written while the Follower tails it on a VirtualClock, as in
+a replay. At the end of each day, once the Follower has caught up, a tracemalloc snapshot is
+taken; the growth between the end of the first day and the end of the last is reported by
+allocation site, and the run fails if it exceeds a threshold.
+
+Usage: python -m seventeenlands.soak [--days N] [--max_growth_kb KB]
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from typing import Iterator, List, Optional, Tuple
+
+import seventeenlands.clock_utils
+import seventeenlands.logging_utils
+import seventeenlands.memory_utils
+import seventeenlands.mtga_follower
+import seventeenlands.sinks
+
+logger = seventeenlands.logging_utils.get_logger('soak')
+
+_SOAK_TOKEN = 'soak'
+_SOAK_HOST = 'soak'
+_PLAYER_ID = 'SOAKPLAYER'
+_PLAYER_NAME = 'Soak#12345'
+_EVENT_NAME = 'PremierDraft_SOAK'
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+_IDLE_POLLS_BEFORE_STOP = 4
+_TRACEMALLOC_FRAMES = 1
+
+
+class CountingSink(seventeenlands.sinks.Sink):
+    """Counts events by kind without keeping them, so the sink itself does not grow."""
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+
+    def emit(self, event: seventeenlands.sinks.Event):
+        self.counts[event.kind] += 1
+
+
+class SessionGenerator:
+    """
+    Generates the log lines of synthetic play. Ids, names and card objects differ between
+    matches, so any state that is kept per id shows up as growth.
+    """
+
+    def __init__(self, seed: int, matches_per_session: int, turns_per_game: int, objects_per_game: int):
+        self._random = random.Random(seed)
+        self._matches_per_session = matches_per_session
+        self._turns_per_game = turns_per_game
+        self._objects_per_game = objects_per_game
+        self._log_time = datetime.datetime(2024, 1, 1, 8, 0, 0)
+        self._serial = 0
+
+    def _next_id(self, prefix: str) -> str:
+        self._serial += 1
+        return f'{prefix}{self._serial}'
+
+    def _entry(self, header: str, blob=None, minutes: float = 0.25) -> List[str]:
+        self._log_time += datetime.timedelta(minutes=minutes)
+        lines = [f'[UnityCrossThreadLogger]{self._log_time.strftime(_TIME_FORMAT)}: {header}\n']
+        if blob is not None:
+            if header.startswith('==>'):
+                blob = {'id': self._next_id(''), 'request': json.dumps(blob)}
+            lines.append(json.dumps(blob) + '\n')
+        return lines
+
+    def start_day(self, day: int):
+        self._log_time = datetime.datetime(2024, 1, 1, 8, 0, 0) + datetime.timedelta(days=day)
+
+    def day_header(self) -> List[str]:
+        return [
+            'DETAILED LOGS: ENABLED\n',
+            f'[UnityCrossThreadLogger]Updated account. DisplayName:{_PLAYER_NAME}, AccountID:{_PLAYER_ID}, Token:soak\n',
+        ]
+
+    def session(self) -> Iterator[List[str]]:
+        """Yield the chunks of one session: its start, then each match."""
+        yield self._session_start()
+        for _ in range(self._matches_per_session):
+            yield self._match()
+
+    def _session_start(self) -> List[str]:
+        lines = self._entry('<== Rank_GetCombinedRankInfo(1)', {
+            'playerId': _PLAYER_ID, 'limitedSeasonOrdinal': 1, 'limitedClass': 'Gold',
+        })
+        lines += self._entry('<== StartHook(1)', {
+            'DTO_InventoryInfo': {'Gems': self._random.randint(0, 10000), 'Gold': self._random.randint(0, 10000)},
+        })
+        draft_id = self._next_id('draft')
+        for pick_number in range(1, 4):
+            lines += self._entry('==> LogBusinessEvents', {
+                'DraftId': draft_id, 'EventId': _EVENT_NAME, 'PackNumber': 1, 'PickNumber': pick_number,
+                'CardsInPack': self._random.sample(range(70000, 90000), 15 - pick_number),
+                'PickGrpId': self._random.randint(70000, 90000), 'AutoPick': False, 'TimeRemainingOnPick': 30,
+            })
+        lines += self._entry('<== Draft_CompleteDraft(5)', {
+            'InternalEventName': _EVENT_NAME, 'DraftId': draft_id, 'CourseId': self._next_id('course'),
+            'CardPool': self._random.sample(range(70000, 90000), 42),
+        })
+        deck = [{'cardId': card_id, 'quantity': 1} for card_id in self._random.sample(range(70000, 90000), 23)]
+        lines += self._entry('==> Event_SetDeck', {
+            'EventName': _EVENT_NAME, 'Deck': {'MainDeck': deck, 'Sideboard': [], 'Companions': []},
+        })
+        # An unparseable entry, so errors are recorded too
+        lines += self._entry('<== Broken(1)') + ['{"unterminated": \n']
+        return lines
+
+    def _match(self) -> List[str]:
+        match_id = self._next_id('match')
+        opponent_name = f'Opponent#{self._next_id("")}'
+        lines = ['[UnityCrossThreadLogger]Match to %s: connected\n' % _PLAYER_ID]
+        lines += self._entry('matchGameRoomStateChangedEvent', {'matchGameRoomStateChangedEvent': {'gameRoomInfo': {'gameRoomConfig': {
+            'matchId': match_id, 'eventId': _EVENT_NAME,
+            'reservedPlayers': [
+                {'systemSeatId': 1, 'playerName': _PLAYER_NAME, 'userId': _PLAYER_ID, 'eventId': _EVENT_NAME},
+                {'systemSeatId': 2, 'playerName': opponent_name, 'userId': self._next_id('opponent')},
+            ],
+        }}}})
+        lines += self._gre([{'type': 'GREMessageType_ConnectResp', 'connectResp': {
+            'deckMessage': {'deckCards': self._random.sample(range(70000, 90000), 40), 'sideboardCards': []},
+        }}])
+
+        first_instance_id = self._serial * 1000
+        objects = [self._game_object(first_instance_id + i, 1 + i % 2) for i in range(self._objects_per_game)]
+        for turn in range(self._turns_per_game):
+            game_state = {
+                'type': 'GameStateType_Full' if turn == 0 else 'GameStateType_Diff',
+                'gameInfo': {'matchID': match_id},
+                'turnInfo': {'turnNumber': turn + 1, 'phase': 'Phase_Main1', 'step': 'Step_Upkeep', 'activePlayer': 1 + turn % 2},
+                'players': [
+                    {'systemSeatNumber': 1, 'pendingMessageType': 'ClientMessageType_MulliganResp' if turn == 0 else None, 'mulliganCount': 0},
+                    {'systemSeatNumber': 2},
+                ],
+                'gameObjects': objects if turn == 0 else [self._game_object(first_instance_id + self._objects_per_game + turn, 1)],
+                'zones': [
+                    {'type': 'ZoneType_Hand', 'zoneId': 31, 'ownerSeatId': 1,
+                     'objectInstanceIds': [first_instance_id + 2 * i for i in range(7)] + ([first_instance_id + self._objects_per_game + turn] if turn else [])},
+                    {'type': 'ZoneType_Hand', 'zoneId': 35, 'ownerSeatId': 2,
+                     'objectInstanceIds': [first_instance_id + 2 * i + 1 for i in range(7)]},
+                ],
+                'annotations': [{'id': i, 'affectorId': first_instance_id + i, 'type': ['AnnotationType_ZoneTransfer']} for i in range(5)],
+                'timers': [{'timerId': 1, 'durationSec': 30}],
+            }
+            if turn == self._turns_per_game - 1:
+                game_state['gameInfo'].update({'stage': 'GameStage_GameOver', 'results': [
+                    {'scope': 'MatchScope_Game', 'winningTeamId': 1, 'result': 'ResultType_WinLoss', 'reason': 'ResultReason_Game'},
+                ]})
+            messages = [{'type': 'GREMessageType_GameStateMessage', 'systemSeatIds': [1], 'gameStateMessage': game_state}]
+            if turn % 4 == 1:
+                messages.append({'type': 'GREMessageType_UIMessage', 'uiMessage': {'onChat': {'text': 'gg'}}})
+            lines += self._gre(messages)
+
+        lines += self._entry('matchGameRoomStateChangedEvent', {'matchGameRoomStateChangedEvent': {'gameRoomInfo': {
+            'gameRoomConfig': {'matchId': match_id, 'eventId': _EVENT_NAME},
+            'finalMatchResult': {'resultList': [
+                {'scope': 'MatchScope_Game', 'winningTeamId': 1, 'result': 'ResultType_WinLoss', 'reason': 'R'},
+                {'scope': 'MatchScope_Match', 'winningTeamId': 1, 'result': 'ResultType_WinLoss', 'reason': 'R'},
+            ]},
+        }}})
+        return lines
+
+    def _gre(self, messages) -> List[str]:
+        return self._entry('greToClientEvent', {'greToClientEvent': {'greToClientMessages': messages}}, minutes=1)
+
+    def _game_object(self, instance_id: int, owner_seat_id: int):
+        return {
+            'type': 'GameObjectType_Card', 'instanceId': instance_id, 'ownerSeatId': owner_seat_id,
+            'grpId': self._random.randint(70000, 90000), 'overlayGrpId': self._random.randint(70000, 90000),
+            'zoneId': 31 if owner_seat_id == 1 else 35, 'visibility': 'Visibility_Public',
+        }
+
+
+class SoakDriver:
+    """
+    Writes each day's chunks of synthetic play to the log as the Follower polls it, rotating the
+    log between days, and snapshots memory at the end of each day.
+    """
+
+    def __init__(
+        self,
+        generator: SessionGenerator,
+        log_path: str,
+        clock: seventeenlands.clock_utils.VirtualClock,
+        days: int,
+        sessions_per_day: int,
+    ):
+        self._generator = generator
+        self._log_path = log_path
+        self._previous_log_path = os.path.join(os.path.dirname(log_path), seventeenlands.mtga_follower.PREVIOUS_LOG)
+        self._clock = clock
+        self._chunks = self._get_chunks(days, sessions_per_day)
+        self._day = 0
+        self._idle_polls = 0
+        self._follower: Optional[seventeenlands.mtga_follower.Follower] = None
+        # (day, traced bytes, snapshot) at the end of each day
+        self.snapshots: List[Tuple[int, int, tracemalloc.Snapshot]] = []
+
+    def attach(self, follower: seventeenlands.mtga_follower.Follower):
+        self._follower = follower
+
+    def _get_chunks(self, days: int, sessions_per_day: int) -> Iterator[Tuple[int, List[str]]]:
+        for day in range(days):
+            self._generator.start_day(day)
+            yield day, self._generator.day_header()
+            for _ in range(sessions_per_day):
+                for chunk in self._generator.session():
+                    yield day, chunk
+
+    def on_clock_advanced(self, now: float):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            if not self.snapshots or self.snapshots[-1][0] != self._day:
+                self._take_snapshot()
+            self._idle_polls += 1
+            if self._idle_polls >= _IDLE_POLLS_BEFORE_STOP and self._follower is not None:
+                self._follower.stop()
+            return
+
+        day, lines = chunk
+        if day > 0 and day != self._day:
+            self._take_snapshot()
+            os.replace(self._log_path, self._previous_log_path)
+        self._day = day
+        with open(self._log_path, 'a', newline='') as f:
+            f.writelines(lines)
+        os.utime(self._log_path, (now, now))
+
+    def _take_snapshot(self):
+        gc.collect()
+        traced, _ = tracemalloc.get_traced_memory()
+        self.snapshots.append((self._day, traced, tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))))
+        logger.info(f'Day {self._day} done: {traced / 1024:.1f} KiB traced')
+
+
+def soak(
+    days: int,
+    sessions_per_day: int,
+    matches_per_session: int,
+    turns_per_game: int,
+    objects_per_game: int,
+    seed: int,
+) -> Tuple[SoakDriver, CountingSink]:
+    """Run the soak test, returning the driver (with its snapshots) and the sink's event counts."""
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=time.time())
+    sink = CountingSink()
+    generator = SessionGenerator(seed, matches_per_session, turns_per_game, objects_per_game)
+
+    tracemalloc.start(_TRACEMALLOC_FRAMES)
+    try:
+        with tempfile.TemporaryDirectory() as scratch_folder:
+            log_path = os.path.join(scratch_folder, seventeenlands.mtga_follower.CURRENT_LOG)
+            open(log_path, 'w').close()
+            driver = SoakDriver(generator, log_path, clock, days, sessions_per_day)
+            clock.add_listener(driver.on_clock_advanced)
+
+            follower = seventeenlands.mtga_follower.Follower(
+                token=_SOAK_TOKEN,
+                host=_SOAK_HOST,
+                clock=clock,
+                sinks=[sink],
+                index_folder=os.path.join(scratch_folder, 'log_index'),
+            )
+            driver.attach(follower)
+            follower.parse_log(filename=log_path, follow=True)
+            follower.close()
+    finally:
+        tracemalloc.stop()
+    return driver, sink
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the follower\'s memory stays flat over days of synthetic play')
+    parser.add_argument('--days', type=int, default=7, help='Days of play to simulate (at least 2)')
+    parser.add_argument('--sessions_per_day', type=int, default=4)
+    parser.add_argument('--matches_per_session', type=int, default=4)
+    parser.add_argument('--turns_per_game', type=int, default=12)
+    parser.add_argument('--objects_per_game', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=17)
+    parser.add_argument('--max_growth_kb', type=float, default=256.0,
+        help='Fail if traced memory grows by more than this between the end of the first and last days')
+
+    args = parser.parse_args()
+    if args.days < 2:
+        parser.error('--days must be at least 2')
+
+    driver, sink = soak(
+        days=args.days,
+        sessions_per_day=args.sessions_per_day,
+        matches_per_session=args.matches_per_session,
+        turns_per_game=args.turns_per_game,
+        objects_per_game=args.objects_per_game,
+        seed=args.seed,
+    )
+
+    print(f'Events: {dict(sorted(sink.counts.items()))}')
+    for day, traced, _ in driver.snapshots:
+        print(f'End of day {day}: {traced / 1024:10.1f} KiB traced')
+
+    # The first day warms up caches and module state, so growth is measured from its end
+    _, baseline_traced, baseline = driver.snapshots[0]
+    _, final_traced, final = driver.snapshots[-1]
+    growth = final_traced - baseline_traced
+    print(f'Growth after day 0: {growth / 1024:+.1f} KiB. Top allocation sites:')
+    print('\n'.join(seventeenlands.memory_utils.format_top_allocations(final, baseline)))
+    seventeenlands.logging_utils.shutdown()
+
+    if growth > args.max_growth_kb * 1024:
+        print(f'FAILED: memory grew by more than {args.max_growth_kb} KiB')
+        sys.exit(1)
+    print('PASSED')
+
+
+if __name__ == '__main__':
+    main()
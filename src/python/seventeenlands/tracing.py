@@ -0,0 +1,223 @@
+"""
+Sampled tracing of events from the log to the server's acknowledgement.
+
+A sampled event carries a Trace, stamped with the time of each stage it goes through:
+
+    logged        The log time of its entry (to the second, as written by MTGA)
+    read          The entry's first line was read
+    completed     The entry was known to be complete
+    decoded       The entry's JSON was decoded
+    handled       The event was produced from the entry
+    serialized    The event was serialized to JSON
+    enqueued      The submission was queued by the API client
+    sent          The first attempt to send it started
+    acknowledged  The server accepted it
+
+Finished traces are aggregated into a latency histogram per stage (the time since the
+previous stamped stage) and for the whole trace. The slowest traces are kept so they can be
+exported.
+"""
+
+import bisect
+import contextlib
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import seventeenlands.logging_utils
+
+logger = seventeenlands.logging_utils.get_logger('tracing')
+
+LOGGED = 'logged'
+READ = 'read'
+COMPLETED = 'completed'
+DECODED = 'decoded'
+HANDLED = 'handled'
+SERIALIZED = 'serialized'
+ENQUEUED = 'enqueued'
+SENT = 'sent'
+ACKNOWLEDGED = 'acknowledged'
+STAGES = (LOGGED, READ, COMPLETED, DECODED, HANDLED, SERIALIZED, ENQUEUED, SENT, ACKNOWLEDGED)
+TOTAL = 'total'
+
+DEFAULT_SAMPLE_RATE = 0.05
+DEFAULT_REPORT_INTERVAL_SECONDS = 10 * 60.0
+# Upper bounds of the histogram buckets, in milliseconds
+_BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, float('inf'))
+_SLOWEST_TRACE_COUNT = 20
+_SUMMARY_PERCENTILES = (50, 90, 99)
+
+_active = threading.local()
+
+
+class Trace:
+    """Stage timestamps (seconds since the epoch) of one sampled event."""
+
+    __slots__ = ('_tracer', 'kind', 'stamps', 'awaits_acknowledgement')
+
+    def __init__(self, tracer: 'Tracer', kind: str):
+        self._tracer = tracer
+        self.kind = kind
+        self.stamps: Dict[str, float] = {}
+        # Set once the event is queued for sending, which then finishes the trace
+        self.awaits_acknowledgement = False
+
+    def stamp(self, stage: str, timestamp: Optional[float] = None):
+        """Record when a stage was reached (now, by default). Only the first time is kept."""
+        if stage not in self.stamps:
+            self.stamps[stage] = time.time() if timestamp is None else timestamp
+
+    def finish(self):
+        self._tracer.record(self)
+
+    def get_total(self) -> float:
+        times = [self.stamps[stage] for stage in STAGES[1:] if stage in self.stamps]
+        return times[-1] - times[0] if times else 0.0
+
+    def to_blob(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind,
+            'stamps': {stage: self.stamps[stage] for stage in STAGES if stage in self.stamps},
+            'total_ms': self.get_total() * 1000,
+        }
+
+
+def get_active_trace() -> Optional[Trace]:
+    """The trace of the event being submitted on this thread, if it is sampled."""
+    return getattr(_active, 'trace', None)
+
+
+@contextlib.contextmanager
+def active_trace(trace: Optional[Trace]):
+    """Make a trace the active one on this thread, e.g. while its event is submitted."""
+    previous = get_active_trace()
+    _active.trace = trace
+    try:
+        yield
+    finally:
+        _active.trace = previous
+
+
+class Histogram:
+    """Counts of latencies in fixed, roughly logarithmic buckets."""
+
+    __slots__ = ('counts', 'count', 'sum_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = [0] * len(_BUCKET_BOUNDS_MS)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, latency_ms: float):
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS_MS, latency_ms)] += 1
+        self.count += 1
+        self.sum_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def get_percentile(self, percentile: float) -> float:
+        """An upper bound of the percentile, from the bucket it falls in."""
+        rank = self.count * percentile / 100
+        for bound, cumulative in zip(_BUCKET_BOUNDS_MS, itertools.accumulate(self.counts)):
+            if cumulative >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_blob(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean_ms': self.sum_ms / self.count if self.count else 0.0,
+            'max_ms': self.max_ms,
+            'buckets': {str(bound): count for bound, count in zip(_BUCKET_BOUNDS_MS, self.counts) if count},
+        }
+
+
+class Tracer:
+    """
+    Samples events to trace and aggregates the finished traces.
+
+    :param sample_rate:     Fraction of events traced.
+    :param report_interval: Seconds between logged summaries (None to only summarize on request).
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = DEFAULT_SAMPLE_RATE,
+        report_interval: Optional[float] = DEFAULT_REPORT_INTERVAL_SECONDS,
+    ):
+        self._sample_rate = sample_rate
+        self._report_interval = report_interval
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {stage: Histogram() for stage in STAGES[1:] + (TOTAL,)}
+        # Min-heap of (total, sequence number, trace blob), so the fastest of the slowest is dropped first
+        self._slowest: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._sequence = itertools.count()
+        self._next_report_time = None if report_interval is None else time.time() + report_interval
+
+    def start_trace(self, kind: str) -> Optional[Trace]:
+        """A trace for an event, or None if it is not sampled."""
+        if random.random() >= self._sample_rate:
+            return None
+        return Trace(self, kind)
+
+    def record(self, trace: Trace):
+        """Add a finished trace to the histograms."""
+        previous_time = None
+        latencies = []
+        for stage in STAGES:
+            stage_time = trace.stamps.get(stage)
+            if stage_time is None:
+                continue
+            if previous_time is not None:
+                # Log times only have a resolution of a second
+                latencies.append((stage, max(stage_time - previous_time, 0.0) * 1000))
+            previous_time = stage_time
+        total_ms = trace.get_total() * 1000
+
+        with self._lock:
+            for stage, latency_ms in latencies:
+                self._histograms[stage].add(latency_ms)
+            self._histograms[TOTAL].add(total_ms)
+            item = (total_ms, next(self._sequence), trace.to_blob())
+            if len(self._slowest) < _SLOWEST_TRACE_COUNT:
+                heapq.heappush(self._slowest, item)
+            elif total_ms > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+            now = time.time()
+            report_due = self._next_report_time is not None and now >= self._next_report_time
+            if report_due:
+                self._next_report_time = now + self._report_interval
+        if report_due:
+            self.log_summary()
+
+    def get_summary(self) -> Dict[str, Dict[str, Any]]:
+        """The histogram of each stage with traces, and of the whole traces."""
+        with self._lock:
+            return {stage: histogram.to_blob() for stage, histogram in self._histograms.items() if histogram.count}
+
+    def log_summary(self):
+        with self._lock:
+            lines = [
+                f'{stage:>12}: n={histogram.count} '
+                + ' '.join(f'p{p}<={histogram.get_percentile(p):.1f}ms' for p in _SUMMARY_PERCENTILES)
+                + f' max={histogram.max_ms:.1f}ms'
+                for stage, histogram in self._histograms.items()
+                if histogram.count
+            ]
+        if lines:
+            logger.info('Event latency by stage:\n%s', '\n'.join(lines))
+
+    def get_slowest_traces(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [blob for _, _, blob in sorted(self._slowest, reverse=True)]
+
+    def export(self, filename: str):
+        """Write the histograms and the slowest traces as JSON."""
+        with open(filename, 'w') as f:
+            json.dump({'histograms': self.get_summary(), 'slowest_traces': self.get_slowest_traces()}, f, indent=2)
+        logger.info(f'Wrote event latency traces to {filename}')
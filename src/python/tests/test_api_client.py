@@ -0,0 +1,84 @@
+import seventeenlands.api_client
+import seventeenlands.clock_utils
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+
+
+class _Transport:
+    """Stands in for requests.post, answering each request with the next queued status code."""
+
+    def __init__(self, status_codes=()):
+        self.status_codes = list(status_codes)
+        self.sent = []
+        self.on_send = None
+
+    def __call__(self, url, json=None, **kwargs):
+        self.sent.append((url.rsplit('/', 1)[-1], json))
+        if self.on_send is not None:
+            on_send, self.on_send = self.on_send, None
+            on_send()
+        return _Response(self.status_codes.pop(0) if self.status_codes else 200)
+
+
+def _client(transport):
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=0)
+    return seventeenlands.api_client.ApiClient(host='http://test', clock=clock, send_post=transport), clock
+
+
+def _inventory(gold, time='2024-01-01T10:00:00'):
+    return {'player_id': 'PLAYER', 'time': time, 'inventory': {'gold': gold}}
+
+
+def _sent_golds(transport):
+    return [blob['inventory']['gold'] for endpoint, blob in transport.sent if endpoint == 'update_inventory']
+
+
+def test_pending_snapshots_are_coalesced():
+    transport = _Transport()
+    client, _ = _client(transport)
+    # Nothing is sent until the virtual clock advances
+    client.submit_inventory(_inventory(1))
+    client.submit_inventory(_inventory(2))
+
+    assert client.flush(timeout=5)
+    assert _sent_golds(transport) == [2]
+
+
+def test_snapshot_matching_acknowledged_one_is_skipped():
+    transport = _Transport()
+    client, _ = _client(transport)
+    client.submit_inventory(_inventory(1))
+    assert client.flush(timeout=5)
+    client.submit_inventory(_inventory(1, time='2024-01-01T11:00:00'))
+    client.submit_inventory(_inventory(2, time='2024-01-01T12:00:00'))
+    assert client.flush(timeout=5)
+    client.submit_inventory(_inventory(2, time='2024-01-01T13:00:00'))
+    assert client.flush(timeout=5)
+
+    assert _sent_golds(transport) == [1, 2]
+
+
+def test_retry_is_not_sent_after_newer_snapshot_queued_while_in_flight():
+    transport = _Transport(status_codes=[503])
+    client, _ = _client(transport)
+    transport.on_send = lambda: client.submit_inventory(_inventory(2))
+    client.submit_inventory(_inventory(1))
+
+    assert client.flush(timeout=5)
+    assert _sent_golds(transport) == [1, 2]
+
+
+def test_newer_snapshot_replaces_pending_retry():
+    transport = _Transport(status_codes=[503])
+    client, clock = _client(transport)
+    client.submit_inventory(_inventory(1))
+    assert not client.flush(timeout=0.25)
+
+    client.submit_inventory(_inventory(2))
+    clock.sleep(60)
+    assert client.flush(timeout=5)
+    assert _sent_golds(transport) == [1, 2]
@@ -0,0 +1,29 @@
+import datetime
+
+import seventeenlands.event_store
+import seventeenlands.sinks
+
+
+def _emit(store, kind, time, **fields):
+    store.emit(seventeenlands.sinks.Event(kind, {'player_id': 'PLAYER', 'time': time, **fields}))
+
+
+def test_draft_picks(tmp_path):
+    store = seventeenlands.event_store.EventStore(str(tmp_path / 'events.sqlite3'))
+    _emit(store, 'human_draft_pick', '2024-01-01T10:00:00', draft_id='draft-1', event_name='PremierDraft', pick_number=0)
+    _emit(store, 'human_draft_pick', '2024-01-01T10:00:05', draft_id='draft-2', event_name='PremierDraft', pick_number=0)
+    for day in (1, 2):
+        for pick_number in range(2):
+            _emit(store, 'draft_pick', f'2024-01-0{day}T11:00:0{pick_number}', event_name='QuickDraft', pick_number=pick_number)
+
+    assert [event.blob['draft_id'] for event in store.get_draft_picks('draft-1')] == ['draft-1']
+    assert len(store.get_bot_draft_picks('QuickDraft')) == 4
+    second_day = store.get_bot_draft_picks('QuickDraft', start_time=datetime.datetime(2024, 1, 2))
+    assert [event.blob['time'] for event in second_day] == ['2024-01-02T11:00:00', '2024-01-02T11:00:01']
+    first_pick = store.get_bot_draft_picks(
+        'QuickDraft',
+        start_time=datetime.datetime(2024, 1, 1, 11),
+        end_time=datetime.datetime(2024, 1, 1, 11, 0, 0),
+    )
+    assert [event.blob['pick_number'] for event in first_pick] == [0]
+    store.close()
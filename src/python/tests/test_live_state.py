@@ -0,0 +1,52 @@
+import http.client
+import json
+
+import pytest
+
+import seventeenlands.live_state
+
+
+@pytest.fixture
+def server():
+    live_state = seventeenlands.live_state.LiveState()
+    server = seventeenlands.live_state.LiveStateServer(live_state, port=0)
+    server.start()
+    yield server
+    server.close()
+
+
+def _get_state(server, host):
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    try:
+        connection.putrequest('GET', '/state', skip_host=True)
+        if host is not None:
+            connection.putheader('Host', host)
+        connection.endheaders()
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('host', ['127.0.0.1:{port}', 'localhost:{port}', 'LocalHost:{port}'])
+def test_loopback_host_is_answered(server, host):
+    server.live_state.update('rank', {'constructed': 'Gold'})
+    status, body = _get_state(server, host.format(port=server.port))
+    assert status == 200
+    assert json.loads(body)['rank'] == {'constructed': 'Gold'}
+
+
+@pytest.mark.parametrize('host', [
+    # A web page rebinding its own name to the loopback address
+    'attacker.example:{port}',
+    '127.0.0.1.attacker.example:{port}',
+    # The right host on another port is some other origin
+    'localhost:1',
+    'localhost',
+    None,
+])
+def test_other_hosts_are_refused(server, host):
+    server.live_state.update('rank', {'constructed': 'Gold'})
+    status, body = _get_state(server, host if host is None else host.format(port=server.port))
+    assert status == 403
+    assert b'Gold' not in body
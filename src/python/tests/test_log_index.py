@@ -0,0 +1,92 @@
+import datetime
+
+import seventeenlands.file_utils
+import seventeenlands.log_index
+
+_START_TIME = datetime.datetime(2024, 1, 1, 10, 0)
+_LINE_COUNT = 100
+
+
+def _write_log(path):
+    """Write a log with one entry a minute, returning the offset of each entry and of the end."""
+    offsets = []
+    content = b''
+    for i in range(_LINE_COUNT):
+        offsets.append(len(content))
+        content += f'[UnityCrossThreadLogger]entry {i:04} {"x" * 60}\n'.encode()
+    offsets.append(len(content))
+    path.write_bytes(content)
+    return offsets
+
+
+def _build_index(log_path, folder, offsets):
+    with open(log_path, 'rb') as f:
+        key = seventeenlands.file_utils.FileIdentity(f).get_index_key()
+        index = seventeenlands.log_index.LogIndex.load(key, f, folder)
+        for i, (offset, end_offset) in enumerate(zip(offsets, offsets[1:])):
+            index.add_entry(_START_TIME + datetime.timedelta(minutes=i), offset, end_offset, 'PLAYER')
+            if 10 <= i < 20:
+                index.mark_range(seventeenlands.log_index.MATCH, 'match-1', offset, end_offset, 'PLAYER')
+        index.save(f, force=True)
+    return index
+
+
+def test_saved_index_is_loaded(tmp_path):
+    log_path = tmp_path / 'Player.log'
+    offsets = _write_log(log_path)
+    _build_index(log_path, str(tmp_path), offsets)
+
+    index = seventeenlands.log_index.load_for_file(str(log_path), str(tmp_path))
+    assert index.indexed_offset == log_path.stat().st_size
+    match_range = index.get_range(seventeenlands.log_index.MATCH, 'match-1')
+    assert (match_range.start_offset, match_range.end_offset, match_range.player_id) == (offsets[10], offsets[20], 'PLAYER')
+    time_range = index.get_time_range(
+        _START_TIME + datetime.timedelta(minutes=30),
+        _START_TIME + datetime.timedelta(minutes=40),
+    )
+    assert (time_range.start_offset, time_range.end_offset) == (offsets[30], offsets[41])
+
+
+def test_index_past_end_of_truncated_log_is_rebuilt(tmp_path):
+    log_path = tmp_path / 'Player.log'
+    offsets = _write_log(log_path)
+    _build_index(log_path, str(tmp_path), offsets)
+    with open(log_path, 'r+b') as f:
+        f.truncate(offsets[_LINE_COUNT // 2])
+
+    index = seventeenlands.log_index.load_for_file(str(log_path), str(tmp_path))
+    assert index.indexed_offset == 0
+    assert index.get_range(seventeenlands.log_index.MATCH, 'match-1') is None
+
+
+def test_index_of_changed_log_is_rebuilt(tmp_path):
+    log_path = tmp_path / 'Player.log'
+    offsets = _write_log(log_path)
+    _build_index(log_path, str(tmp_path), offsets)
+    # Same size and start, but different content at the last time point
+    with open(log_path, 'r+b') as f:
+        f.seek(offsets[-2])
+        f.write(b'[UnityCrossThreadLogger]changed')
+
+    index = seventeenlands.log_index.load_for_file(str(log_path), str(tmp_path))
+    assert index.indexed_offset == 0
+
+    _build_index(log_path, str(tmp_path), offsets)
+    index = seventeenlands.log_index.load_for_file(str(log_path), str(tmp_path))
+    assert index.indexed_offset == log_path.stat().st_size
+
+
+def test_unreadable_index_is_ignored(tmp_path):
+    log_path = tmp_path / 'Player.log'
+    offsets = _write_log(log_path)
+    index = _build_index(log_path, str(tmp_path), offsets)
+    with open(index.path, 'w') as f:
+        f.write('{not json')
+
+    assert seventeenlands.log_index.load_for_file(str(log_path), str(tmp_path)).indexed_offset == 0
+
+
+def test_log_too_short_to_fingerprint_has_no_index(tmp_path):
+    log_path = tmp_path / 'Player.log'
+    log_path.write_bytes(b'[UnityCrossThreadLogger]short\n')
+    assert seventeenlands.log_index.load_for_file(str(log_path), str(tmp_path)) is None
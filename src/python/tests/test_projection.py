@@ -0,0 +1,75 @@
+import json
+
+import seventeenlands.mtga_follower
+import seventeenlands.projection
+import seventeenlands.sinks
+
+_DRAFT_PACK = {
+    'DraftStatus': 'PickNext',
+    'EventName': 'QuickDraft',
+    'PackNumber': 0,
+    'PickNumber': 1,
+    'DraftPack': ['101', '102'],
+    'PickedCards': ['100'],
+}
+
+
+class _ListSink(seventeenlands.sinks.Sink):
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append((event.kind, dict(event.blob)))
+
+
+def _parse_draft_pack(tmp_path, projection):
+    filename = str(tmp_path / 'Player.log')
+    with open(filename, 'w') as f:
+        f.write('DETAILED LOGS: ENABLED\n')
+        f.write(f'[UnityCrossThreadLogger]2024-01-01 10:00:00: <== BotDraft_DraftStatus\n{json.dumps(_DRAFT_PACK)}\n')
+
+    sink = _ListSink()
+    follower = seventeenlands.mtga_follower.Follower(
+        token='token',
+        host='http://localhost',
+        sinks=[sink],
+        use_index=False,
+        projection=projection,
+    )
+    follower.parse_log(filename=filename, follow=False)
+    follower.close()
+    [(kind, blob)] = sink.events
+    assert kind == 'draft_pack'
+    return blob
+
+
+def test_full_payloads_are_sent_by_default(tmp_path):
+    blob = _parse_draft_pack(tmp_path, seventeenlands.projection.FULL_PAYLOADS)
+    assert blob['payload'] == _DRAFT_PACK
+    assert blob['card_ids'] == [101, 102]
+
+
+def test_trimmed_payloads_drop_duplicated_fields(tmp_path):
+    blob = _parse_draft_pack(tmp_path, seventeenlands.projection.TRIMMED_PAYLOADS)
+    assert blob['payload'] == {'DraftStatus': 'PickNext', 'PickedCards': ['100']}
+    assert (blob['event_name'], blob['pack_number'], blob['pick_number'], blob['card_ids']) == ('QuickDraft', 0, 1, [101, 102])
+
+
+def test_trimming_copies_rather_than_modifies():
+    projection = seventeenlands.projection.Projection(
+        event_fields={'deck_submission': ('payload.Deck.MainDeck',)},
+        gre_message_fields={'GREMessageType_GameStateMessage': ('gameStateMessage.timers',)},
+    )
+    deck = {'MainDeck': [1, 2], 'Sideboard': [3]}
+    blob = {'payload': {'Deck': deck, 'EventName': 'QuickDraft'}, 'event_name': 'QuickDraft'}
+    assert projection.project_event('deck_submission', blob) == {
+        'payload': {'Deck': {'Sideboard': [3]}, 'EventName': 'QuickDraft'},
+        'event_name': 'QuickDraft',
+    }
+    assert deck == {'MainDeck': [1, 2], 'Sideboard': [3]}
+    # Kinds without a projection are passed through as they are
+    assert projection.project_event('game_result', blob) is blob
+
+    message = {'type': 'GREMessageType_GameStateMessage', 'gameStateMessage': {'timers': [1], 'turnInfo': {}}}
+    assert projection.project_gre_message(message) == {'type': 'GREMessageType_GameStateMessage', 'gameStateMessage': {'turnInfo': {}}}
+    assert message['gameStateMessage'] == {'timers': [1], 'turnInfo': {}}
@@ -0,0 +1,41 @@
+import json
+
+import seventeenlands.records
+
+
+def _envelope():
+    return seventeenlands.records.Envelope(
+        token='token',
+        client_version='1.0',
+        player_id='PLAYER',
+        time='2024-01-01T10:00:00',
+        utc_time='2024-01-01T10:00:00',
+        event_time=None,
+        raw_time='1/1/2024 10:00:00 AM',
+    )
+
+
+def _assert_serializes_like_dict(record):
+    serialized = record.serialize()
+    assert json.loads(serialized) == record.to_dict()
+    assert serialized == json.dumps(record.to_dict()).encode('utf8')
+
+
+def test_serialize_matches_dict():
+    record = seventeenlands.records.DraftPick(
+        _envelope(),
+        event_name='PremierDraft',
+        pack_number=1,
+        pick_number=2,
+        card_id=3,
+        card_ids=[3, 4],
+    )
+    _assert_serializes_like_dict(record)
+    _assert_serializes_like_dict(record.replace(card_ids=seventeenlands.records.OMITTED))
+
+
+def test_serialize_with_every_field_omitted():
+    record = seventeenlands.records.Inventory(_envelope())
+    assert len(record) == len(seventeenlands.records.Envelope.FIELDS)
+    assert 'inventory' not in record
+    _assert_serializes_like_dict(record)
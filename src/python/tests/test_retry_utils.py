@@ -0,0 +1,95 @@
+import datetime
+
+import seventeenlands.clock_utils
+import seventeenlands.retry_utils
+
+
+def _circuit_breaker(clock):
+    return seventeenlands.retry_utils.CircuitBreaker(
+        name='test',
+        failure_threshold=2,
+        initial_open_duration=datetime.timedelta(seconds=30),
+        max_open_duration=datetime.timedelta(seconds=120),
+        clock=clock,
+    )
+
+
+def test_waiting_on_open_circuit_advances_virtual_clock():
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=0)
+    circuit_breaker = _circuit_breaker(clock)
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == circuit_breaker.OPEN
+
+    assert circuit_breaker.wait_until_allowed()
+    assert circuit_breaker.state == circuit_breaker.HALF_OPEN
+    # The jittered open period is between half and all of the initial duration
+    assert 15 <= clock.monotonic() <= 30
+
+
+def test_circuit_opens_after_consecutive_failures():
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=0)
+    circuit_breaker = _circuit_breaker(clock)
+    circuit_breaker.record_failure()
+    circuit_breaker.record_success()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == circuit_breaker.CLOSED
+    assert circuit_breaker.wait_until_allowed(timeout=0)
+
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == circuit_breaker.OPEN
+    assert not circuit_breaker.wait_until_allowed(timeout=0)
+    assert 15 <= circuit_breaker.get_wait_time() <= 30
+
+
+def test_half_open_circuit_lets_one_probe_through():
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=0)
+    circuit_breaker = _circuit_breaker(clock)
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    clock.sleep(30)
+
+    assert circuit_breaker.wait_until_allowed(timeout=0)
+    assert circuit_breaker.state == circuit_breaker.HALF_OPEN
+    assert not circuit_breaker.wait_until_allowed(timeout=0)
+    assert circuit_breaker.get_wait_time() > 0
+
+    # A probe given up without an outcome lets another caller probe
+    circuit_breaker.release()
+    assert circuit_breaker.wait_until_allowed(timeout=0)
+    circuit_breaker.record_success()
+    assert circuit_breaker.state == circuit_breaker.CLOSED
+    assert circuit_breaker.get_wait_time() == 0
+
+
+def test_failed_probe_reopens_circuit_for_longer():
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=0)
+    circuit_breaker = _circuit_breaker(clock)
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+
+    for open_duration in (60, 120, 120):
+        clock.sleep(circuit_breaker.get_wait_time())
+        assert circuit_breaker.wait_until_allowed(timeout=0)
+        circuit_breaker.record_failure()
+        assert circuit_breaker.state == circuit_breaker.OPEN
+        assert open_duration / 2 <= circuit_breaker.get_wait_time() <= open_duration
+
+    # Success resets the open period for the next time the circuit opens
+    clock.sleep(circuit_breaker.get_wait_time())
+    assert circuit_breaker.wait_until_allowed(timeout=0)
+    circuit_breaker.record_success()
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    assert 15 <= circuit_breaker.get_wait_time() <= 30
+
+
+def test_wait_on_open_circuit_is_bounded_by_timeout():
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=0)
+    circuit_breaker = _circuit_breaker(clock)
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+
+    assert not circuit_breaker.wait_until_allowed(timeout=5)
+    assert clock.monotonic() == 5
+    assert circuit_breaker.state == circuit_breaker.OPEN
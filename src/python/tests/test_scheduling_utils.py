@@ -0,0 +1,135 @@
+import threading
+
+import seventeenlands.clock_utils
+import seventeenlands.scheduling_utils
+
+
+class _Gate:
+    """Holds all work until opened."""
+
+    def __init__(self):
+        self.is_open = False
+
+    def __call__(self):
+        return 0 if self.is_open else 60
+
+
+def _priority_class(priority, **kwargs):
+    return seventeenlands.scheduling_utils.PriorityClass(priority=priority, requests_per_second=1000, burst=1000, **kwargs)
+
+
+def _scheduler(priority_classes, clock=seventeenlands.clock_utils.SYSTEM_CLOCK, **kwargs):
+    gate = _Gate()
+    scheduler = seventeenlands.scheduling_utils.PriorityScheduler(
+        name='test',
+        priority_classes=priority_classes,
+        max_requests_per_second=1000,
+        gate=gate,
+        clock=clock,
+        **kwargs,
+    )
+    return scheduler, gate
+
+
+def _open(scheduler, gate, ran):
+    """Open the gate and wake the worker with a last, least urgent item."""
+    gate.is_open = True
+    scheduler.submit('low', lambda: ran.append('last'))
+    assert scheduler.flush(timeout=5)
+
+
+def test_runs_most_urgent_class_first():
+    ran = []
+    scheduler, gate = _scheduler({'high': _priority_class(0), 'low': _priority_class(1)})
+    for name in ('low-1', 'high-1', 'low-2', 'high-2'):
+        scheduler.submit(name.split('-')[0], lambda name=name: ran.append(name))
+
+    _open(scheduler, gate, ran)
+    assert ran == ['high-1', 'high-2', 'low-1', 'low-2', 'last']
+
+
+def test_coalesced_work_replaces_pending_work_in_place():
+    ran = []
+    discarded = []
+    scheduler, gate = _scheduler(
+        {'high': _priority_class(0), 'low': _priority_class(1)},
+        on_discard=discarded.append,
+    )
+    first = lambda: ran.append('first')
+    scheduler.submit('low', first, coalesce_key='key')
+    scheduler.submit('low', lambda: ran.append('other'))
+    assert not scheduler.submit('low', lambda: ran.append('second'), coalesce_key='key')
+
+    _open(scheduler, gate, ran)
+    assert ran == ['second', 'other', 'last']
+    assert discarded == [first]
+
+
+def test_full_droppable_class_drops_oldest():
+    ran = []
+    discarded = []
+    scheduler, gate = _scheduler(
+        {'high': _priority_class(0), 'low': _priority_class(1, max_pending=2, drop_when_full=True)},
+        on_discard=discarded.append,
+    )
+    callbacks = [lambda i=i: ran.append(i) for i in range(4)]
+    for callback in callbacks:
+        scheduler.submit('low', callback)
+
+    assert discarded == callbacks[:2]
+    assert scheduler.dropped_count == 2
+    _open(scheduler, gate, ran)
+    # The class is still full when the marker is submitted, so the oldest is dropped again
+    assert ran == [3, 'last']
+
+
+def test_full_class_blocks_until_there_is_room():
+    ran = []
+    scheduler, gate = _scheduler({'high': _priority_class(0, max_pending=2), 'low': _priority_class(1)})
+    scheduler.submit('high', lambda: ran.append(0))
+    scheduler.submit('high', lambda: ran.append(1))
+
+    submitter = threading.Thread(target=lambda: scheduler.submit('high', lambda: ran.append(2)))
+    submitter.start()
+    submitter.join(timeout=0.2)
+    assert submitter.is_alive()
+
+    _open(scheduler, gate, ran)
+    submitter.join(timeout=5)
+    assert not submitter.is_alive()
+    assert scheduler.flush(timeout=5)
+    assert set(ran) == {0, 1, 2, 'last'}
+    assert scheduler.dropped_count == 0
+
+
+def test_overall_bound_drops_only_droppable_work():
+    discarded = []
+    scheduler, gate = _scheduler(
+        {'high': _priority_class(0), 'low': _priority_class(1, drop_when_full=True)},
+        max_pending=3,
+        on_discard=discarded.append,
+    )
+    low = lambda: None
+    scheduler.submit('low', low)
+    for _ in range(3):
+        scheduler.submit('high', lambda: None)
+
+    assert discarded == [low]
+    assert scheduler.get_pending_count() == 3
+    gate.is_open = True
+    assert scheduler.flush(timeout=5)
+
+
+def test_delayed_work_runs_when_due_ahead_of_its_class():
+    ran = []
+    clock = seventeenlands.clock_utils.VirtualClock(start_time=0)
+    scheduler, gate = _scheduler({'high': _priority_class(0), 'low': _priority_class(1)}, clock=clock)
+    gate.is_open = True
+    scheduler.submit('low', lambda: ran.append('retry'), delay=10)
+    assert not scheduler.flush(timeout=0.2)
+    assert ran == []
+
+    clock.sleep(10)
+    scheduler.submit('low', lambda: ran.append('new'))
+    assert scheduler.flush(timeout=5)
+    assert ran == ['retry', 'new']
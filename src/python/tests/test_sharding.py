@@ -0,0 +1,79 @@
+import json
+
+import seventeenlands.mtga_follower
+import seventeenlands.sharding
+import seventeenlands.sinks
+
+_FOLLOWER_OPTIONS = dict(token='token', host='http://localhost')
+
+
+class _ListSink(seventeenlands.sinks.Sink):
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append((event.kind, dict(event.blob)))
+
+
+def _entry(time, header, blob):
+    return f'[UnityCrossThreadLogger]{time}: {header}\n{json.dumps(blob)}\n'
+
+
+def _session(index):
+    """A log in, rank info, one match and a log out."""
+    player_id = f'PLAYER{index}'
+    time = f'2024-01-0{index + 1} 10:00'
+    match_id = f'match-{index}'
+    reserved_players = [
+        {'systemSeatId': 1, 'playerName': f'Player{index}#1', 'userId': player_id, 'eventId': 'Ladder'},
+        {'systemSeatId': 2, 'playerName': 'Opponent#2', 'userId': 'OPPONENT', 'eventId': 'Ladder'},
+    ]
+    result_list = [
+        {'scope': 'MatchScope_Game', 'winningTeamId': 1, 'result': 'ResultType_WinLoss', 'reason': 'R'},
+        {'scope': 'MatchScope_Match', 'winningTeamId': 1, 'result': 'ResultType_WinLoss', 'reason': 'R'},
+    ]
+    return ''.join([
+        f'[UnityCrossThreadLogger]Updated account. DisplayName:Player{index}#1, AccountID:{player_id}, Token:x\n',
+        _entry(f'{time}:00', '<== Rank_GetCombinedRankInfo(1)', {'playerId': player_id, 'limitedSeasonOrdinal': 1, 'limitedClass': f'Class{index}'}),
+        _entry(f'{time}:01', 'matchGameRoomStateChangedEvent', {'matchGameRoomStateChangedEvent': {'gameRoomInfo': {
+            'gameRoomConfig': {'matchId': match_id, 'eventId': 'Ladder', 'reservedPlayers': reserved_players},
+        }}}),
+        _entry(f'{time}:02', 'matchGameRoomStateChangedEvent', {'matchGameRoomStateChangedEvent': {'gameRoomInfo': {
+            'gameRoomConfig': {'matchId': match_id, 'eventId': 'Ladder'},
+            'finalMatchResult': {'resultList': result_list},
+        }}}),
+        # Untimed, so the follower keeps the log time of the previous entry
+        '[UnityCrossThreadLogger]==> Event_GetCourses\n{"Courses": []}\n',
+        f'[UnityCrossThreadLogger]{time}:03: FrontDoorConnection.Close {{}}\n',
+    ])
+
+
+def _parse_serially(filename):
+    sink = _ListSink()
+    follower = seventeenlands.mtga_follower.Follower(sinks=[sink], use_index=False, **_FOLLOWER_OPTIONS)
+    follower.parse_log(filename=filename, follow=False)
+    follower.close()
+    return sink.events
+
+
+def test_multi_session_log_is_not_reparsed(tmp_path):
+    filename = str(tmp_path / 'Player.log')
+    with open(filename, 'w') as f:
+        f.write('DETAILED LOGS: ENABLED\n')
+        for index in range(6):
+            f.write(_session(index))
+
+    sink = _ListSink()
+    follower = seventeenlands.mtga_follower.Follower(sinks=[sink], use_index=False, **_FOLLOWER_OPTIONS)
+    reparsed_count = seventeenlands.sharding.parse_sharded(
+        follower,
+        filename,
+        workers=2,
+        follower_options=_FOLLOWER_OPTIONS,
+        min_shard_size=1,
+    )
+    follower.close()
+
+    assert len(seventeenlands.sharding.find_boundaries(filename)) > 6
+    assert reparsed_count == 0
+    assert sink.events == _parse_serially(filename)